@@ -0,0 +1,33 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import User
+
+
+@database_sync_to_async
+def get_user_for_token(raw_token):
+    try:
+        user_id = AccessToken(raw_token)['user_id']
+        return User.objects.get(id=user_id, is_active=True)
+    except (TokenError, KeyError, User.DoesNotExist):
+        return AnonymousUser()
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Authenticate WebSocket connections with a JWT access token
+
+    Browsers can't set headers on WebSocket requests, so the token is read
+    from the ``token`` query parameter: ``ws/payments/<id>/?token=<access>``.
+    """
+
+    async def __call__(self, scope, receive, send):
+        params = parse_qs(scope.get('query_string', b'').decode())
+        token = params.get('token', [None])[0]
+        scope['user'] = await get_user_for_token(token) if token else AnonymousUser()
+        return await super().__call__(scope, receive, send)
@@ -3,8 +3,13 @@ from django.db import models
 from django.utils.translation import gettext_lazy as _
 
 class User(AbstractUser):
+    # Sizes of avatar generated for clients (core/images.py)
+    AVATAR_VARIANTS = ('thumb', 'card')
+
     email = models.EmailField(_('email address'), unique=True)
     avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)
+    # Resized copies of avatar, see core/images.py
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
     
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
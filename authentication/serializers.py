@@ -2,19 +2,24 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from .models import EventPlanner, Notification
 from django.contrib.auth.password_validation import validate_password
+from core.images import ImageVariantsField
 
 User = get_user_model()
 
 class UserSerializer(serializers.ModelSerializer):
+    avatarVariants = ImageVariantsField(names=User.AVATAR_VARIANTS, source='avatar_variants')
+
     class Meta:
         model = User
-        fields = ['id', 'email', 'first_name', 'last_name', 'avatar']
+        fields = ['id', 'email', 'first_name', 'last_name', 'avatar', 'avatarVariants']
         read_only_fields = ['id']
 
 class UserDetailSerializer(serializers.ModelSerializer):
+    avatarVariants = ImageVariantsField(names=User.AVATAR_VARIANTS, source='avatar_variants')
+
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'avatar',
+        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'avatar', 'avatarVariants',
                   'is_staff', 'date_joined', 'last_login']
         read_only_fields = ['id', 'date_joined', 'last_login']
 
@@ -0,0 +1,10 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from core.images import schedule_variants
+from .models import User
+
+
+@receiver(post_save, sender=User)
+def make_avatar_variants(sender, instance, **kwargs):
+    schedule_variants(instance, 'avatar', 'avatar_variants', User.AVATAR_VARIANTS)
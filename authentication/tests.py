@@ -1,3 +1,18 @@
 from django.test import TestCase
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from .models import EventPlanner, User
+
+
+class EventPlannerListTests(TestCase):
+    def test_planners_are_listed_without_pagination(self):
+        admin = User.objects.create_user(email='admin@example.com', username='admin', password='pass1234', is_staff=True)
+        planner_user = User.objects.create_user(email='planner@example.com', username='planner', password='pass1234')
+        planner = EventPlanner.objects.create(user=planner_user, phone='0700000000', national_id='123')
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        response = client.get('/api/auth/planners/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()], [planner.pk])
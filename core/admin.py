@@ -17,8 +17,12 @@ class SiteSettingAdmin(admin.ModelAdmin):
     )
     
     def has_add_permission(self, request):
-        # Prevent creating multiple settings objects
-        return SiteSetting.objects.count() == 0
+        # Singleton: the row is created on first use, see changelist_view
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        SiteSetting.get_settings()
+        return super().changelist_view(request, extra_context)
         
     def has_delete_permission(self, request, obj=None):
         # Prevent deleting the settings object
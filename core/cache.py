@@ -0,0 +1,145 @@
+"""
+Shared caching helpers.
+
+Cached data is grouped into namespaces (e.g. 'events'). Every key embeds the
+namespace's current generation, so invalidating a namespace is a single
+counter bump; entries from older generations are simply never read again and
+expire on their own.
+
+``cache_response`` uses this to cache anonymous GET responses keyed on the
+normalized query string, with ETag/If-None-Match support and
+stale-while-revalidate: once an entry goes stale one request recomputes it
+while concurrent requests keep being served the stale copy.
+"""
+from functools import wraps
+from urllib.parse import urlencode
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def _generation_key(namespace):
+    return f'generation:{namespace}'
+
+
+def get_generation(namespace):
+    """Return the current generation of a cache namespace"""
+    key = _generation_key(namespace)
+    generation = cache.get(key)
+    if generation is None:
+        # Seed from the clock so an evicted counter never reuses old keys
+        cache.add(key, int(time.time() * 1000), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(namespace):
+    """Invalidate everything cached under a namespace"""
+    try:
+        cache.incr(_generation_key(namespace))
+    except ValueError:
+        get_generation(namespace)
+
+
+def _normalized_query(request):
+    params = []
+    for name in sorted(request.query_params):
+        for value in sorted(request.query_params.getlist(name)):
+            if value != '':
+                params.append((name, value))
+    return urlencode(params)
+
+
+def response_cache_key(namespace, request):
+    """
+    Cache key for a request: namespace generation + origin + path + normalized query
+
+    The origin is part of the key because cached bodies hold absolute URLs
+    (e.g. the pagination ``next`` link).
+    """
+    raw = f'{request.scheme}://{request.get_host()}{request.path}?{_normalized_query(request)}'
+    digest = hashlib.sha256(raw.encode()).hexdigest()
+    return f'response:{namespace}:{get_generation(namespace)}:{digest}'
+
+
+def _etag(data):
+    body = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True)
+    return '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+
+
+def _etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH', '')
+    candidates = [tag.strip() for tag in header.split(',')]
+    return etag in candidates or '*' in candidates
+
+
+def _build_response(request, entry, cache_status):
+    if _etag_matches(request, entry['etag']):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(entry['data'])
+    response['ETag'] = entry['etag']
+    response['Cache-Control'] = (
+        f"public, max-age={settings.RESPONSE_CACHE_TIMEOUT}, "
+        f"stale-while-revalidate={settings.RESPONSE_CACHE_STALE_TIMEOUT}"
+    )
+    response['X-Cache'] = cache_status
+    patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+def cache_response(namespace):
+    """
+    Cache anonymous GET responses of a view method
+
+    Authenticated requests bypass the cache, since their payloads can be
+    user-specific (e.g. favorites).
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(view, request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated:
+                return view_method(view, request, *args, **kwargs)
+
+            key = response_cache_key(namespace, request)
+            lock_key = f'{key}:refresh'
+            entry = cache.get(key)
+            now = time.time()
+
+            locked = False
+            if entry is not None:
+                if now < entry['fresh_until']:
+                    return _build_response(request, entry, 'HIT')
+                # Stale: one request revalidates, the rest keep getting the stale copy
+                if not cache.add(lock_key, 1, settings.RESPONSE_CACHE_REFRESH_LOCK_TIMEOUT):
+                    return _build_response(request, entry, 'STALE')
+                locked = True
+
+            try:
+                response = view_method(view, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+
+                entry = {
+                    'data': response.data,
+                    'etag': _etag(response.data),
+                    'fresh_until': now + settings.RESPONSE_CACHE_TIMEOUT,
+                }
+                cache.set(
+                    key, entry,
+                    settings.RESPONSE_CACHE_TIMEOUT + settings.RESPONSE_CACHE_STALE_TIMEOUT,
+                )
+            finally:
+                # Released even when the view raises, or the next refresh waits out the timeout
+                if locked:
+                    cache.delete(lock_key)
+            return _build_response(request, entry, 'MISS')
+        return wrapper
+    return decorator
@@ -0,0 +1,77 @@
+"""
+Query plan checks.
+
+``full_scans(sql)`` asks the database how it would run a statement and
+returns the tables it would read row by row without an index. The index
+tests run the hot endpoints, capture their SQL and fail if any of it scans a
+table that should be reached through an index, so a dropped index or a query
+rewritten into an unindexable shape shows up in CI rather than in production.
+
+Only SQLite and PostgreSQL plans are understood. On PostgreSQL sequential
+scans are disabled for the check, as the planner rightly prefers them on the
+tiny tables of a test database; a Seq Scan that remains means no index fits.
+"""
+import json
+import re
+
+from django.db import connections
+
+# Django aliases tables in subqueries: FROM "events_eventdate" U0
+_ALIAS = re.compile(r'"(\w+)" ([A-Z]\d+)\b')
+
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE')
+
+
+def full_scans(sql, params=None, using='default'):
+    """Tables the database would scan without an index to run ``sql``"""
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return []
+    connection = connections[using]
+    aliases = {alias: table for table, alias in _ALIAS.findall(sql)}
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            tables = _sqlite_scans(row[-1] for row in cursor.fetchall())
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            try:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plan = cursor.fetchone()[0]
+            finally:
+                cursor.execute('RESET enable_seqscan')
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            tables = _postgres_scans(plan[0]['Plan'])
+        else:
+            raise NotImplementedError(f'Query plans of {connection.vendor} are not supported')
+    return [aliases.get(table, table) for table in tables]
+
+
+def _sqlite_scans(details):
+    # "SCAN t" reads every row; "SCAN t USING [COVERING] INDEX i" walks an
+    # index in order (how a paginated listing is sorted) and SEARCH seeks one
+    tables = []
+    for detail in details:
+        match = re.match(r'SCAN (\w+)(?: AS \w+)?$', detail)
+        if match and match.group(1) != 'CONSTANT':
+            tables.append(match.group(1))
+    return tables
+
+
+def _postgres_scans(node):
+    tables = [node['Alias']] if node['Node Type'] == 'Seq Scan' else []
+    for child in node.get('Plans', []):
+        tables.extend(_postgres_scans(child))
+    return tables
+
+
+def captured_full_scans(queries, tables, using='default'):
+    """
+    Full scans of any of ``tables`` among queries captured by
+    CaptureQueriesContext, as (table, sql) pairs
+    """
+    return [
+        (table, query['sql'])
+        for query in queries
+        for table in full_scans(query['sql'], using=using)
+        if table in tables
+    ]
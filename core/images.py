@@ -0,0 +1,220 @@
+"""
+Resized image variants.
+
+Uploaded images (Event.image, User.avatar) are kept as uploaded, and
+smaller variants are generated in the background once the upload is
+committed:
+
+* thumb: 160x160, cropped to fill
+* card: 640x360, cropped to fill
+* hero: 1600x900 at most, never cropped
+
+Each variant is written as WebP and JPEG, and never upscaled. File names
+are derived from the SHA-256 of the original
+(``<upload dir>/variants/<hash>-<variant>.<ext>``): they are immutable and
+can be cached forever, and re-uploading the same picture reuses the files.
+The content-addressed storage (core/storage.py) names them after the hash
+of each variant instead, to the same effect.
+
+Where the variants are is kept in a JSON column next to the image field,
+e.g. Event.image_variants:
+``{"source": <image name>, "card": {"width": 640, "height": 360,
+"webp": <name>, "jpeg": <name>}, ...}``. Serializers turn it into URLs with
+ImageVariantsField, so list endpoints can ship a small variant instead of
+the original. Until the variants exist, the original is served.
+
+Variants are produced on a pool of IMAGE_WORKERS threads per process
+(inline when 0). The map is written with a conditional UPDATE, so a slow
+worker never overwrites the variants of a newer upload. Images whose
+variants were lost, e.g. to a restart, are picked up by
+``manage.py generate_image_variants``.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import logging
+import posixpath
+import threading
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.dispatch import Signal
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+# Variant -> (width, height, crop to fill)
+VARIANTS = {
+    'thumb': (160, 160, True),
+    'card': (640, 360, True),
+    'hero': (1600, 900, False),
+}
+
+# Extension -> (Pillow format, save options)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Sent with pk=<row> once a row's variants are stored, e.g. to invalidate caches
+variants_generated = Signal()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _resize(image, width, height, crop):
+    if crop:
+        # Never upscale: shrink the box until it fits inside the original
+        scale = min(1, image.width / width, image.height / height)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+    resized = image.copy()
+    resized.thumbnail((width, height), Image.Resampling.LANCZOS)
+    return resized
+
+
+def _encode(image, extension):
+    image_format, options = FORMATS[extension]
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def render_variants(data, names):
+    """Resize image bytes; returns {variant: (width, height, {extension: bytes})}"""
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    rendered = {}
+    for name in names:
+        resized = _resize(image, *VARIANTS[name])
+        rendered[name] = (resized.width, resized.height, {ext: _encode(resized, ext) for ext in FORMATS})
+    return rendered
+
+
+def build_variants(field_file, names):
+    """Write the variants of an image file; returns the map stored next to the field"""
+    storage = field_file.storage
+    field_file.open('rb')
+    try:
+        data = field_file.read()
+    finally:
+        field_file.close()
+
+    digest = hashlib.sha256(data).hexdigest()[:20]
+    directory = posixpath.join(posixpath.dirname(field_file.name), 'variants')
+    variants = {'source': field_file.name}
+    for name, (width, height, encoded) in render_variants(data, names).items():
+        variant = {'width': width, 'height': height}
+        for extension, content in encoded.items():
+            path = posixpath.join(directory, f'{digest}-{name}.{extension}')
+            # Content-addressed: an existing file already holds these bytes
+            if not storage.exists(path):
+                path = storage.save(path, ContentFile(content))
+            variant[extension] = path
+        variants[name] = variant
+    return variants
+
+
+def generate_variants(model, pk, field, variants_field, names):
+    """Build and store the variants of one row's image; returns the map or None"""
+    instance = model.objects.filter(pk=pk).first()
+    field_file = getattr(instance, field, None)
+    if not field_file:
+        return None
+    try:
+        variants = build_variants(field_file, names)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+        logger.warning(f"Could not make variants of {field_file.name}: {str(e)}")
+        return None
+    # Only if the row still has this image; a newer upload has its own job
+    if model.objects.filter(pk=pk, **{field: field_file.name}).update(**{variants_field: variants}):
+        variants_generated.send(sender=model, pk=pk)
+    return variants
+
+
+def _run_in_thread(*args):
+    try:
+        return generate_variants(*args)
+    except Exception as e:
+        logger.error(f"Unexpected error making image variants: {str(e)}", exc_info=True)
+    finally:
+        connection.close()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS, thread_name_prefix='image-variants')
+        return _executor
+
+
+def needs_variants(instance, field, variants_field):
+    field_file = getattr(instance, field)
+    variants = getattr(instance, variants_field) or {}
+    return bool(field_file) and variants.get('source') != field_file.name
+
+
+def schedule_variants(instance, field, variants_field, names):
+    """
+    Queue variant generation after commit if the image changed; call from post_save
+
+    A removed image clears the map right away.
+    """
+    model = type(instance)
+    if not getattr(instance, field) and getattr(instance, variants_field):
+        model.objects.filter(pk=instance.pk).update(**{variants_field: {}})
+        setattr(instance, variants_field, {})
+        return
+    if not needs_variants(instance, field, variants_field):
+        return
+
+    args = (model, instance.pk, field, variants_field, tuple(names))
+    if settings.IMAGE_WORKERS > 0:
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, *args))
+    else:
+        transaction.on_commit(lambda: generate_variants(*args))
+
+
+def variant_urls(variants, names, request=None):
+    """{variant: {width, height, webp, jpeg}} with URLs, for the variants that exist"""
+    urls = {}
+    for name in names:
+        variant = (variants or {}).get(name)
+        if not variant:
+            continue
+        urls[name] = {'width': variant['width'], 'height': variant['height']}
+        for extension in FORMATS:
+            url = default_storage.url(variant[extension])
+            urls[name][extension] = request.build_absolute_uri(url) if request else url
+    return urls
+
+
+def preferred_url(field_file, variants, name, request=None):
+    """URL of a variant's JPEG, or of the original while the variants don't exist yet"""
+    variant = variant_urls(variants, [name], request).get(name)
+    if variant:
+        return variant['jpeg']
+    if not field_file:
+        return None
+    return request.build_absolute_uri(field_file.url) if request else field_file.url
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Serializes a variants map as URLs, limited to ``names``"""
+
+    def __init__(self, names=tuple(VARIANTS), **kwargs):
+        self.names = names
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return variant_urls(value, self.names, self.context.get('request'))
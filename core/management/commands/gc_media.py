@@ -0,0 +1,41 @@
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from core.storage import ContentAddressedStorage, referenced_names
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete stored media blobs that no image field or image variant references any more. '
+        'Blobs newer than --grace-hours are kept, as their rows may not be committed yet.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='Keep blobs saved or reused this recently (default: 24)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ContentAddressedStorage):
+            raise CommandError('The default storage is not content addressed')
+        cutoff = time.time() - options['grace_hours'] * 3600
+
+        # Old blobs first: anything saved or reused after the listing is kept
+        candidates = [(name, size) for name, size, modified in default_storage.blobs() if modified < cutoff]
+        referenced = referenced_names()
+        orphans = [(name, size) for name, size in candidates if name not in referenced]
+
+        if options['dry_run']:
+            freed = sum(size for _, size in orphans)
+            self.stdout.write(f'Would delete {len(orphans)} blobs, {freed} bytes')
+            return
+
+        deleted = freed = 0
+        for name, _ in orphans:
+            size = default_storage.delete_blob(name, older_than=cutoff)
+            if size is not None:
+                deleted += 1
+                freed += size
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unreferenced blobs, {freed} bytes freed'))
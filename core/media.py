@@ -0,0 +1,132 @@
+"""
+Serving uploaded media.
+
+Blobs of the content-addressed storage (core/storage.py) never change, so
+they are served with ``Cache-Control: public, max-age=<a year>, immutable``
+and their SHA-256 as a strong ETag: browsers and CDNs keep them without ever
+revalidating. Other files, saved under client names before that storage was
+used, get an ETag from their size and modification time and must be
+revalidated.
+
+Both honour If-None-Match / If-Modified-Since (304) and single byte range
+requests (206, with If-Range), so interrupted downloads of large files
+resume instead of restarting. Requests for several ranges get the whole
+file.
+"""
+import mimetypes
+import os
+import re
+
+from django.core.files.storage import default_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+
+from .storage import blob_digest
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, no-cache'
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive of a single byte range header, None to send the
+    whole file, or False if the range can't be satisfied
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        return False
+    if end < start:
+        return None
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        while length > 0:
+            chunk = handle.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _with_headers(response, etag, last_modified, cache_control):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = cache_control
+    response['Accept-Ranges'] = 'bytes'
+    # Uploads are served as their stored type, never as what a browser guesses
+    response['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+
+@require_safe
+def serve(request, path):
+    try:
+        full_path = default_storage.path(path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found')
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('Not found')
+    if not os.path.isfile(full_path) or os.path.basename(full_path).startswith('.'):
+        raise Http404('Not found')
+
+    digest = blob_digest(path)
+    if digest:
+        etag, cache_control = f'"{digest}"', IMMUTABLE_CACHE_CONTROL
+    else:
+        etag, cache_control = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"', REVALIDATE_CACHE_CONTROL
+    last_modified = int(stat.st_mtime)
+
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional is not None:
+        return _with_headers(conditional, etag, last_modified, cache_control)
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    size = stat.st_size
+
+    byte_range = None
+    if 'HTTP_RANGE' in request.META:
+        if_range = request.META.get('HTTP_IF_RANGE')
+        # A changed file (or a date validator, which isn't strong) gets the whole file
+        if not if_range or etag in parse_etags(if_range):
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return _with_headers(response, etag, last_modified, cache_control)
+
+    if byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _read_range(full_path, start, end - start + 1), status=206, content_type=content_type,
+        )
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return _with_headers(response, etag, last_modified, cache_control)
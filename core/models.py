@@ -30,3 +30,9 @@ class SiteSetting(models.Model):
         """Get or create site settings"""
         settings, created = cls.objects.get_or_create(pk=1)
         return settings
+
+    @classmethod
+    def current(cls):
+        """Cached, read-only site settings for hot paths (see core/site_settings.py)"""
+        from .site_settings import current
+        return current()
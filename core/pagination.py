@@ -0,0 +1,215 @@
+"""
+Keyset (cursor) pagination.
+
+A page is fetched with ``WHERE (sort key) > (last key of previous page)``
+instead of OFFSET, so page 10,000 costs the same as page 1 as long as an
+index covers the ordering. The ordering is whatever the view applied (sortBy,
+the ``ordering`` query param, search rank, distance, ...) with the primary key
+appended as a tie-breaker, which makes every key unique and pages stable
+while rows are inserted or deleted.
+
+The ``cursor`` query param is an opaque token holding the last row's sort key
+and a fingerprint of the ordering; ``page_size`` picks the page length (up
+to MAX_PAGE_SIZE). Responses look like ``{"next": <url or null>, "results":
+[...]}``. Only forward paging is offered, which is what infinite scrolling
+and exports need.
+"""
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import datetime
+import decimal
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, OrderBy, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = getattr(settings, 'API_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    max_page_size = MAX_PAGE_SIZE
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.keys = sort_keys(queryset)
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*[key.order_by() for key in self.keys])
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(after(self.keys, position))
+
+        # One extra row tells whether there is a next page
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        page = rows[:page_size]
+        self.next_position = [key.value_of(page[-1]) for key in self.keys] if self.has_next else None
+        return page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def _fingerprint(self):
+        ordering = ','.join(f"{'-' if key.descending else ''}{key.field}" for key in self.keys)
+        return hashlib.sha256(ordering.encode()).hexdigest()[:8]
+
+    def encode_cursor(self, position):
+        payload = json.dumps({'o': self._fingerprint(), 'p': position}, default=_encode_value)
+        return urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            payload = json.loads(urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            position = payload['p']
+            valid = payload['o'] == self._fingerprint() and len(position) == len(self.keys)
+        except (TypeError, ValueError, KeyError):
+            valid = False
+        if not valid:
+            # Malformed, tampered with, or made for a different sort order
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+
+class SortKey:
+    """One column of a keyset ordering"""
+
+    def __init__(self, field, descending=False, nullable=True):
+        self.field = field
+        self.descending = descending
+        self.nullable = nullable
+
+    def order_by(self):
+        expression = F(self.field)
+        if not self.nullable:
+            return expression.desc() if self.descending else expression.asc()
+        # NULLs always last, whatever the database's default
+        return expression.desc(nulls_last=True) if self.descending else expression.asc(nulls_last=True)
+
+    def value_of(self, obj):
+        value = obj
+        for part in self.field.split('__'):
+            value = getattr(value, part)
+        return value
+
+    def beyond(self, value):
+        """Rows whose value of this key sorts after ``value``"""
+        if value is None:
+            # NULLs sort last, nothing lies beyond them
+            return Q(pk__in=[])
+        condition = Q(**{f"{self.field}__{'lt' if self.descending else 'gt'}": value})
+        if self.nullable:
+            condition |= Q(**{f'{self.field}__isnull': True})
+        return condition
+
+    def not_before(self, value):
+        """Rows whose value of this key is ``value`` or sorts after it"""
+        if value is None:
+            return Q(**{f'{self.field}__isnull': True})
+        condition = Q(**{f"{self.field}__{'lte' if self.descending else 'gte'}": value})
+        if self.nullable:
+            condition |= Q(**{f'{self.field}__isnull': True})
+        return condition
+
+    def equal(self, value):
+        if value is None:
+            return Q(**{f'{self.field}__isnull': True})
+        return Q(**{self.field: value})
+
+
+def sort_keys(queryset):
+    """The queryset's ordering as SortKeys, ending with the primary key"""
+    model = queryset.model
+    ordering = queryset.query.order_by or queryset.query.get_meta().ordering or []
+    keys = []
+    for item in ordering:
+        if isinstance(item, OrderBy) and isinstance(item.expression, F):
+            field, descending = item.expression.name, item.descending
+        elif isinstance(item, str) and item != '?':
+            field, descending = item.lstrip('-'), item.startswith('-')
+        else:
+            raise ValueError(f'Keyset pagination cannot order by {item!r}')
+        if field in ('pk', model._meta.pk.name):
+            keys.append(SortKey('pk', descending, nullable=False))
+            return keys
+        keys.append(SortKey(field, descending, nullable=_is_nullable(model, field)))
+
+    # The primary key makes every position unique; follow the last key's direction
+    keys.append(SortKey('pk', keys[-1].descending if keys else False, nullable=False))
+    return keys
+
+
+def _is_nullable(model, path):
+    """Whether a field path can be NULL; annotations are assumed to be"""
+    *relations, name = path.split('__')
+    for relation in relations:
+        try:
+            field = model._meta.get_field(relation)
+        except FieldDoesNotExist:
+            return True
+        if field.null or not field.is_relation or field.related_model is None:
+            return True
+        model = field.related_model
+    try:
+        return model._meta.get_field(name).null
+    except FieldDoesNotExist:
+        return True
+
+
+def _encode_value(value):
+    # Full precision: DjangoJSONEncoder would cut datetimes to milliseconds,
+    # and the next page must start exactly after the last row
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    raise TypeError(f'Cannot use {type(value).__name__} in a cursor')
+
+
+def after(keys, position):
+    """Rows strictly after ``position`` in the ``keys`` ordering"""
+    # The redundant bound on the leading key lets the database seek the index
+    # to the position instead of evaluating the OR for every row before it
+    return keys[0].not_before(position[0]) & _after(keys, position)
+
+
+def _after(keys, position):
+    key, value = keys[0], position[0]
+    if len(keys) == 1:
+        return key.beyond(value)
+    return key.beyond(value) | (key.equal(value) & _after(keys[1:], position[1:]))
@@ -0,0 +1,15 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import site_settings
+from .models import SiteSetting
+
+
+@receiver(post_save, sender=SiteSetting)
+@receiver(post_delete, sender=SiteSetting)
+def invalidate_site_settings(sender, **kwargs):
+    """Processes serve SiteSetting from a local copy (core/site_settings.py)"""
+    site_settings.clear_local()
+    # After commit, so no process can reload and keep the old row
+    transaction.on_commit(site_settings.invalidate)
@@ -0,0 +1,90 @@
+"""
+Cached site settings.
+
+``SiteSetting.current()`` serves the settings row from a process-local copy,
+so hot paths such as the service fee on every purchase don't query the
+database. The copy is stamped with the 'site_settings' cache generation it
+was loaded under. Within SITE_SETTINGS_CACHE_TTL seconds it is used as is;
+after that the shared generation is compared (one cache read, no query) and
+the row is only reloaded if it changed. Saving a SiteSetting drops this
+process's copy and bumps the generation, so other processes pick up the
+change within the TTL.
+
+SiteSettingsSnapshotMiddleware pins the settings to the request: whatever is
+saved meanwhile, one request sees one version of them throughout.
+"""
+from contextvars import ContextVar
+import copy
+import time
+
+from django.conf import settings
+
+from .cache import bump_generation, get_generation
+
+NAMESPACE = 'site_settings'
+
+# (settings, generation, checked_at) of this process
+_cached = None
+
+# Outside a request there is nothing to pin to
+_OUTSIDE_REQUEST = object()
+_snapshot = ContextVar('site_settings_snapshot', default=_OUTSIDE_REQUEST)
+
+
+def _load():
+    global _cached
+    from .models import SiteSetting
+
+    now = time.monotonic()
+    cached = _cached
+    if cached is not None:
+        site_settings, generation, checked_at = cached
+        if now - checked_at < settings.SITE_SETTINGS_CACHE_TTL:
+            return site_settings
+        if get_generation(NAMESPACE) == generation:
+            _cached = (site_settings, generation, now)
+            return site_settings
+
+    # Read the generation first: a change saved while we load bumps it again
+    generation = get_generation(NAMESPACE)
+    site_settings = SiteSetting.get_settings()
+    _cached = (site_settings, generation, now)
+    return site_settings
+
+
+def current():
+    """The site settings, the same snapshot for the rest of the request; treat as read-only"""
+    snapshot = _snapshot.get()
+    if snapshot is not _OUTSIDE_REQUEST and snapshot is not None:
+        return snapshot
+
+    site_settings = _load()
+    if snapshot is None:
+        # A copy, so nothing the request does can leak into the shared one
+        site_settings = copy.copy(site_settings)
+        _snapshot.set(site_settings)
+    return site_settings
+
+
+def clear_local():
+    """Drop this process's copy; the next read goes to the database"""
+    global _cached
+    _cached = None
+
+
+def invalidate():
+    """Make every process reload the settings"""
+    clear_local()
+    bump_generation(NAMESPACE)
+
+
+class SiteSettingsSnapshotMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _snapshot.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            _snapshot.reset(token)
@@ -0,0 +1,153 @@
+"""
+Content-addressed media storage.
+
+Uploads are stored under the SHA-256 of their bytes rather than the client's
+file name: ``blobs/<first 2 hex digits>/<sha256>.<ext>``. The same picture
+uploaded for several events, as an avatar, or again on every edit of an
+event is kept once, and since a name always refers to the same bytes it can
+be served with an immutable Cache-Control and its hash as a strong ETag
+(core/media.py).
+
+The extension decides the Content-Type (and Content-Encoding) the file is
+served with, so it comes from the image format Pillow detects in the bytes,
+or else from the client's name only if it is in ALLOWED_EXTENSIONS; anything
+else is stored without one and served as application/octet-stream.
+
+A blob may be referenced by any number of rows, so deleting a field's file
+leaves the blob in place. Blobs no row references any more, including the
+image variants of core/images.py, are removed by ``manage.py gc_media``.
+Files saved before this storage was used keep their names and are served
+as before; gc_media never touches them.
+"""
+import hashlib
+import os
+import posixpath
+import uuid
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from PIL import Image, UnidentifiedImageError
+
+from .images import FORMATS
+
+BLOB_DIR = 'blobs'
+
+# Pillow format -> extension blobs of that format are stored with
+IMAGE_EXTENSIONS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'GIF': '.gif',
+    'WEBP': '.webp',
+}
+
+# Client extensions kept for content Pillow doesn't recognise
+ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+
+
+def blob_name(digest, extension=''):
+    return posixpath.join(BLOB_DIR, digest[:2], f'{digest}{extension}')
+
+
+def blob_extension(name, content):
+    """The extension to store ``content`` with, never one the client made up"""
+    try:
+        content.seek(0)
+        with Image.open(content) as image:
+            detected = IMAGE_EXTENSIONS.get(image.format)
+    except (UnidentifiedImageError, OSError, ValueError):
+        detected = None
+    finally:
+        content.seek(0)
+    if detected:
+        return detected
+    extension = posixpath.splitext(name)[1].lower()
+    return extension if extension in ALLOWED_EXTENSIONS else ''
+
+
+def is_blob(name):
+    return name.startswith(f'{BLOB_DIR}/')
+
+
+def blob_digest(name):
+    """The SHA-256 a blob name was derived from, or None for other files"""
+    if not is_blob(name):
+        return None
+    return posixpath.basename(name).split('.', 1)[0]
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that names every saved file after its content"""
+
+    def get_available_name(self, name, max_length=None):
+        # _save picks the real name, and an existing one is reused on purpose
+        return name
+
+    def _save(self, name, content):
+        sha256 = hashlib.sha256()
+        for chunk in content.chunks():
+            sha256.update(chunk if isinstance(chunk, bytes) else chunk.encode())
+        digest = sha256.hexdigest()
+
+        final_name = blob_name(digest, blob_extension(name, content))
+        if self.exists(final_name):
+            # Fresh again, so gc_media leaves it to the row about to reference it
+            os.utime(self.path(final_name))
+            return final_name
+
+        # Written aside and renamed, so concurrent saves of the same bytes
+        # never expose a partial blob
+        temporary = super()._save(posixpath.join(posixpath.dirname(final_name), f'.{uuid.uuid4().hex}.tmp'), content)
+        os.replace(self.path(temporary), self.path(final_name))
+        return final_name
+
+    def delete(self, name):
+        # Other rows may share the blob; gc_media removes it once unused
+        if not is_blob(name):
+            super().delete(name)
+
+    def delete_blob(self, name, older_than):
+        """Delete a blob unless it was saved or reused after ``older_than``; returns its size or None"""
+        try:
+            stat = os.stat(self.path(name))
+        except FileNotFoundError:
+            return None
+        if stat.st_mtime >= older_than:
+            return None
+        super().delete(name)
+        return stat.st_size
+
+    def blobs(self):
+        """Yield (name, size, modified timestamp) of every stored blob"""
+        root = self.path(BLOB_DIR)
+        for directory, _, files in os.walk(root):
+            for file_name in files:
+                path = os.path.join(directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                name = posixpath.join(BLOB_DIR, os.path.relpath(path, root).replace(os.sep, '/'))
+                yield name, stat.st_size, stat.st_mtime
+
+
+def referenced_names():
+    """
+    Every file name stored in a FileField, plus the files of the
+    ``<field>_variants`` map next to it (see core/images.py)
+    """
+    names = set()
+    for model in apps.get_models():
+        for field in model._meta.get_fields():
+            if not isinstance(field, models.FileField):
+                continue
+            variants_field = f'{field.name}_variants'
+            has_variants = any(other.name == variants_field for other in model._meta.get_fields())
+            columns = (field.name, variants_field) if has_variants else (field.name,)
+            rows = model._default_manager.exclude(**{field.name: ''}).exclude(**{f'{field.name}__isnull': True})
+            for row in rows.values_list(*columns).iterator():
+                names.add(row[0])
+                for variant in (row[1] or {}).values() if has_variants else ():
+                    if isinstance(variant, dict):
+                        names.update(variant[extension] for extension in FORMATS if extension in variant)
+    return names
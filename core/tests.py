@@ -1,3 +1,197 @@
-from django.test import TestCase
+from decimal import Decimal
+import io
+import os
+import shutil
+import tempfile
+import time
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from PIL import Image
+
+from . import media, site_settings
+from .models import SiteSetting
+
+
+class SiteSettingCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        site_settings.clear_local()
+        self.addCleanup(site_settings.clear_local)
+
+    def update(self, **fields):
+        row = SiteSetting.get_settings()
+        for name, value in fields.items():
+            setattr(row, name, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            row.save()
+
+    def test_hot_path_reads_no_database(self):
+        self.update(service_fee_enabled=True)
+        SiteSetting.current()
+
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                self.assertTrue(SiteSetting.current().service_fee_enabled)
+
+    def test_save_invalidates(self):
+        self.assertFalse(SiteSetting.current().service_fee_enabled)
+        self.update(service_fee_enabled=True, service_fee_percentage=Decimal('10.00'))
+        self.assertEqual(SiteSetting.current().service_fee_percentage, Decimal('10.00'))
+
+    @override_settings(SITE_SETTINGS_CACHE_TTL=0)
+    def test_changes_from_other_processes_follow_the_generation(self):
+        SiteSetting.current()
+        # Unchanged generation: checked in the cache, no query
+        with self.assertNumQueries(0):
+            SiteSetting.current()
+
+        # Another process saved: the row moved on and the generation was bumped
+        SiteSetting.objects.filter(pk=1).update(site_name='Renamed')
+        site_settings.bump_generation(site_settings.NAMESPACE)
+        self.assertEqual(SiteSetting.current().site_name, 'Renamed')
+
+    def test_request_sees_one_snapshot(self):
+        seen = []
+
+        def view(request):
+            seen.append(SiteSetting.current().service_fee_enabled)
+            self.update(service_fee_enabled=True)
+            seen.append(SiteSetting.current().service_fee_enabled)
+            return HttpResponse()
+
+        site_settings.SiteSettingsSnapshotMiddleware(view)(RequestFactory().get('/'))
+        self.assertEqual(seen, [False, False])
+        self.assertTrue(SiteSetting.current().service_fee_enabled)
+
+
+class MediaStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.factory = RequestFactory()
+
+    def save(self, name, content):
+        return default_storage.save(name, ContentFile(content))
+
+    def age(self, name, hours):
+        past = time.time() - hours * 3600
+        os.utime(default_storage.path(name), (past, past))
+
+    def get(self, name, **headers):
+        return media.serve(self.factory.get(f'/media/{name}', headers=headers), name)
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.save('event_images/poster.JPG', b'same bytes')
+        second = self.save('avatars/me.jpg', b'same bytes')
+        other = self.save('event_images/poster.jpg', b'other bytes')
+
+        self.assertEqual(first, second)
+        self.assertRegex(first, r'^blobs/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertNotEqual(first, other)
+        self.assertEqual(len(list(default_storage.blobs())), 2)
+
+        # Shared, so only gc_media removes it
+        default_storage.delete(first)
+        self.assertTrue(default_storage.exists(first))
+
+    def test_extension_comes_from_the_content(self):
+        png = io.BytesIO()
+        Image.new('RGB', (1, 1)).save(png, 'PNG')
+
+        self.assertTrue(self.save('avatars/me.jpg.gz', png.getvalue()).endswith('.png'))
+        for client_name in ('avatars/me.html', 'avatars/me.svg', 'avatars/me.gz'):
+            with self.subTest(client_name):
+                name = self.save(client_name, b'<script>alert(1)</script>')
+                self.assertNotIn('.', os.path.basename(name))
+                response = self.get(name)
+                self.assertEqual(response['Content-Type'], 'application/octet-stream')
+                self.assertNotIn('Content-Encoding', response)
+                self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+    def test_blobs_are_served_immutable_with_strong_etag(self):
+        name = self.save('event_images/poster.jpg', b'0123456789')
+        digest = os.path.basename(name).split('.')[0]
+
+        response = self.get(name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['ETag'], f'"{digest}"')
+        self.assertEqual(response['Cache-Control'], media.IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+        response = self.get(name, if_none_match=f'"{digest}"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Cache-Control'], media.IMMUTABLE_CACHE_CONTROL)
+
+    def test_range_requests(self):
+        name = self.save('event_images/poster.jpg', b'0123456789')
+        etag = self.get(name)['ETag']
+
+        for header, status, body, content_range in [
+            ('bytes=2-5', 206, b'2345', 'bytes 2-5/10'),
+            ('bytes=7-', 206, b'789', 'bytes 7-9/10'),
+            ('bytes=-3', 206, b'789', 'bytes 7-9/10'),
+            ('bytes=8-100', 206, b'89', 'bytes 8-9/10'),
+            ('bytes=0-1,4-5', 200, b'0123456789', None),
+        ]:
+            with self.subTest(header):
+                response = self.get(name, range=header)
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(b''.join(response.streaming_content), body)
+                self.assertEqual(response.get('Content-Range'), content_range)
+
+        response = self.get(name, range='bytes=10-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'))
+
+        # If-Range: only a matching validator gets the partial response
+        self.assertEqual(self.get(name, range='bytes=2-5', if_range=etag).status_code, 206)
+        self.assertEqual(self.get(name, range='bytes=2-5', if_range='"stale"').status_code, 200)
+
+    def test_files_outside_the_blob_store_are_revalidated(self):
+        os.makedirs(default_storage.path('event_images'))
+        with open(default_storage.path('event_images/legacy.jpg'), 'wb') as handle:
+            handle.write(b'legacy')
+
+        response = self.get('event_images/legacy.jpg')
+        self.assertEqual(response['Cache-Control'], media.REVALIDATE_CACHE_CONTROL)
+        self.assertEqual(self.get('event_images/legacy.jpg', if_none_match=response['ETag']).status_code, 304)
+        with self.assertRaises(Http404):
+            self.get('../secret.txt')
+
+    def test_gc_deletes_old_unreferenced_blobs_only(self):
+        avatar = self.save('avatars/me.jpg', b'avatar')
+        variant = self.save('avatars/variants/me.webp', b'variant')
+        orphan = self.save('event_images/old.jpg', b'orphan')
+        recent = self.save('event_images/new.jpg', b'just uploaded')
+        for name in (avatar, variant, orphan):
+            self.age(name, 48)
+
+        user = get_user_model().objects.create_user(email='me@example.com', username='me', password='pass1234')
+        get_user_model().objects.filter(pk=user.pk).update(
+            avatar=avatar,
+            avatar_variants={'source': avatar, 'thumb': {'width': 1, 'height': 1, 'webp': variant, 'jpeg': variant}},
+        )
+
+        call_command('gc_media', dry_run=True, stdout=io.StringIO())
+        self.assertTrue(default_storage.exists(orphan))
+
+        call_command('gc_media', stdout=io.StringIO())
+        self.assertFalse(default_storage.exists(orphan))
+        for name in (avatar, variant, recent):
+            self.assertTrue(default_storage.exists(name))
+
+        # Uploading the same bytes again makes an old blob fresh
+        self.age(avatar, 48)
+        get_user_model().objects.filter(pk=user.pk).update(avatar='', avatar_variants={})
+        self.save('avatars/again.jpg', b'avatar')
+        call_command('gc_media', stdout=io.StringIO())
+        self.assertTrue(default_storage.exists(avatar))
@@ -5,7 +5,7 @@ from .models import Event, EventDate, Category, UserFavorite
 class EventDateInline(admin.TabularInline):
     model = EventDate
     extra = 1
-    fields = ('date', 'time', 'availability', 'price', 'capacity', 'tickets_sold')
+    fields = ('date', 'time', 'availability', 'price', 'capacity', 'tickets_sold', 'queue_enabled')
     readonly_fields = ('availability',)
 
 @admin.register(Event)
@@ -14,7 +14,7 @@ class EventAdmin(admin.ModelAdmin):
     list_filter = ('is_featured', 'categories', 'created_at')
     search_fields = ('title', 'description', 'location', 'planner__user__username')
     prepopulated_fields = {'slug': ('title',)}
-    readonly_fields = ('id', 'created_at', 'updated_at')
+    readonly_fields = ('id', 'first_date', 'last_date', 'next_date', 'created_at', 'updated_at')
     inlines = [EventDateInline]
     filter_horizontal = ('categories',)
     
@@ -25,6 +25,11 @@ class EventAdmin(admin.ModelAdmin):
     def get_dates_count(self, obj):
         return obj.dates.count()
     get_dates_count.short_description = 'Number of Dates'
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # The date inline may have added, moved or removed dates
+        Event.update_date_bounds([form.instance.pk])
     
     def get_queryset(self, request):
         queryset = super().get_queryset(request)
@@ -32,8 +37,8 @@ class EventAdmin(admin.ModelAdmin):
 
 @admin.register(EventDate)
 class EventDateAdmin(admin.ModelAdmin):
-    list_display = ('event', 'date', 'time', 'availability', 'price', 'capacity', 'tickets_sold')
-    list_filter = ('availability', 'date')
+    list_display = ('event', 'date', 'time', 'availability', 'price', 'capacity', 'tickets_sold', 'queue_enabled')
+    list_filter = ('availability', 'queue_enabled', 'date')
     search_fields = ('event__title',)
     readonly_fields = ('availability',)
     
@@ -41,6 +46,19 @@ class EventDateAdmin(admin.ModelAdmin):
         queryset = super().get_queryset(request)
         return queryset.select_related('event')
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        Event.update_date_bounds([obj.event_id])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        Event.update_date_bounds([obj.event_id])
+
+    def delete_queryset(self, request, queryset):
+        event_ids = set(queryset.values_list('event_id', flat=True))
+        super().delete_queryset(request, queryset)
+        Event.update_date_bounds(event_ids)
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'get_events_count')
@@ -0,0 +1,161 @@
+"""
+Viewport clustering for the events map.
+
+The map is split into tiles (geohash cells one or more levels coarser than the
+cluster grid). Each tile's clusters are aggregated in the database and cached
+per (tile, zoom, category, dateFilter), so panning only computes the tiles
+that were not seen before. Cached tiles live in the 'events' cache
+namespace, whose generation is bumped whenever an Event or EventDate changes.
+"""
+import hashlib
+from datetime import date
+
+from core.cache import get_generation
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, F, Window
+from django.db.models.functions import RowNumber, Substr
+
+from .geo import GEOHASH_PRECISION, GEOHASH_RANGE_END, cell_size, cells_for_bbox, estimated_cell_count
+from .serializers import MapEventSerializer
+
+MAX_ZOOM = 22
+
+# Roughly 8x8 clusters per 256px map tile
+CLUSTERS_PER_TILE_SIDE = 8
+
+# Upper bound on tiles computed for one viewport
+MAX_TILES = 64
+
+# Event ids returned with each cluster
+REPRESENTATIVE_EVENTS = 3
+
+# Pins returned for one tile at pin zoom levels, featured and newest first
+MAX_PINS_PER_TILE = 500
+
+# Featured and newest events represent their cluster and come first as pins
+REPRESENTATIVE_ORDER = (F('is_featured').desc(), F('created_at').desc())
+
+def precision_for_zoom(zoom):
+    """Return the geohash precision of the cluster grid at a map zoom level"""
+    target_width = 360.0 / (2 ** zoom) / CLUSTERS_PER_TILE_SIDE
+    precision = 1
+    for candidate in range(1, GEOHASH_PRECISION + 1):
+        if cell_size(candidate)[1] < target_width:
+            break
+        precision = candidate
+    return precision
+
+
+def _tile_precision(bbox, precision):
+    tile_precision = precision - 1
+    while tile_precision > 0 and estimated_cell_count(*bbox, tile_precision) > MAX_TILES:
+        tile_precision -= 1
+    return tile_precision
+
+
+def _in_bbox(latitude, longitude, bbox):
+    min_lat, min_lng, max_lat, max_lng = bbox
+    if not min_lat <= latitude <= max_lat:
+        return False
+    if min_lng <= max_lng:
+        return min_lng <= longitude <= max_lng
+    return longitude >= min_lng or longitude <= max_lng
+
+
+def _build_tile(queryset, tile, precision, pins):
+    tile_queryset = queryset.filter(geohash__gte=tile, geohash__lt=tile + GEOHASH_RANGE_END)
+
+    if pins:
+        events = list(tile_queryset.order_by(*REPRESENTATIVE_ORDER)[:MAX_PINS_PER_TILE + 1])
+        return {
+            'events': MapEventSerializer(events[:MAX_PINS_PER_TILE], many=True).data,
+            'truncated': len(events) > MAX_PINS_PER_TILE,
+        }
+
+    cell = Substr('geohash', 1, precision)
+    rows = (
+        tile_queryset
+        .annotate(cell=cell)
+        .values('cell')
+        .annotate(
+            count=Count('id'),
+            centroid_lat=Avg('latitude'),
+            centroid_lng=Avg('longitude'),
+        )
+        .order_by('cell')
+    )
+
+    # The first few events of each cell, ranked by the database
+    representatives = {}
+    ranked = (
+        tile_queryset
+        .annotate(cell=cell, rank=Window(RowNumber(), partition_by=[cell], order_by=REPRESENTATIVE_ORDER))
+        .filter(rank__lte=REPRESENTATIVE_EVENTS)
+        .order_by('cell', 'rank')
+        .values_list('cell', 'id')
+    )
+    for cell_hash, event_id in ranked:
+        representatives.setdefault(cell_hash, []).append(str(event_id))
+
+    return {
+        'clusters': [
+            {
+                'geohash': row['cell'],
+                'count': row['count'],
+                'latitude': row['centroid_lat'],
+                'longitude': row['centroid_lng'],
+                'event_ids': representatives.get(row['cell'], []),
+            }
+            for row in rows
+        ]
+    }
+
+
+def get_map_clusters(queryset, bbox, zoom, category='All', date_filter='All'):
+    """
+    Return clusters (or individual pins at high zoom) for a map viewport
+
+    Args:
+        queryset: Geolocated events already filtered by category and date
+        bbox: (min_lat, min_lng, max_lat, max_lng)
+        zoom: Map zoom level (0-22)
+        category, date_filter: The filters applied to ``queryset``, hashed into cache keys
+
+    Returns:
+        Dictionary with either ``clusters`` or ``events``; ``truncated`` is
+        set when a tile had more than MAX_PINS_PER_TILE pins
+    """
+    precision = precision_for_zoom(zoom)
+    pins = zoom >= settings.MAP_PIN_ZOOM
+    tile_precision = _tile_precision(bbox, precision)
+
+    generation = get_generation('events')
+    # Date filters are relative to today, so cached tiles roll over at midnight
+    today = date.today().isoformat()
+    # Category names may hold spaces or non-ASCII, which memcached keys can't
+    filters = hashlib.sha256(f"{category}\0{date_filter}".encode()).hexdigest()[:32]
+
+    clusters = []
+    events = []
+    truncated = False
+    for tile in sorted(cells_for_bbox(*bbox, tile_precision)):
+        key = f"events:map:{generation}:{tile}:{zoom}:{filters}:{today}"
+        data = cache.get(key)
+        if data is None:
+            data = _build_tile(queryset, tile, precision, pins)
+            cache.set(key, data, settings.MAP_CLUSTER_CACHE_TIMEOUT)
+
+        clusters.extend(
+            cluster for cluster in data.get('clusters', [])
+            if _in_bbox(cluster['latitude'], cluster['longitude'], bbox)
+        )
+        events.extend(
+            event for event in data.get('events', [])
+            if _in_bbox(event['latitude'], event['longitude'], bbox)
+        )
+        truncated = truncated or data.get('truncated', False)
+
+    if pins:
+        return {'zoom': zoom, 'events': events, 'truncated': truncated}
+    return {'zoom': zoom, 'precision': precision, 'clusters': clusters}
@@ -0,0 +1,123 @@
+"""
+Merging submitted event dates into the stored ones.
+
+Editing an event sends its full list of dates. Rather than deleting and
+recreating them all, which would cascade to their tickets and lose
+``tickets_sold``, ``merge_dates`` matches each submitted date to a stored one
+by ``id`` or else by (date, time), and then in one transaction:
+
+* deletes the stored dates that were left out, refusing if any has tickets
+* bulk-updates only the dates whose fields changed, and only those fields
+* bulk-creates the new ones
+
+The stored rows are locked while this runs, so purchases can't change
+``tickets_sold`` under a capacity check. The outcome is sent as the
+``event_dates_changed`` signal with the ids created, updated and deleted;
+nothing is sent when nothing changed.
+"""
+from typing import NamedTuple
+
+from django.db import IntegrityError, transaction
+from django.dispatch import Signal
+from rest_framework import serializers
+
+from .models import Event, EventDate
+
+# Fields a planner may change on a date
+DATE_FIELDS = ('date', 'time', 'price', 'capacity', 'queue_enabled')
+
+# Sent with event=<Event> and changes=<DateChanges> inside the transaction
+event_dates_changed = Signal()
+
+
+class DateChanges(NamedTuple):
+    created: list
+    updated: list
+    deleted: list
+
+    def __bool__(self):
+        return bool(self.created or self.updated or self.deleted)
+
+
+def _match(entries, stored):
+    """Pair every submitted entry with its stored date, or None if it's new"""
+    by_id = {event_date.pk: event_date for event_date in stored}
+    by_slot = {(event_date.date, event_date.time): event_date for event_date in stored}
+    pairs, matched = [], set()
+    for entry in entries:
+        entry = dict(entry)
+        date_id = entry.pop('id', None)
+        if date_id is not None:
+            current = by_id.get(date_id)
+            if current is None:
+                raise serializers.ValidationError({'dates': f'Date {date_id} does not belong to this event'})
+        else:
+            current = by_slot.get((entry['date'], entry['time']))
+        if current is not None:
+            if current.pk in matched:
+                raise serializers.ValidationError({'dates': f'Date {current.pk} is listed twice'})
+            matched.add(current.pk)
+        pairs.append((entry, current))
+
+    slots = [(entry['date'], entry['time']) for entry, _ in pairs]
+    if len(set(slots)) != len(slots):
+        raise serializers.ValidationError({'dates': 'Two dates cannot share a date and time'})
+    return pairs, [event_date for event_date in stored if event_date.pk not in matched]
+
+
+def merge_dates(event, entries):
+    """Make the event's dates match ``entries``; returns the DateChanges"""
+    with transaction.atomic():
+        stored = list(EventDate.objects.select_for_update().filter(event=event))
+        pairs, removed = _match(entries, stored)
+
+        with_tickets = set(
+            EventDate.objects.filter(pk__in=[event_date.pk for event_date in removed], tickets__isnull=False)
+            .values_list('pk', flat=True)
+        )
+        if with_tickets:
+            raise serializers.ValidationError({'dates': [
+                f'{event_date.date} {event_date.time} has tickets and cannot be removed'
+                for event_date in removed if event_date.pk in with_tickets
+            ]})
+
+        created, updated, changed_fields = [], [], set()
+        for entry, current in pairs:
+            if current is None:
+                created.append(EventDate(event=event, **entry))
+                created[-1].update_availability()
+                continue
+            changed = [name for name in DATE_FIELDS if name in entry and getattr(current, name) != entry[name]]
+            if not changed:
+                continue
+            if entry.get('capacity', current.capacity) < current.tickets_sold:
+                raise serializers.ValidationError({'dates': (
+                    f'{current.date} {current.time} already has {current.tickets_sold} tickets sold'
+                )})
+            for name in changed:
+                setattr(current, name, entry[name])
+            current.update_availability()
+            updated.append(current)
+            changed_fields.update(changed)
+
+        try:
+            # Deletes first, so a new date may take a removed one's slot
+            EventDate.objects.filter(pk__in=[event_date.pk for event_date in removed]).delete()
+            if updated:
+                EventDate.objects.bulk_update(updated, [*changed_fields, 'availability'])
+            EventDate.objects.bulk_create(created)
+        except IntegrityError:
+            # Two stored dates swapping slots in a single edit
+            raise serializers.ValidationError({'dates': 'Two dates cannot share a date and time'})
+
+        if created or removed or 'date' in changed_fields:
+            Event.update_date_bounds([event.pk])
+
+        changes = DateChanges(
+            created=[event_date.pk for event_date in created],
+            updated=[event_date.pk for event_date in updated],
+            deleted=[event_date.pk for event_date in removed],
+        )
+        if changes:
+            event_dates_changed.send(sender=Event, event=event, changes=changes)
+    return changes
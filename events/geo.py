@@ -0,0 +1,236 @@
+"""
+Geospatial helpers for events.
+
+Events are indexed by a geohash column kept in sync by ``Event.save``. A
+geohash cell is a prefix of every geohash inside it, so the cells covering a
+bounding box turn into a handful of indexed range scans. The exact
+lat/lng checks and haversine distance are then evaluated in the database on
+that small candidate set only.
+"""
+import math
+
+from django.db.models import F, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+# Geohash alphabet; '{' sorts directly after 'z' and closes prefix ranges
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_RANGE_END = '{'
+
+# Precision stored on Event (~5m cells)
+GEOHASH_PRECISION = 9
+
+# Upper bound on cells used to cover a query area
+MAX_COVER_CELLS = 16
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Nearest-N search starts at this radius and grows until it holds enough
+# events; after NEAREST_MAX_STEPS radii it searches everything once
+NEAREST_START_RADIUS_KM = 2.0
+NEAREST_GROWTH = 4
+NEAREST_MAX_STEPS = 4
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Encode a latitude/longitude pair as a geohash string"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, longitude first
+        value, value_range = (longitude, lng_range) if even else (latitude, lat_range)
+        mid = (value_range[0] + value_range[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            value_range[0] = mid
+        else:
+            bits = bits << 1
+            value_range[1] = mid
+
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """Return (height, width) in degrees of a geohash cell at a precision"""
+    total_bits = precision * 5
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lng_bits)
+
+
+def _split_antimeridian(min_lat, min_lng, max_lat, max_lng):
+    """Split a bounding box that crosses the antimeridian into two"""
+    if min_lng <= max_lng:
+        return [(min_lat, min_lng, max_lat, max_lng)]
+    return [(min_lat, min_lng, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lng)]
+
+
+def _cells_for_box(min_lat, min_lng, max_lat, max_lng, precision):
+    height, width = cell_size(precision)
+    cells = set()
+
+    lat = min_lat
+    while True:
+        lng = min_lng
+        while True:
+            cells.add(encode_geohash(lat, lng, precision))
+            if lng >= max_lng:
+                break
+            lng = min(lng + width, max_lng)
+        if lat >= max_lat:
+            break
+        lat = min(lat + height, max_lat)
+
+    return cells
+
+
+def _estimated_cell_count(boxes, precision):
+    height, width = cell_size(precision)
+    return sum(
+        (math.ceil((max_lat - min_lat) / height) + 1) * (math.ceil((max_lng - min_lng) / width) + 1)
+        for min_lat, min_lng, max_lat, max_lng in boxes
+    )
+
+
+def covering_cells(min_lat, min_lng, max_lat, max_lng, max_cells=MAX_COVER_CELLS):
+    """
+    Return the geohash cells covering a bounding box
+
+    Picks the finest precision at which the box is covered by at most
+    ``max_cells`` cells. Returns an empty set when the box is so large that
+    no prefix narrows the search (i.e. the whole world).
+    """
+    boxes = _split_antimeridian(min_lat, min_lng, max_lat, max_lng)
+
+    precision = 0
+    for candidate in range(1, GEOHASH_PRECISION + 1):
+        if _estimated_cell_count(boxes, candidate) > max_cells:
+            break
+        precision = candidate
+
+    if precision == 0:
+        return set()
+    return cells_for_bbox(min_lat, min_lng, max_lat, max_lng, precision)
+
+
+def cells_for_bbox(min_lat, min_lng, max_lat, max_lng, precision):
+    """Return the geohash cells at a fixed precision covering a bounding box"""
+    if precision == 0:
+        # The empty prefix is the whole world
+        return {''}
+    cells = set()
+    for box in _split_antimeridian(min_lat, min_lng, max_lat, max_lng):
+        cells |= _cells_for_box(*box, precision)
+    return cells
+
+
+def estimated_cell_count(min_lat, min_lng, max_lat, max_lng, precision):
+    """Upper bound on ``len(cells_for_bbox(...))`` without building the set"""
+    if precision == 0:
+        return 1
+    return _estimated_cell_count(_split_antimeridian(min_lat, min_lng, max_lat, max_lng), precision)
+
+
+def radius_bbox(latitude, longitude, radius_km):
+    """Return the (min_lat, min_lng, max_lat, max_lng) box enclosing a circle"""
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat = max(latitude - lat_delta, -90.0)
+    max_lat = min(latitude + lat_delta, 90.0)
+
+    # Near the poles (or for huge radii) the circle spans every longitude
+    cos_lat = math.cos(math.radians(latitude))
+    if min_lat <= -90.0 or max_lat >= 90.0 or cos_lat <= 0:
+        return min_lat, -180.0, max_lat, 180.0
+
+    lng_delta = math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat))
+    if lng_delta >= 180.0:
+        return min_lat, -180.0, max_lat, 180.0
+
+    min_lng = longitude - lng_delta
+    max_lng = longitude + lng_delta
+    if min_lng < -180.0:
+        min_lng += 360.0
+    if max_lng > 180.0:
+        max_lng -= 360.0
+    return min_lat, min_lng, max_lat, max_lng
+
+
+def within_bbox(queryset, min_lat, min_lng, max_lat, max_lng):
+    """Filter events to a bounding box using the geohash index"""
+    queryset = queryset.filter(latitude__isnull=False, longitude__isnull=False)
+
+    cells = covering_cells(min_lat, min_lng, max_lat, max_lng)
+    if cells:
+        cell_filter = Q()
+        for cell in cells:
+            cell_filter |= Q(geohash__gte=cell, geohash__lt=cell + GEOHASH_RANGE_END)
+        queryset = queryset.filter(cell_filter)
+
+    queryset = queryset.filter(latitude__gte=min_lat, latitude__lte=max_lat)
+    if min_lng <= max_lng:
+        return queryset.filter(longitude__gte=min_lng, longitude__lte=max_lng)
+    return queryset.filter(Q(longitude__gte=min_lng) | Q(longitude__lte=max_lng))
+
+
+def distance_expression(latitude, longitude):
+    """Haversine distance in km from a point, evaluated by the database"""
+    half_dlat = Radians(F('latitude') - Value(latitude)) / 2
+    half_dlng = Radians(F('longitude') - Value(longitude)) / 2
+    a = (
+        Power(Sin(half_dlat), 2)
+        + Value(math.cos(math.radians(latitude)))
+        * Cos(Radians(F('latitude')))
+        * Power(Sin(half_dlng), 2)
+    )
+    # Rounding can push ``a`` a hair above 1 for antipodal points
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(Least(a, Value(1.0))))
+
+
+def annotate_distance(queryset, latitude, longitude):
+    """Annotate each event with ``distance`` (km) from a point"""
+    return queryset.annotate(distance=distance_expression(latitude, longitude))
+
+
+def within_radius(queryset, latitude, longitude, radius_km):
+    """Filter events within ``radius_km`` of a point, annotated with distance"""
+    queryset = within_bbox(queryset, *radius_bbox(latitude, longitude, radius_km))
+    return annotate_distance(queryset, latitude, longitude).filter(distance__lte=radius_km)
+
+
+def nearest(queryset, latitude, longitude, limit, max_radius_km=None):
+    """
+    Return a list of the ``limit`` events closest to a point, nearest first
+
+    Each step is one ordered, limited query within a growing radius; as soon
+    as a radius holds ``limit`` events they are the nearest ones. Sparse data
+    ends with one last query over the whole area (within ``max_radius_km``
+    if given), so the search never takes more than NEAREST_MAX_STEPS + 1
+    queries.
+    """
+    radius_km = NEAREST_START_RADIUS_KM
+    for _ in range(NEAREST_MAX_STEPS):
+        if max_radius_km is not None and radius_km >= max_radius_km:
+            break
+        events = list(within_radius(queryset, latitude, longitude, radius_km).order_by('distance')[:limit])
+        if len(events) >= limit:
+            return events
+        radius_km *= NEAREST_GROWTH
+
+    if max_radius_km is None:
+        candidates = annotate_distance(
+            queryset.filter(latitude__isnull=False, longitude__isnull=False), latitude, longitude
+        )
+    else:
+        candidates = within_radius(queryset, latitude, longitude, max_radius_km)
+    return list(candidates.order_by('distance')[:limit])
@@ -0,0 +1,214 @@
+"""
+Bulk event import.
+
+Planners onboarding a venue send thousands of events at once. Rows are read
+from a CSV or NDJSON stream one at a time and handled in batches of
+IMPORT_BATCH_SIZE: each row is validated on its own, then the valid rows of
+a batch are written with one bulk_create each for Event, EventDate and the
+Event.categories through table, followed by a single date bounds update. A
+row that fails validation is reported with its line number and skipped; it
+never aborts the rest of the batch.
+
+Batches are committed as they go. If the file can't be decoded or parsed
+past some point, the rows read before it are still imported and the result
+says where the import stopped, so a retry can resume after that row rather
+than duplicating the events already created.
+
+bulk_create skips Event.save() and the post_save signals, so slugs and
+geohashes are filled in here and the search index and listing caches are
+updated once per batch.
+
+CSV files have one event per line with the columns of EventImportSerializer.
+``categories`` and ``highlights`` are separated by ``;``, and ``dates`` is a
+``;`` separated list of ``YYYY-MM-DD HH:MM`` entries. ``capacity`` and
+``queue_enabled`` apply to every date of the line. NDJSON lines are event
+objects where ``categories`` is a list of names and ``dates`` a list of
+date objects as the event API takes them.
+"""
+import csv
+import io
+import json
+import uuid
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.text import slugify
+from rest_framework import serializers
+
+from core.cache import bump_generation
+from .models import Category, Event, EventDate
+from .search import get_search_backend
+from .serializers import EventDateSerializer
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+# CSV columns holding several values
+LIST_SEPARATOR = ';'
+
+# Rows per INSERT, within the databases' bound parameter limits
+INSERT_BATCH_SIZE = 1000
+
+
+class UnreadableFile(Exception):
+    """The upload can't be decoded or parsed any further"""
+
+
+class EventImportSerializer(serializers.ModelSerializer):
+    categories = serializers.ListField(child=serializers.CharField(), required=False)
+    dates = EventDateSerializer(many=True, allow_empty=False)
+
+    class Meta:
+        model = Event
+        fields = [
+            'title', 'description', 'location', 'address', 'latitude', 'longitude',
+            'price', 'currency', 'is_featured', 'highlights', 'categories', 'dates',
+        ]
+
+    def validate_categories(self, names):
+        known = self.context['categories']
+        unknown = [name for name in names if name not in known]
+        if unknown:
+            raise serializers.ValidationError(f"Unknown categories: {', '.join(unknown)}")
+        return [known[name] for name in dict.fromkeys(names)]
+
+    def validate_dates(self, dates):
+        slots = {(entry['date'], entry['time']) for entry in dates}
+        if len(slots) != len(dates):
+            raise serializers.ValidationError('The same date and time is listed twice')
+        return dates
+
+
+def _split(value):
+    return [item.strip() for item in value.split(LIST_SEPARATOR) if item.strip()]
+
+
+def _csv_row(row):
+    """Turn a flat CSV row into the nested shape EventImportSerializer takes"""
+    data = {name: value for name, value in row.items() if name and value not in ('', None)}
+    for name in ('categories', 'highlights'):
+        if name in data:
+            data[name] = _split(data[name])
+    extra = {name: data.pop(name) for name in ('capacity', 'queue_enabled') if name in data}
+    dates = []
+    for entry in _split(data.pop('dates', '')):
+        day, _, start = entry.partition(' ')
+        dates.append({'date': day, 'time': start, **extra})
+    data['dates'] = dates
+    return data
+
+
+def read_rows(stream, import_format):
+    """
+    Yield (line number, row data or None if unreadable) from a text stream
+
+    Raises UnreadableFile where the stream stops being valid UTF-8 or CSV.
+    """
+    try:
+        yield from _read_rows(stream, import_format)
+    except UnicodeDecodeError:
+        raise UnreadableFile('Must be UTF-8 encoded')
+    except csv.Error as e:
+        raise UnreadableFile(f'Unreadable CSV: {str(e)}')
+
+
+def _read_rows(stream, import_format):
+    if import_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, _csv_row(row)
+        return
+
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def text_stream(binary, encoding='utf-8'):
+    """Wrap an uploaded or opened binary file for read_rows"""
+    return io.TextIOWrapper(binary, encoding=encoding, newline='')
+
+
+def _new_event(planner, data):
+    event = Event(planner=planner, **data)
+    event.slug = f"{slugify(event.title)}-{str(uuid.uuid4())[:8]}"
+    event.geohash = event.compute_geohash()
+    return event
+
+
+def _import_batch(planner, rows, categories):
+    """Validate and insert one batch; returns (created events, row errors)"""
+    events, dates, links, errors = [], [], [], []
+    for line_number, data in rows:
+        if data is None:
+            errors.append({'row': line_number, 'errors': {'non_field_errors': ['Not a valid JSON object']}})
+            continue
+        serializer = EventImportSerializer(data=data, context={'categories': categories})
+        if not serializer.is_valid():
+            errors.append({'row': line_number, 'errors': serializer.errors})
+            continue
+
+        values = dict(serializer.validated_data)
+        event_categories = values.pop('categories', [])
+        event_dates = values.pop('dates')
+        event = _new_event(planner, values)
+        events.append(event)
+        dates.extend(EventDate(event=event, **entry) for entry in event_dates)
+        links.extend(
+            Event.categories.through(event=event, category=category) for category in event_categories
+        )
+
+    if events:
+        with transaction.atomic():
+            Event.objects.bulk_create(events, batch_size=INSERT_BATCH_SIZE)
+            EventDate.objects.bulk_create(dates, batch_size=INSERT_BATCH_SIZE)
+            Event.categories.through.objects.bulk_create(links, batch_size=INSERT_BATCH_SIZE)
+            Event.update_date_bounds([event.pk for event in events])
+            get_search_backend().index_events(events)
+            transaction.on_commit(lambda: bump_generation('events'))
+    return events, errors
+
+
+def _next_batch(rows, batch_size):
+    """Up to ``batch_size`` rows, and the UnreadableFile that cut them short if any"""
+    batch = []
+    try:
+        batch.extend(islice(rows, batch_size))
+    except UnreadableFile as e:
+        return batch, e
+    return batch, None
+
+
+def import_events(planner, rows, batch_size=None, max_errors=None):
+    """
+    Import (line number, row data) pairs for a planner, batch by batch
+
+    Returns the number of events created, the number of rows rejected and
+    the first ``max_errors`` row errors. If the rows end in UnreadableFile,
+    ``stopped`` holds the error and ``after_row``, the last row read: every
+    row up to it was imported or rejected, none after it.
+    """
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    max_errors = settings.IMPORT_MAX_ERRORS if max_errors is None else max_errors
+    categories = {category.name: category for category in Category.objects.all()}
+    result = {'created': 0, 'failed': 0, 'errors': []}
+
+    rows, last_row = iter(rows), 0
+    while True:
+        batch, unreadable = _next_batch(rows, batch_size)
+        if batch:
+            events, errors = _import_batch(planner, batch, categories)
+            result['created'] += len(events)
+            result['failed'] += len(errors)
+            result['errors'].extend(errors[:max_errors - len(result['errors'])])
+            last_row = batch[-1][0]
+        if unreadable:
+            result['stopped'] = {'error': str(unreadable), 'after_row': last_row}
+            return result
+        if not batch:
+            return result
@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.cache import bump_generation
+from events.models import Event
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the denormalized first_date/last_date/next_date columns on events. '
+        'Keep running with --rolled-over --loop so next_date moves past dates that have ended.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--rolled-over', action='store_true',
+            help='Only refresh events whose next_date is already in the past',
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='With --rolled-over, check again every EVENT_DATES_REFRESH_INTERVAL seconds',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if not options['rolled_over']:
+            event_ids = list(Event.objects.order_by('pk').values_list('pk', flat=True))
+            for start in range(0, len(event_ids), batch_size):
+                Event.update_date_bounds(event_ids[start:start + batch_size])
+            bump_generation('events')
+            self.stdout.write(self.style.SUCCESS(f'Refreshed date columns for {len(event_ids)} events'))
+            return
+
+        while True:
+            count = Event.roll_over_dates(batch_size=batch_size)
+            if count:
+                # Cached listings sorted by date are out of order now
+                bump_generation('events')
+            self.stdout.write(self.style.SUCCESS(f'Refreshed date columns for {count} events'))
+            if not options['loop']:
+                return
+            time.sleep(settings.EVENT_DATES_REFRESH_INTERVAL)
@@ -0,0 +1,117 @@
+from decimal import Decimal
+from datetime import date, timedelta
+from statistics import median
+import random
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from authentication.models import EventPlanner, User
+from core.pagination import after, sort_keys
+from events.models import Event
+
+# Listing sorts, as EventViewSet.list applies them
+SORTS = {
+    'recommended': ('-created_at',),
+    'price': ('price',),
+    'date': (F('next_date').asc(nulls_last=True), 'first_date'),
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Time keyset against OFFSET pagination of the event listing at shallow and deep pages. '
+        'Synthetic events are created for the run and rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', default='1,100,10000',
+                            help='Comma separated page numbers to time (default: 1,100,10000)')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement; the median is reported')
+        parser.add_argument('--sort', choices=SORTS, action='append',
+                            help='Sort to benchmark, may be repeated (default: all)')
+        parser.add_argument('--existing', action='store_true',
+                            help="Use the events already in the database instead of synthetic ones")
+
+    def handle(self, *args, **options):
+        try:
+            pages = sorted({int(page) for page in options['pages'].split(',')})
+        except ValueError:
+            raise CommandError('--pages must be a comma separated list of numbers')
+        if pages[0] < 1 or options['page_size'] < 1:
+            raise CommandError('Pages and page size must be at least 1')
+        options['pages'] = pages
+
+        if options['existing']:
+            self.benchmark(**options)
+            return
+        try:
+            with transaction.atomic():
+                self.seed(pages[-1] * options['page_size'])
+                self.benchmark(**options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, count):
+        self.stdout.write(f'Creating {count} synthetic events...')
+        suffix = uuid.uuid4().hex[:8]
+        user = User.objects.create_user(email=f'benchmark-{suffix}@example.com', username=f'benchmark-{suffix}')
+        planner = EventPlanner.objects.create(user=user, phone='0700000000', national_id=suffix, status='approved')
+        today = date.today()
+        batch = []
+        for i in range(count):
+            first_date = today + timedelta(days=random.randrange(-30, 365))
+            batch.append(Event(
+                planner=planner, title=f'Benchmark event {i}', slug=f'benchmark-{suffix}-{i}',
+                description='Benchmark', location='Nairobi', address='Street',
+                # Few distinct prices and dates, so the id tie-breaker matters
+                price=Decimal(random.randrange(5, 200)),
+                first_date=first_date, last_date=first_date, next_date=first_date if first_date >= today else None,
+            ))
+            if len(batch) == 5000:
+                Event.objects.bulk_create(batch)
+                batch = []
+        Event.objects.bulk_create(batch)
+
+    def benchmark(self, pages, page_size, repeat, sort, **options):
+        total = Event.objects.count()
+        self.stdout.write(f'{total} events, page size {page_size}, median of {repeat} runs (ms)')
+        self.stdout.write(f"{'sort':<12}{'page':>8}{'offset':>12}{'keyset':>12}")
+
+        for name in sort or SORTS:
+            queryset = Event.objects.order_by(*SORTS[name])
+            keys = sort_keys(queryset)
+            queryset = queryset.order_by(*[key.order_by() for key in keys])
+
+            for page in pages:
+                start = (page - 1) * page_size
+                if start >= total:
+                    self.stdout.write(f'{name:<12}{page:>8}{"(past the end)":>24}')
+                    continue
+
+                offset_ms = self.time(lambda: list(queryset[start:start + page_size]), repeat)
+                if start:
+                    # The cursor a client would hold after reading the previous page
+                    last = queryset[start - 1]
+                    page_queryset = queryset.filter(after(keys, [key.value_of(last) for key in keys]))
+                else:
+                    page_queryset = queryset
+                keyset_ms = self.time(lambda: list(page_queryset[:page_size]), repeat)
+                self.stdout.write(f'{name:<12}{page:>8}{offset_ms:>12.2f}{keyset_ms:>12.2f}')
+
+    def time(self, fetch, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fetch()
+            timings.append((time.perf_counter() - started) * 1000)
+        return median(timings)
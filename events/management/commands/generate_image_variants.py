@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from authentication.models import User
+from core.images import generate_variants, needs_variants
+from events.models import Event
+
+# Model, image field, variants field, variant names
+IMAGE_FIELDS = (
+    (Event, 'image', 'image_variants', Event.IMAGE_VARIANTS),
+    (User, 'avatar', 'avatar_variants', User.AVATAR_VARIANTS),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate the resized variants of event images and avatars that are missing or out of date. '
+        'Run once after upgrading, and after restarts that may have dropped queued images.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Images resized at once (default: IMAGE_WORKERS)')
+        parser.add_argument('--force', action='store_true', help='Regenerate variants that look up to date')
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'] or settings.IMAGE_WORKERS, 1)
+        jobs = []
+        for model, field, variants_field, names in IMAGE_FIELDS:
+            rows = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+            for instance in rows.only('pk', field, variants_field).iterator():
+                if options['force'] or needs_variants(instance, field, variants_field):
+                    jobs.append((model, instance.pk, field, variants_field, names))
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-variants') as pool:
+                results = list(pool.map(lambda job: self.generate_in_thread(*job), jobs))
+        else:
+            results = [generate_variants(*job) for job in jobs]
+
+        failed = results.count(None)
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated variants for {len(jobs) - failed} images, {failed} could not be read'
+        ))
+
+    def generate_in_thread(self, *job):
+        try:
+            return generate_variants(*job)
+        finally:
+            connection.close()
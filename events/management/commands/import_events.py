@@ -0,0 +1,54 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.models import EventPlanner
+from events.importer import IMPORT_FORMATS, import_events, read_rows, text_stream
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk import events for a planner from a CSV or NDJSON file (see events/importer.py for the columns). '
+        'Invalid rows are reported and skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin")
+        parser.add_argument('--planner', required=True, help='Id or user email of the approved planner')
+        parser.add_argument('--format', choices=IMPORT_FORMATS,
+                            help='Input format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, help='Rows per batch (default: IMPORT_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        planner = self.get_planner(options['planner'])
+        path = options['path']
+        import_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if import_format not in IMPORT_FORMATS:
+            raise CommandError(f"Pass --format, the format can't be told from {path!r}")
+
+        try:
+            binary = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        except OSError as e:
+            raise CommandError(str(e))
+        try:
+            rows = read_rows(text_stream(binary), import_format)
+            result = import_events(planner, rows, batch_size=options['batch_size'], max_errors=sys.maxsize)
+        finally:
+            if binary is not sys.stdin.buffer:
+                binary.close()
+
+        for error in result['errors']:
+            self.stderr.write(f"Row {error['row']}: {json.dumps(error['errors'])}")
+        message = f"Imported {result['created']} events for {planner}, {result['failed']} rows rejected"
+        if 'stopped' in result:
+            stopped = result['stopped']
+            raise CommandError(f"{message}; stopped after row {stopped['after_row']}: {stopped['error']}")
+        self.stdout.write(self.style.SUCCESS(message))
+
+    def get_planner(self, value):
+        lookup = {'user__email': value} if '@' in value else {'pk': value}
+        try:
+            return EventPlanner.objects.get(status='approved', **lookup)
+        except (EventPlanner.DoesNotExist, ValueError):
+            raise CommandError(f'No approved planner {value!r}')
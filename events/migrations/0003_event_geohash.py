@@ -0,0 +1,29 @@
+# Generated by Django 5.0.6 on 2026-10-16 23:53
+
+from django.db import migrations, models
+
+from events.geo import encode_geohash
+
+
+def populate_geohash(apps, schema_editor):
+    Event = apps.get_model('events', 'Event')
+    events = Event.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    for event in events.iterator():
+        event.geohash = encode_geohash(event.latitude, event.longitude)
+        event.save(update_fields=['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0002_category_event_is_favorite_event_latitude_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+        migrations.RunPython(populate_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.0.6 on 2026-10-16 23:56
+
+from datetime import date
+
+from django.db import migrations, models
+
+
+def populate_date_bounds(apps, schema_editor):
+    Event = apps.get_model('events', 'Event')
+    EventDate = apps.get_model('events', 'EventDate')
+    today = date.today()
+    rows = (
+        EventDate.objects.values('event')
+        .annotate(
+            first=models.Min('date'),
+            last=models.Max('date'),
+            upcoming=models.Min('date', filter=models.Q(date__gte=today)),
+        )
+        .order_by()
+    )
+    for row in rows:
+        Event.objects.filter(pk=row['event']).update(
+            first_date=row['first'], last_date=row['last'], next_date=row['upcoming']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0003_event_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='first_date',
+            field=models.DateField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='last_date',
+            field=models.DateField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='next_date',
+            field=models.DateField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(populate_date_bounds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.0.6 on 2026-10-17 00:10
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    Event = apps.get_model('events', 'Event')
+
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            if not cursor.fetchone()[0]:
+                # No FTS5 in this SQLite build; search falls back to icontains
+                return
+            cursor.execute(
+                "CREATE VIRTUAL TABLE events_event_fts USING fts5("
+                "event_id UNINDEXED, title, description, location, "
+                "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+            cursor.execute(
+                "CREATE VIRTUAL TABLE events_event_fts_vocab USING fts5vocab(events_event_fts, 'row')"
+            )
+            rows = [
+                (event.pk.int & ((1 << 63) - 1), str(event.pk), event.title, event.description, event.location)
+                for event in Event.objects.only('id', 'title', 'description', 'location').iterator()
+            ]
+            cursor.executemany(
+                "INSERT INTO events_event_fts (rowid, event_id, title, description, location) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                rows,
+            )
+
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("ALTER TABLE events_event ADD COLUMN search_vector tsvector")
+            cursor.execute(
+                "UPDATE events_event SET search_vector = "
+                "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+                "setweight(to_tsvector('simple', coalesce(location, '')), 'B') || "
+                "setweight(to_tsvector('simple', coalesce(description, '')), 'C')"
+            )
+            cursor.execute(
+                "CREATE INDEX events_event_search_vector_gin ON events_event USING GIN (search_vector)"
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("DROP TABLE IF EXISTS events_event_fts_vocab")
+            cursor.execute("DROP TABLE IF EXISTS events_event_fts")
+        elif connection.vendor == 'postgresql':
+            cursor.execute("DROP INDEX IF EXISTS events_event_search_vector_gin")
+            cursor.execute("ALTER TABLE events_event DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0004_event_date_bounds'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 00:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0005_event_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventdate',
+            name='queue_enabled',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.6 on 2026-10-17 00:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0002_notification'),
+        ('events', '0006_eventdate_queue_enabled'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['created_at', 'id'], name='events_created_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['price', 'id'], name='events_price_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['next_date', 'first_date', 'id'], name='events_date_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userfavorite',
+            index=models.Index(fields=['user', 'created_at'], name='events_favorite_user_idx'),
+        ),
+    ]
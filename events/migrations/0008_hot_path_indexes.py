@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-17 00:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0007_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='eventdate',
+            index=models.Index(fields=['date', 'time'], name='events_eventdate_date_idx'),
+        ),
+    ]
@@ -3,6 +3,7 @@ from authentication.models import User, EventPlanner
 from django.utils.text import slugify
 import uuid
 from datetime import date
+from .geo import encode_geohash
 
 class Category(models.Model):
     name = models.CharField(max_length=50, unique=True)
@@ -11,50 +12,127 @@ class Category(models.Model):
         return self.name
 
 class Event(models.Model):
+    # Sizes of image generated for clients (core/images.py)
+    IMAGE_VARIANTS = ('thumb', 'card', 'hero')
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     planner = models.ForeignKey(EventPlanner, on_delete=models.CASCADE, related_name='events')
     title = models.CharField(max_length=255)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
     description = models.TextField()
     image = models.ImageField(upload_to='event_images/', null=True, blank=True)
+    # Resized copies of image, see core/images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     location = models.CharField(max_length=255)
     address = models.CharField(max_length=255)
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=3, default='USD')
     is_featured = models.BooleanField(default=False)
     highlights = models.JSONField(default=list, blank=True)
     categories = models.ManyToManyField(Category, related_name='events')
     review_count = models.PositiveIntegerField(default=0)
+    # Denormalized from EventDate so listings can filter and sort without a join
+    first_date = models.DateField(null=True, blank=True, db_index=True, editable=False)
+    last_date = models.DateField(null=True, blank=True, db_index=True, editable=False)
+    next_date = models.DateField(null=True, blank=True, db_index=True, editable=False)
     is_favorite = models.BooleanField(default=False)  # This will be used differently per user
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # Composite keys for the keyset-paginated listing sorts (core/pagination.py)
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='events_created_keyset_idx'),
+            models.Index(fields=['price', 'id'], name='events_price_keyset_idx'),
+            models.Index(fields=['next_date', 'first_date', 'id'], name='events_date_keyset_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.slug:
             # Generate a unique slug
             base_slug = slugify(self.title)
             unique_id = str(uuid.uuid4())[:8]
             self.slug = f"{base_slug}-{unique_id}"
+
+        # Keep the spatial index column in sync with the coordinates
+        self.geohash = self.compute_geohash()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+
         super().save(*args, **kwargs)
 
+    def compute_geohash(self):
+        """Return the geohash for this event's coordinates ('' if not geolocated)"""
+        if self.latitude is None or self.longitude is None:
+            return ''
+        return encode_geohash(self.latitude, self.longitude)
+
     def __str__(self):
         return self.title
     
     def get_date_range(self):
         """Return date range as a string (e.g., 'Mar 21 - May 03')"""
-        dates = self.dates.all().order_by('date')
-        if not dates:
+        return self.format_date_range(self.first_date, self.last_date)
+
+    @classmethod
+    def update_date_bounds(cls, event_ids, today=None):
+        """
+        Recompute first_date, last_date and next_date from EventDate rows
+
+        Called by every path that adds, moves or removes dates (the event
+        serializers, merge_dates, the importer and the admin); EventDate
+        itself never does, since bulk writes and cascades would bypass it.
+        next_date is relative to today, so roll_over_dates must also run
+        regularly (``backfill_event_dates --rolled-over --loop``).
+        """
+        today = today or date.today()
+        event_ids = list(event_ids)
+        bounds = {
+            row['event']: row
+            for row in EventDate.objects.filter(event__in=event_ids)
+            .values('event')
+            .annotate(
+                first=models.Min('date'),
+                last=models.Max('date'),
+                upcoming=models.Min('date', filter=models.Q(date__gte=today)),
+            )
+            .order_by()
+        }
+
+        events = []
+        for event_id in event_ids:
+            row = bounds.get(event_id, {})
+            events.append(cls(
+                pk=event_id,
+                first_date=row.get('first'),
+                last_date=row.get('last'),
+                next_date=row.get('upcoming'),
+            ))
+        cls.objects.bulk_update(events, ['first_date', 'last_date', 'next_date'], batch_size=500)
+
+    @classmethod
+    def roll_over_dates(cls, today=None, batch_size=500):
+        """Refresh the events whose next_date has passed; returns how many"""
+        today = today or date.today()
+        event_ids = list(cls.objects.filter(next_date__lt=today).order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(event_ids), batch_size):
+            cls.update_date_bounds(event_ids[start:start + batch_size], today=today)
+        return len(event_ids)
+
+    @staticmethod
+    def format_date_range(first_date, last_date):
+        """Format a first/last date pair (e.g., 'Mar 21 - May 03')"""
+        if first_date is None:
             return ""
         
-        first_date = dates.first().date
-        last_date = dates.last().date
-        
         # Format dates
         first_str = first_date.strftime("%b %d")
         
-        if first_date == last_date:
+        if last_date is None or first_date == last_date:
             return first_str
         
         last_str = last_date.strftime("%b %d")
@@ -74,21 +152,30 @@ class EventDate(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     capacity = models.PositiveIntegerField(default=100)
     tickets_sold = models.PositiveIntegerField(default=0)
+    # Flash sales: buyers must wait in the admission queue (tickets/admission.py)
+    queue_enabled = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['date', 'time']
         unique_together = ('event', 'date', 'time')
+        indexes = [
+            # Upcoming/past ticket filters and date-ordered planner reports
+            models.Index(fields=['date', 'time'], name='events_eventdate_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.event.title} - {self.date} {self.time}"
 
-    def save(self, *args, **kwargs):
+    def update_availability(self):
         if self.tickets_sold >= self.capacity:
             self.availability = 'Sold Out'
         elif self.tickets_sold >= (self.capacity * 0.8):
             self.availability = 'Limited'
         else:
             self.availability = 'Available'
+
+    def save(self, *args, **kwargs):
+        self.update_availability()
         super().save(*args, **kwargs)
 
 class UserFavorite(models.Model):
@@ -98,6 +185,9 @@ class UserFavorite(models.Model):
 
     class Meta:
         unique_together = ('user', 'event')
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='events_favorite_user_idx'),
+        ]
         
     def __str__(self):
         return f"{self.user.username} - {self.event.title}"
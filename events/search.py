@@ -0,0 +1,265 @@
+"""
+Full-text search for events.
+
+The index lives in the database next to the events:
+
+* SQLite: an FTS5 virtual table ``events_event_fts`` ranked with bm25
+* PostgreSQL: a weighted ``search_vector`` tsvector column with a GIN index
+
+Both are created by migration 0005 and updated incrementally whenever an
+Event is saved or deleted (see events/signals.py). Other databases, or a
+SQLite build without FTS5, fall back to icontains matching.
+
+Every term is matched as a prefix. When a query finds nothing, terms that are
+not in the index vocabulary are swapped for close spellings from it, which
+gives basic typo tolerance.
+"""
+import difflib
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+from .models import Event
+
+FTS_TABLE = 'events_event_fts'
+FTS_VOCAB_TABLE = 'events_event_fts_vocab'
+SEARCH_VECTOR_COLUMN = 'search_vector'
+
+# Longer queries are truncated to this many terms
+MAX_TERMS = 8
+
+# Spelling suggestions considered per unknown term
+MAX_SUGGESTIONS = 3
+SUGGESTION_CUTOFF = 0.75
+VOCABULARY_CACHE_TIMEOUT = 600
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_ROWID_MASK = (1 << 63) - 1
+
+
+def tokenize(query):
+    """Split a user query into lowercase search terms"""
+    return [term.lower() for term in _TOKEN_RE.findall(query)][:MAX_TERMS]
+
+
+class FallbackSearchBackend:
+    """Unindexed icontains matching, as DRF's SearchFilter did"""
+    search_fields = ('title', 'description', 'location')
+
+    def index_events(self, events):
+        pass
+
+    def remove_events(self, event_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, queryset, terms):
+        for term in terms:
+            term_filter = Q()
+            for field in self.search_fields:
+                term_filter |= Q(**{f'{field}__icontains': term})
+            queryset = queryset.filter(term_filter)
+        return queryset
+
+
+class IndexedSearchBackend(FallbackSearchBackend):
+    """Shared query handling for the database-native indexes"""
+
+    def search(self, queryset, terms):
+        results = self.match(queryset, [[term] for term in terms])
+        if results.exists():
+            return results
+
+        # Nothing matched: retry with close spellings of unknown terms
+        alternatives = [self.spelling_alternatives(term) for term in terms]
+        if all(alternative == [term] for alternative, term in zip(alternatives, terms)):
+            return results
+        return self.match(queryset, alternatives)
+
+    def spelling_alternatives(self, term):
+        vocabulary = self.vocabulary(term[0])
+        if any(word.startswith(term) for word in vocabulary):
+            return [term]
+        return [term] + difflib.get_close_matches(
+            term, vocabulary, n=MAX_SUGGESTIONS, cutoff=SUGGESTION_CUTOFF
+        )
+
+    def vocabulary(self, initial):
+        """Indexed words starting with ``initial``, cached briefly"""
+        key = f'events:search:vocabulary:{connection.vendor}:{initial}'
+        words = cache.get(key)
+        if words is None:
+            words = self.load_vocabulary(initial)
+            cache.set(key, words, VOCABULARY_CACHE_TIMEOUT)
+        return words
+
+    def load_vocabulary(self, initial):
+        raise NotImplementedError
+
+    def match(self, queryset, term_groups):
+        """Filter and rank ``queryset``; each group is a list of alternative terms"""
+        raise NotImplementedError
+
+
+class SQLiteSearchBackend(IndexedSearchBackend):
+    """
+    FTS5 index. Each row's rowid is derived from the event UUID, so updating or
+    deleting one event's entry is a rowid lookup rather than a table scan.
+    """
+
+    @staticmethod
+    def rowid(event_id):
+        return event_id.int & _ROWID_MASK
+
+    def index_events(self, events):
+        rows = [
+            (self.rowid(event.pk), str(event.pk), event.title, event.description, event.location)
+            for event in events
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT OR REPLACE INTO {FTS_TABLE} (rowid, event_id, title, description, location) '
+                f'VALUES (%s, %s, %s, %s, %s)',
+                rows,
+            )
+
+    def remove_events(self, event_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [(self.rowid(event_id),) for event_id in event_ids],
+            )
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        events = Event.objects.only('id', 'title', 'description', 'location')
+        batch = []
+        for event in events.iterator(chunk_size=1000):
+            batch.append(event)
+            if len(batch) == 1000:
+                self.index_events(batch)
+                batch = []
+        self.index_events(batch)
+
+    def load_vocabulary(self, initial):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT term FROM {FTS_VOCAB_TABLE} WHERE term >= %s AND term < %s',
+                [initial, initial + '\uffff'],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def match(self, queryset, term_groups):
+        match_query = ' AND '.join(
+            '(' + ' OR '.join(f'"{term}"*' for term in group) + ')'
+            for group in term_groups
+        )
+        # The index is joined into the filtered queryset, so category, date
+        # and map filters narrow the matches before any LIMIT. event_id holds
+        # the hyphenated UUID, the events table the bare hex.
+        # Column weights: event_id (unindexed), title, description, location;
+        # bm25 is lower-is-better, so it is flipped to sort descending.
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[
+                f'{FTS_TABLE} MATCH %s',
+                f"{Event._meta.db_table}.id = replace({FTS_TABLE}.event_id, '-', '')",
+            ],
+            params=[match_query],
+        ).annotate(
+            search_rank=RawSQL(f'-bm25({FTS_TABLE}, 0.0, 10.0, 1.0, 4.0)', [], output_field=FloatField()),
+        ).order_by('-search_rank')
+
+
+class PostgresSearchBackend(IndexedSearchBackend):
+    """Weighted tsvector column (title A, location B, description C) with a GIN index"""
+    vector_sql = (
+        "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(location, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(description, '')), 'C')"
+    )
+
+    def index_events(self, events):
+        event_ids = [event.pk for event in events]
+        if not event_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {Event._meta.db_table} SET {SEARCH_VECTOR_COLUMN} = {self.vector_sql} '
+                f'WHERE id = ANY(%s)',
+                [event_ids],
+            )
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {Event._meta.db_table} SET {SEARCH_VECTOR_COLUMN} = {self.vector_sql}')
+
+    def load_vocabulary(self, initial):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT word FROM ts_stat('SELECT {SEARCH_VECTOR_COLUMN} FROM {Event._meta.db_table}') "
+                f"WHERE word >= %s AND word < %s",
+                [initial, initial + '\uffff'],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def match(self, queryset, term_groups):
+        tsquery = ' & '.join(
+            '(' + ' | '.join(f'{term}:*' for term in group) + ')'
+            for group in term_groups
+        )
+        column = f'{Event._meta.db_table}.{SEARCH_VECTOR_COLUMN}'
+        return queryset.annotate(
+            search_match=RawSQL(f"{column} @@ to_tsquery('simple', %s)", [tsquery], output_field=BooleanField()),
+            search_rank=RawSQL(f"ts_rank({column}, to_tsquery('simple', %s))", [tsquery], output_field=FloatField()),
+        ).filter(search_match=True).order_by('-search_rank')
+
+
+_backends = {}
+
+
+def get_search_backend():
+    """Return the search backend for the default database"""
+    key = (connection.vendor, str(connection.settings_dict['NAME']))
+    if key not in _backends:
+        _backends[key] = _select_backend()
+    return _backends[key]
+
+
+def _select_backend():
+    if settings.EVENT_SEARCH_BACKEND == 'fallback':
+        return FallbackSearchBackend()
+
+    if connection.vendor == 'sqlite':
+        if FTS_TABLE in connection.introspection.table_names():
+            return SQLiteSearchBackend()
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            columns = connection.introspection.get_table_description(cursor, Event._meta.db_table)
+        if any(column.name == SEARCH_VECTOR_COLUMN for column in columns):
+            return PostgresSearchBackend()
+
+    return FallbackSearchBackend()
+
+
+class EventSearchFilter(filters.BaseFilterBackend):
+    """
+    Ranked full-text search over title, description and location
+
+    Results are ordered by relevance unless another ordering is applied later.
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        terms = tokenize(request.query_params.get(self.search_param, ''))
+        if not terms:
+            return queryset
+        return get_search_backend().search(queryset, terms)
@@ -1,21 +1,27 @@
 from rest_framework import serializers
+from core.images import ImageVariantsField, preferred_url
 from .models import Event, EventDate, Category, UserFavorite
+from .dates import merge_dates
 from django.db import transaction
 from datetime import datetime, timedelta
 
 class EventDateSerializer(serializers.ModelSerializer):
     class Meta:
         model = EventDate
-        fields = ['id', 'date', 'time', 'availability', 'price', 'capacity', 'tickets_sold']
+        fields = ['id', 'date', 'time', 'availability', 'price', 'capacity', 'tickets_sold', 'queue_enabled']
         read_only_fields = ['availability', 'tickets_sold']
 
+class EventDateWriteSerializer(EventDateSerializer):
+    # Lets an event update refer to a stored date, e.g. to move it to another time
+    id = serializers.IntegerField(required=False)
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'name']
 
 class EventSerializer(serializers.ModelSerializer):
-    dates = EventDateSerializer(many=True, required=False)
+    dates = EventDateWriteSerializer(many=True, required=False)
     categories = CategorySerializer(many=True, required=False, read_only=True)
     category_ids = serializers.PrimaryKeyRelatedField(
         many=True, 
@@ -26,11 +32,12 @@ class EventSerializer(serializers.ModelSerializer):
     )
     dateRange = serializers.SerializerMethodField()
     isFavorite = serializers.SerializerMethodField()
+    imageVariants = ImageVariantsField(source='image_variants')
 
     class Meta:
         model = Event
         fields = [
-            'id', 'title', 'description', 'image', 'location', 'address',
+            'id', 'title', 'description', 'image', 'imageVariants', 'location', 'address',
             'latitude', 'longitude', 'price', 'currency', 'is_featured', 
             'highlights', 'dates', 'categories', 'category_ids', 'dateRange',
             'review_count', 'isFavorite', 'created_at', 'updated_at'
@@ -66,9 +73,13 @@ class EventSerializer(serializers.ModelSerializer):
                 event.categories.set(categories)
 
             # Create dates
-            for date_data in dates_data:
-                EventDate.objects.create(event=event, **date_data)
+            EventDate.objects.bulk_create([
+                EventDate(event=event, **{name: value for name, value in date_data.items() if name != 'id'})
+                for date_data in dates_data
+            ])
+            Event.update_date_bounds([event.pk])
 
+        event.refresh_from_db(fields=['first_date', 'last_date', 'next_date'])
         return event
 
     """def update(self, instance, validated_data):
@@ -90,34 +101,42 @@ class EventSerializer(serializers.ModelSerializer):
         categories = validated_data.pop('categories', None)
         dates_data = validated_data.pop('dates', [])
 
-        # Update the event instance
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
+        with transaction.atomic():
+            # Update the event instance
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            instance.save()
 
-        # Update categories if provided
-        if categories is not None:
-            instance.categories.set(categories)
+            # Update categories if provided
+            if categories is not None:
+                instance.categories.set(categories)
 
-        # Handle dates
-        if dates_data:
-            instance.dates.all().delete()  # Remove existing dates
-            for date_data in dates_data:
-                EventDate.objects.create(event=instance, **date_data)
+            # Merge dates: only changed rows are written, dates with tickets are kept
+            if dates_data:
+                merge_dates(instance, dates_data)
+                instance.refresh_from_db(fields=['first_date', 'last_date', 'next_date'])
 
         return instance
 
 class EventListSerializer(serializers.ModelSerializer):
+    # Cards only need the small variants, never the original upload
+    image = serializers.SerializerMethodField()
+    imageVariants = ImageVariantsField(names=('thumb', 'card'), source='image_variants')
     dateRange = serializers.SerializerMethodField()
     isFavorite = serializers.SerializerMethodField()
     categories = serializers.StringRelatedField(many=True, read_only=True)
+    distance = serializers.SerializerMethodField()
 
     class Meta:
         model = Event
         fields = [
-            'id', 'title', 'image', 'location', 'price', 'currency', 
-            'is_featured', 'dateRange', 'review_count', 'isFavorite', 'categories'
+            'id', 'title', 'image', 'imageVariants', 'location', 'price', 'currency', 
+            'is_featured', 'dateRange', 'review_count', 'isFavorite', 'categories',
+            'distance'
         ]
+
+    def get_image(self, obj):
+        return preferred_url(obj.image, obj.image_variants, 'card', self.context.get('request'))
     
     def get_dateRange(self, obj):
         return obj.get_date_range()
@@ -125,13 +144,27 @@ class EventListSerializer(serializers.ModelSerializer):
     def get_isFavorite(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
+            if hasattr(obj, 'user_favorited'):
+                return obj.user_favorited
             return UserFavorite.objects.filter(user=request.user, event=obj).exists()
         return False
 
+    def get_distance(self, obj):
+        # Only present when the request supplied lat/lng
+        distance = getattr(obj, 'distance', None)
+        return round(distance, 3) if distance is not None else None
+
 class MapEventSerializer(serializers.ModelSerializer):
+    distance = serializers.SerializerMethodField()
+
     class Meta:
         model = Event
-        fields = ['id', 'title', 'location', 'latitude', 'longitude']
+        fields = ['id', 'title', 'location', 'latitude', 'longitude', 'distance']
+
+    def get_distance(self, obj):
+        # Only present when the request supplied lat/lng
+        distance = getattr(obj, 'distance', None)
+        return round(distance, 3) if distance is not None else None
 
 class UserFavoriteSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,39 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from core.cache import bump_generation
+from core.images import schedule_variants, variants_generated
+from .dates import event_dates_changed
+from .models import Event, EventDate, Category
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+@receiver(post_save, sender=EventDate)
+@receiver(post_delete, sender=EventDate)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(m2m_changed, sender=Event.categories.through)
+@receiver(event_dates_changed)
+@receiver(variants_generated, sender=Event)
+def invalidate_event_caches(sender, **kwargs):
+    """Cached listings and map tiles depend on events, their dates and categories"""
+    # After commit, so a concurrent request can't re-cache the old rows
+    transaction.on_commit(lambda: bump_generation('events'))
+
+
+@receiver(post_save, sender=Event)
+def index_event(sender, instance, **kwargs):
+    get_search_backend().index_events([instance])
+
+
+@receiver(post_delete, sender=Event)
+def unindex_event(sender, instance, **kwargs):
+    get_search_backend().remove_events([instance.pk])
+
+
+@receiver(post_save, sender=Event)
+def make_image_variants(sender, instance, **kwargs):
+    schedule_variants(instance, 'image', 'image_variants', Event.IMAGE_VARIANTS)
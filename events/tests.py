@@ -1,3 +1,665 @@
-from django.test import TestCase
+from django.test import RequestFactory, TestCase, override_settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+from datetime import date, time, timedelta
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+
+from authentication.models import User, EventPlanner
+from core.cache import response_cache_key
+from core.explain import captured_full_scans
+from tickets.models import Ticket
+from .dates import DateChanges, event_dates_changed
+from .geo import NEAREST_MAX_STEPS, nearest
+from .models import Event, EventDate, Category, UserFavorite
+
+
+class EventTestCase(TestCase):
+    """A fan, an approved planner and an anonymous client"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='fan@example.com', username='fan', password='pass1234')
+        planner_user = User.objects.create_user(email='planner@example.com', username='planner', password='pass1234')
+        self.planner = EventPlanner.objects.create(
+            user=planner_user, phone='0700000000', national_id='123', status='approved'
+        )
+        self.client = APIClient()
+        cache.clear()
+
+    def create_event(self, title='Concert', days=(), **fields):
+        """An event of the planner, with a date at 18:00 this many days from today for each of ``days``"""
+        fields = {'description': 'Description', 'location': 'Nairobi', 'address': 'Street', 'price': 10, **fields}
+        event = Event.objects.create(planner=self.planner, title=title, **fields)
+        for offset in days:
+            EventDate.objects.create(event=event, date=date.today() + timedelta(days=offset), time=time(18, 0))
+        if days:
+            Event.update_date_bounds([event.pk])
+            event.refresh_from_db()
+        return event
+
+
+class EventListQueryCountTests(EventTestCase):
+    def setUp(self):
+        super().setUp()
+        self.categories = [Category.objects.create(name=name) for name in ('Music', 'Food')]
+        self.client.force_authenticate(self.user)
+
+    def create_events(self, count):
+        for i in range(count):
+            event = self.create_event(f'Event {i}', days=(i, i + 3), price=10 + i)
+            event.categories.set(self.categories)
+            if i % 2:
+                UserFavorite.objects.create(user=self.user, event=event)
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/events/', {'category': 'Music', 'sortBy': 'Price: Low to High'})
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.json()['results']
+
+    def test_query_count_is_independent_of_result_size(self):
+        self.create_events(2)
+        small_count, _ = self.count_list_queries()
+
+        self.create_events(18)
+        large_count, results = self.count_list_queries()
+
+        self.assertEqual(len(results), 20)
+        self.assertEqual(small_count, large_count)
+
+    def test_precomputed_fields_match_model(self):
+        self.create_events(3)
+        _, results = self.count_list_queries()
+
+        for item in results:
+            event = Event.objects.get(id=item['id'])
+            self.assertEqual(item['dateRange'], event.get_date_range())
+            self.assertEqual(
+                item['isFavorite'],
+                UserFavorite.objects.filter(user=self.user, event=event).exists()
+            )
+            self.assertEqual(sorted(item['categories']), ['Food', 'Music'])
+
+
+class EventDateBoundsTests(EventTestCase):
+    def test_columns_follow_event_dates(self):
+        event = self.create_event('Festival', days=(-2, 5, 9))
+        self.assertEqual(event.first_date, date.today() - timedelta(days=2))
+        self.assertEqual(event.last_date, date.today() + timedelta(days=9))
+        self.assertEqual(event.next_date, date.today() + timedelta(days=5))
+
+    def test_passed_dates_roll_over(self):
+        event = self.create_event('Festival', days=(-2, 5))
+        # As the columns stood three days ago
+        Event.update_date_bounds([event.pk], today=date.today() - timedelta(days=3))
+        event.refresh_from_db()
+        self.assertEqual(event.next_date, date.today() - timedelta(days=2))
+
+        call_command('backfill_event_dates', rolled_over=True, stdout=io.StringIO())
+        event.refresh_from_db()
+        self.assertEqual(event.next_date, date.today() + timedelta(days=5))
+
+    def test_added_date_updates_the_columns(self):
+        soon = self.create_event('Soon', days=(5,))
+        event = self.create_event('Festival', days=(9,))
+        self.client.force_authenticate(self.planner.user)
+
+        response = self.client.post(
+            f'/api/events/{event.id}/add_date/', {'date': str(date.today() + timedelta(days=2)), 'time': '18:00'},
+        )
+        self.assertEqual(response.status_code, 201)
+        event.refresh_from_db()
+        self.assertEqual(event.next_date, date.today() + timedelta(days=2))
+
+        response = self.client.get('/api/events/', {'sortBy': 'Date'})
+        self.assertEqual([item['id'] for item in response.json()['results']], [str(event.id), str(soon.id)])
+
+    def test_date_filter_and_sort_use_actual_dates(self):
+        later = self.create_event('Later', days=(3, 4))
+        # Spans today but has no date on it
+        self.create_event('Gap', days=(-1, 1))
+        today = self.create_event('Today', days=(0,))
+
+        response = self.client.get('/api/events/', {'dateFilter': 'Today'})
+        self.assertEqual([item['id'] for item in response.json()['results']], [str(today.id)])
+
+        response = self.client.get('/api/events/', {'sortBy': 'Date'})
+        titles = [item['title'] for item in response.json()['results']]
+        self.assertEqual(titles, ['Today', 'Gap', 'Later'])
+        self.assertEqual(len(titles), len(set(titles)))
+
+
+class EventResponseCacheTests(EventTestCase):
+    def create_event(self, title):
+        with self.captureOnCommitCallbacks(execute=True):
+            return super().create_event(title, days=(0,))
+
+    def test_anonymous_list_is_cached_until_events_change(self):
+        self.create_event('First')
+
+        response = self.client.get('/api/events/', {'sortBy': 'Date'})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/events/', {'sortBy': 'Date', 'category': ''})
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(len(context.captured_queries), 0)
+
+        response = self.client.get('/api/events/', {'sortBy': 'Date'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.create_event('Second')
+        response = self.client.get('/api/events/', {'sortBy': 'Date'})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.json()['results']), 2)
+
+    @override_settings(ALLOWED_HOSTS=['*'])
+    def test_hosts_are_cached_apart(self):
+        self.create_event('First')
+        self.create_event('Second')
+
+        response = self.client.get('/api/events/', {'page_size': 1}, HTTP_HOST='a.example')
+        self.assertTrue(response.json()['next'].startswith('http://a.example/'))
+        response = self.client.get('/api/events/', {'page_size': 1}, HTTP_HOST='b.example')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertTrue(response.json()['next'].startswith('http://b.example/'))
+
+    def test_refresh_lock_is_released_when_the_view_fails(self):
+        request = Request(RequestFactory().get('/api/events/', {'cursor': 'bad'}))
+        key = response_cache_key('events', request)
+        cache.set(key, {'data': {}, 'etag': '"stale"', 'fresh_until': 0})
+
+        response = self.client.get('/api/events/', {'cursor': 'bad'})
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(cache.get(f'{key}:refresh'))
+
+    def test_authenticated_requests_bypass_cache(self):
+        self.create_event('First')
+        self.client.force_authenticate(self.planner.user)
+
+        response = self.client.get('/api/events/')
+        self.assertNotIn('X-Cache', response)
+
+
+class EventPaginationTests(EventTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        self.events = [
+            self.create_event(f'Event {i}', days=(i % 2,) if i % 3 else (), price=10 + i % 2)
+            for i in range(7)
+        ]
+
+    def walk(self, url, params):
+        ids = []
+        response = self.client.get(url, {**params, 'page_size': 3})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page['results']), 3)
+            ids.extend(item['id'] for item in page['results'])
+            if not page['next']:
+                return ids
+            response = self.client.get(page['next'])
+
+    def test_pages_cover_every_event_once_despite_ties(self):
+        for sort_by in ('Recommended', 'Date', 'Price: Low to High', 'Price: High to Low'):
+            ids = self.walk('/api/events/', {'sortBy': sort_by})
+            self.assertEqual(sorted(ids), sorted(str(event.id) for event in self.events), sort_by)
+
+        prices = [Event.objects.get(id=event_id).price for event_id in self.walk('/api/events/', {'sortBy': 'Price: High to Low'})]
+        self.assertEqual(prices, sorted(prices, reverse=True))
+
+    def test_invalid_or_mismatched_cursor_is_rejected(self):
+        response = self.client.get('/api/events/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+        cursor = self.client.get('/api/events/', {'sortBy': 'Date', 'page_size': 2}).json()['next'].split('cursor=')[1]
+        response = self.client.get('/api/events/', {'sortBy': 'Price: Low to High', 'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+
+    def test_favorites_are_paginated_newest_first(self):
+        now = timezone.now()
+        for i, event in enumerate(self.events[:5]):
+            favorite = UserFavorite.objects.create(user=self.user, event=event)
+            UserFavorite.objects.filter(pk=favorite.pk).update(created_at=now + timedelta(seconds=i))
+
+        ids = self.walk('/api/events/favorites/', {})
+        self.assertEqual(ids, [str(event.id) for event in reversed(self.events[:5])])
+
+        response = self.client.get('/api/events/favorites/')
+        self.assertTrue(all(item['isFavorite'] for item in response.json()['results']))
+
+
+    def test_categories_are_paginated(self):
+        categories = [Category.objects.create(name=f'Category {i}') for i in range(4)]
+        ids = self.walk('/api/categories/', {})
+        self.assertEqual(sorted(ids), sorted(category.id for category in categories))
+
+
+class EventIndexPlanTests(EventTestCase):
+    """The listing queries must reach events through an index, never a table scan"""
+    TABLES = ('events_event', 'events_eventdate', 'events_userfavorite')
+
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='Music')
+        for i in range(3):
+            event = self.create_event(f'Event {i}', days=(i,), price=10 + i, latitude=-1.28, longitude=36.82)
+            event.categories.add(category)
+            UserFavorite.objects.create(user=self.user, event=event)
+        self.client.force_authenticate(self.user)
+
+    def assertNoFullScans(self, path, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path, params or {})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(captured_full_scans(context.captured_queries, self.TABLES), [], f'{path} {params}')
+
+    def test_listing_sorts_and_filters_use_indexes(self):
+        for sort_by in ('Recommended', 'Date', 'Price: Low to High', 'Price: High to Low'):
+            self.assertNoFullScans('/api/events/', {'sortBy': sort_by})
+        self.assertNoFullScans('/api/events/', {'dateFilter': 'This Week', 'category': 'Music'})
+        self.assertNoFullScans('/api/events/', {'sortBy': 'Price: Low to High', 'page_size': 1})
+        next_page = self.client.get('/api/events/', {'sortBy': 'Date', 'page_size': 1}).json()['next']
+        self.assertNoFullScans(next_page)
+
+    def test_planner_favorites_and_map_queries_use_indexes(self):
+        self.client.force_authenticate(self.planner.user)
+        self.assertNoFullScans('/api/events/', {'plannerOnly': 'true'})
+        self.client.force_authenticate(self.user)
+        self.assertNoFullScans('/api/events/favorites/')
+        self.assertNoFullScans('/api/events/map_events/', {'bbox': '36.7,-1.4,36.9,-1.2'})
+
+
+class NearestEventTests(EventTestCase):
+    def setUp(self):
+        super().setUp()
+        # Roughly 1, 10 and 500 km north of the point
+        self.events = [
+            self.create_event(title, latitude=-1.28 + offset, longitude=36.82)
+            for title, offset in (('Near', 0.009), ('Town', 0.09), ('Far', 4.5))
+        ]
+
+    def test_nearest_stops_growing_once_enough_events(self):
+        queryset = Event.objects.all()
+        # 2 km, 8 km, then 32 km holds both
+        with self.assertNumQueries(3):
+            events = nearest(queryset, -1.28, 36.82, 2)
+        self.assertEqual([event.title for event in events], ['Near', 'Town'])
+
+        # Too few events anywhere: a bounded number of queries, then everything
+        with self.assertNumQueries(NEAREST_MAX_STEPS + 1):
+            events = nearest(queryset, -1.28, 36.82, 5)
+        self.assertEqual([event.title for event in events], ['Near', 'Town', 'Far'])
+
+    def test_map_limit_respects_radius(self):
+        response = self.client.get('/api/events/map_events/', {'lat': -1.28, 'lng': 36.82, 'limit': 5, 'radius': 50})
+        self.assertEqual([item['title'] for item in response.json()], ['Near', 'Town'])
+        response = self.client.get('/api/events/map_events/', {'lat': -1.28, 'lng': 36.82, 'limit': 0})
+        self.assertEqual(response.status_code, 400)
+
+
+class MapClusterTests(EventTestCase):
+    def setUp(self):
+        super().setUp()
+        self.events = [
+            self.create_event(f'Event {i}', latitude=-1.28 + i * 0.001, longitude=36.82, is_featured=i == 0)
+            for i in range(5)
+        ]
+        now = timezone.now()
+        for i, event in enumerate(self.events):
+            Event.objects.filter(pk=event.pk).update(created_at=now + timedelta(seconds=i))
+
+    def test_representatives_are_ranked_in_the_database(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/events/map_clusters/', {'bbox': '30,-5,40,5', 'zoom': 3})
+        [cluster] = response.json()['clusters']
+        self.assertEqual(cluster['count'], 5)
+        expected = [self.events[0], self.events[4], self.events[3]]
+        self.assertEqual(cluster['event_ids'], [str(event.id) for event in expected])
+        self.assertTrue(any('ROW_NUMBER' in query['sql'] for query in context.captured_queries))
+
+    def test_pins_are_capped_per_tile(self):
+        response = self.client.get('/api/events/map_clusters/', {'bbox': '36.8,-1.3,36.9,-1.2', 'zoom': 18})
+        data = response.json()
+        self.assertEqual(len(data['events']), 5)
+        self.assertFalse(data['truncated'])
+
+    def test_only_known_filters_are_cached(self):
+        Category.objects.create(name='Live Music')
+        viewport = {'bbox': '30,-5,40,5', 'zoom': 3}
+        for params in ({'category': 'x' * 300}, {'dateFilter': 'Next Year'}):
+            response = self.client.get('/api/events/map_clusters/', {**viewport, **params})
+            self.assertEqual(response.status_code, 400)
+
+        with mock.patch('events.clustering.cache.set') as cache_set:
+            response = self.client.get('/api/events/map_clusters/', {
+                **viewport, 'category': 'Live Music', 'dateFilter': 'This Weekend',
+            })
+        self.assertEqual(response.status_code, 200)
+        keys = [call.args[0] for call in cache_set.call_args_list]
+        self.assertTrue(keys)
+        for key in keys:
+            self.assertNotIn(' ', key)
+            self.assertLessEqual(len(key), 250)
+
+
+class EventSearchTests(EventTestCase):
+    def setUp(self):
+        super().setUp()
+        music, food = Category.objects.create(name='Music'), Category.objects.create(name='Food')
+        for i in range(6):
+            event = self.create_event(f'Jazz night {i}', description='Live music')
+            event.categories.add(music if i % 3 == 0 else food)
+        self.create_event('Comedy', description='Stand-up').categories.add(music)
+
+    def walk(self, params):
+        titles, response = [], self.client.get('/api/events/', {**params, 'page_size': 1})
+        while True:
+            page = response.json()
+            titles.extend(item['title'] for item in page['results'])
+            if not page['next']:
+                return titles
+            response = self.client.get(page['next'])
+
+    def test_filters_apply_before_ranking_and_pages_cover_all_matches(self):
+        self.assertEqual(sorted(self.walk({'search': 'jazz', 'category': 'Music'})), ['Jazz night 0', 'Jazz night 3'])
+        titles = self.walk({'search': 'jazz'})
+        self.assertEqual(sorted(titles), [f'Jazz night {i}' for i in range(6)])
+
+    def test_results_are_ranked_by_relevance(self):
+        self.create_event('Open mic', description='Poetry and comedy')
+        response = self.client.get('/api/events/', {'search': 'comedy'})
+        # A match in the title outweighs one in the description
+        self.assertEqual([item['title'] for item in response.json()['results']], ['Comedy', 'Open mic'])
+
+    def test_equally_relevant_results_are_ordered_by_pk(self):
+        # bm25 scores these two the same, so the pagination tiebreak decides
+        special = self.create_event('Comedy special', description='Jokes')
+        comedy = Event.objects.get(title='Comedy')
+        response = self.client.get('/api/events/', {'search': 'comedy'})
+        expected = sorted([comedy, special], key=lambda event: event.pk, reverse=True)
+        self.assertEqual([item['id'] for item in response.json()['results']], [str(event.id) for event in expected])
+
+    def test_misspelled_terms_fall_back_to_close_words(self):
+        response = self.client.get('/api/events/', {'search': 'comedyy'})
+        self.assertEqual([item['title'] for item in response.json()['results']], ['Comedy'])
+
+
+class EventImportTests(EventTestCase):
+    CSV = (
+        'title,description,location,address,price,categories,dates,capacity\n'
+        'Jazz Night,Live jazz,Nairobi,Street,15,Music,2030-01-10 19:00;2030-01-11 19:00,50\n'
+        'Broken,No price,Nairobi,Street,,Music,2030-01-12 19:00,\n'
+        'Food Fair,Street food,Mombasa,Beach Rd,5,Food;Music,2030-02-01 10:00,\n'
+        'Mystery,Unknown,Nairobi,Street,5,Opera,2030-02-02 10:00,\n'
+    )
+
+    def setUp(self):
+        super().setUp()
+        for name in ('Music', 'Food'):
+            Category.objects.create(name=name)
+        self.client.force_authenticate(self.planner.user)
+
+    def upload(self, name, content, **data):
+        upload = SimpleUploadedFile(name, content.encode())
+        return self.client.post('/api/events/import/', {'file': upload, **data}, format='multipart')
+
+    def test_csv_import_creates_valid_rows_and_reports_the_rest(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.upload('events.csv', self.CSV)
+
+        self.assertEqual(response.status_code, 201)
+        result = response.json()
+        self.assertEqual((result['created'], result['failed']), (2, 2))
+        self.assertEqual([error['row'] for error in result['errors']], [3, 5])
+        self.assertIn('price', result['errors'][0]['errors'])
+        self.assertIn('categories', result['errors'][1]['errors'])
+
+        jazz = Event.objects.get(title='Jazz Night')
+        self.assertEqual(jazz.planner, self.planner)
+        self.assertTrue(jazz.slug.startswith('jazz-night-'))
+        self.assertEqual(jazz.first_date, date(2030, 1, 10))
+        self.assertEqual(jazz.last_date, date(2030, 1, 11))
+        self.assertEqual(list(jazz.dates.values_list('capacity', flat=True)), [50, 50])
+        food = Event.objects.get(title='Food Fair')
+        self.assertEqual(sorted(food.categories.values_list('name', flat=True)), ['Food', 'Music'])
+
+        # Imported events are searchable and listed like any other
+        titles = [item['title'] for item in self.client.get('/api/events/', {'search': 'jazz'}).json()['results']]
+        self.assertEqual(titles, ['Jazz Night'])
+
+    def test_ndjson_import_in_batches(self):
+        lines = [
+            json.dumps({
+                'title': f'Show {i}', 'description': 'Show', 'location': 'Nairobi', 'address': 'Street',
+                'price': '10.00', 'dates': [{'date': '2030-03-01', 'time': f'{10 + i}:00'}],
+            })
+            for i in range(5)
+        ]
+        lines.insert(2, 'not json')
+
+        # Categories once, then per batch of two rows: savepoint, events, dates,
+        # date bounds (select + update), search index, release
+        with self.settings(IMPORT_BATCH_SIZE=2):
+            with self.assertNumQueries(1 + 3 * 7):
+                response = self.upload('shows.ndjson', '\n'.join(lines))
+
+        self.assertEqual((response.json()['created'], response.json()['failed']), (5, 1))
+        self.assertEqual(response.json()['errors'][0]['row'], 3)
+        self.assertEqual(EventDate.objects.filter(event__planner=self.planner).count(), 5)
+
+    def test_unreadable_file_reports_where_the_import_stopped(self):
+        # Long enough rows that the bad byte is decoded after several batches
+        lines = [
+            json.dumps({
+                'title': f'Show {i}', 'description': 'x' * 1000, 'location': 'Nairobi', 'address': 'Street',
+                'price': '10.00', 'dates': [{'date': '2030-03-01', 'time': '10:00'}],
+            })
+            for i in range(30)
+        ]
+        content = '\n'.join(lines).encode() + b'\n\xff\n'
+        with self.settings(IMPORT_BATCH_SIZE=2):
+            response = self.client.post(
+                '/api/events/import/', {'file': SimpleUploadedFile('shows.ndjson', content)}, format='multipart',
+            )
+
+        self.assertEqual(response.status_code, 400)
+        result = response.json()
+        self.assertEqual(result['stopped']['error'], 'Must be UTF-8 encoded')
+        after_row = result['stopped']['after_row']
+        self.assertTrue(0 < after_row <= len(lines))
+        self.assertEqual(result['created'], after_row)
+        self.assertEqual(
+            list(Event.objects.filter(planner=self.planner, title__startswith='Show ').order_by('title').values_list('title', flat=True)),
+            sorted(f'Show {i}' for i in range(after_row)),
+        )
+
+    def test_only_approved_planners_or_superusers_import(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.upload('events.csv', self.CSV).status_code, 403)
+
+        admin = User.objects.create_superuser(email='admin@example.com', username='admin', password='pass1234')
+        self.client.force_authenticate(admin)
+        response = self.upload('events.csv', self.CSV, planner=self.planner.pk)
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual(self.upload('events.txt', self.CSV, planner=self.planner.pk).status_code, 400)
+
+    def test_management_command(self):
+        path = os.path.join(tempfile.mkdtemp(), 'events.csv')
+        with open(path, 'w') as handle:
+            handle.write(self.CSV)
+        self.addCleanup(os.remove, path)
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_events', path, planner='planner@example.com', stdout=stdout, stderr=stderr)
+        self.assertIn('Imported 2 events', stdout.getvalue())
+        self.assertIn('Row 3:', stderr.getvalue())
+
+
+class EventDateMergeTests(EventTestCase):
+    def setUp(self):
+        super().setUp()
+        self.event = self.create_event('Festival')
+        self.sold, self.quiet, self.dropped = [
+            EventDate.objects.create(event=self.event, date=date(2030, 5, day), time=time(18, 0), capacity=10)
+            for day in (1, 2, 3)
+        ]
+        self.ticket = Ticket.objects.create(
+            user=self.user, event=self.event, event_date=self.sold, quantity=2,
+            total_price=20, service_fee=0, payment_method='MPESA', status='CONFIRMED',
+        )
+        EventDate.objects.filter(pk=self.sold.pk).update(tickets_sold=2)
+        self.client.force_authenticate(self.planner.user)
+
+        self.changes = []
+        event_dates_changed.connect(self.record, sender=Event)
+        self.addCleanup(event_dates_changed.disconnect, self.record, sender=Event)
+
+    def record(self, sender, changes, **kwargs):
+        self.changes.append(changes)
+
+    def patch_dates(self, dates):
+        return self.client.patch(f'/api/events/{self.event.pk}/', {'dates': dates}, format='json')
+
+    def test_only_changed_dates_are_written(self):
+        response = self.patch_dates([
+            {'date': '2030-05-01', 'time': '18:00', 'capacity': 20},
+            {'date': '2030-05-02', 'time': '18:00', 'capacity': 10},
+            {'date': '2030-05-09', 'time': '20:00'},
+        ])
+        self.assertEqual(response.status_code, 200)
+
+        self.sold.refresh_from_db()
+        self.assertEqual((self.sold.capacity, self.sold.tickets_sold), (20, 2))
+        self.assertTrue(Ticket.objects.filter(pk=self.ticket.pk).exists())
+        self.assertFalse(EventDate.objects.filter(pk=self.dropped.pk).exists())
+        added = EventDate.objects.get(event=self.event, date=date(2030, 5, 9))
+
+        self.assertEqual(self.changes, [DateChanges(created=[added.pk], updated=[self.sold.pk], deleted=[self.dropped.pk])])
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.last_date, date(2030, 5, 9))
+
+    def test_date_moved_by_id_keeps_its_tickets(self):
+        response = self.patch_dates([
+            {'id': self.sold.pk, 'date': '2030-05-01', 'time': '20:00'},
+            {'date': '2030-05-02', 'time': '18:00'},
+            {'date': '2030-05-03', 'time': '18:00'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Ticket.objects.get(pk=self.ticket.pk).event_date.time, time(20, 0))
+        self.assertEqual(self.changes, [DateChanges(created=[], updated=[self.sold.pk], deleted=[])])
+
+    def test_unchanged_dates_write_nothing(self):
+        response = self.patch_dates([
+            {'date': '2030-05-0%d' % day, 'time': '18:00'} for day in (1, 2, 3)
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.changes, [])
+
+    def test_dates_with_tickets_are_not_dropped(self):
+        for dates in (
+            [{'date': '2030-05-02', 'time': '18:00'}],
+            [{'date': '2030-05-01', 'time': '18:00', 'capacity': 1}, {'date': '2030-05-02', 'time': '18:00'}],
+            [{'date': '2030-05-02', 'time': '18:00'}, {'date': '2030-05-02', 'time': '18:00'}],
+        ):
+            self.assertEqual(self.patch_dates(dates).status_code, 400, dates)
+        self.assertEqual(EventDate.objects.filter(event=self.event).count(), 3)
+        self.assertEqual(self.changes, [])
+
+
+@override_settings(IMAGE_WORKERS=0)
+class EventImageVariantTests(EventTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def image(self, size, color='red', name='poster.jpg'):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, color).save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def create_event(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            event = super().create_event('Festival', image=image)
+        event.refresh_from_db()
+        return event
+
+    def test_variants_are_generated_after_upload(self):
+        event = self.create_event(self.image((2000, 1200)))
+
+        sizes = {name: (event.image_variants[name]['width'], event.image_variants[name]['height'])
+                 for name in Event.IMAGE_VARIANTS}
+        self.assertEqual(sizes, {'thumb': (160, 160), 'card': (640, 360), 'hero': (1500, 900)})
+        self.assertEqual(event.image_variants['source'], event.image.name)
+        card = event.image_variants['card']
+        self.assertRegex(card['webp'], r'^blobs/[0-9a-f]{2}/[0-9a-f]{64}\.webp$')
+        with default_storage.open(card['webp']) as handle, Image.open(handle) as variant:
+            self.assertEqual((variant.format, variant.size), ('WEBP', (640, 360)))
+
+    def test_list_ships_small_variants_only(self):
+        event = self.create_event(self.image((2000, 1200)))
+
+        item = self.client.get('/api/events/').json()['results'][0]
+        self.assertTrue(item['image'].endswith(event.image_variants['card']['jpeg']))
+        self.assertEqual(sorted(item['imageVariants']), ['card', 'thumb'])
+        self.assertEqual(item['imageVariants']['thumb']['width'], 160)
+
+        detail = self.client.get(f'/api/events/{event.pk}/').json()
+        self.assertEqual(sorted(detail['imageVariants']), ['card', 'hero', 'thumb'])
+
+    def test_small_images_are_not_upscaled_and_same_content_reuses_files(self):
+        first = self.create_event(self.image((100, 50)))
+        self.assertEqual((first.image_variants['thumb']['width'], first.image_variants['thumb']['height']), (50, 50))
+        self.assertEqual((first.image_variants['hero']['width'], first.image_variants['hero']['height']), (100, 50))
+
+        second = self.create_event(self.image((100, 50), name='again.jpg'))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image_variants['card'], second.image_variants['card'])
+
+    def test_replacing_or_removing_the_image_updates_variants(self):
+        event = self.create_event(self.image((800, 600)))
+        old_card = event.image_variants['card']['jpeg']
+
+        event.image = self.image((800, 600), color='blue', name='new.jpg')
+        with self.captureOnCommitCallbacks(execute=True):
+            event.save()
+        event.refresh_from_db()
+        self.assertNotEqual(event.image_variants['card']['jpeg'], old_card)
+
+        event.image = None
+        event.save()
+        event.refresh_from_db()
+        self.assertEqual(event.image_variants, {})
+
+    def test_command_fills_in_missing_variants(self):
+        event = self.create_event(self.image((800, 600)))
+        self.planner.user.avatar = self.image((300, 300), name='me.jpg')
+        self.planner.user.save()
+        Event.objects.filter(pk=event.pk).update(image_variants={})
+
+        call_command('generate_image_variants', workers=1, stdout=io.StringIO())
+
+        event.refresh_from_db()
+        self.assertEqual(event.image_variants['source'], event.image.name)
+        self.planner.user.refresh_from_db()
+        self.assertEqual(sorted(self.planner.user.avatar_variants), ['card', 'source', 'thumb'])
@@ -2,23 +2,83 @@ from django.shortcuts import get_object_or_404
 from rest_framework import viewsets, permissions, status, filters
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from django_filters.rest_framework import DjangoFilterBackend
 from datetime import datetime, timedelta, date
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
 
 from .models import Event, EventDate, Category, UserFavorite
+from .geo import annotate_distance, nearest, within_bbox, within_radius
+from .clustering import MAX_ZOOM, get_map_clusters
+from .importer import IMPORT_FORMATS, import_events, read_rows, text_stream
+from .search import EventSearchFilter
 from .serializers import (
     EventSerializer, EventListSerializer, EventDateSerializer,
     CategorySerializer, MapEventSerializer, UserFavoriteSerializer
 )
 from authentication.models import EventPlanner
-from rest_framework.exceptions import ValidationError
+from core.cache import cache_response
+from core.pagination import KeysetPagination
+from rest_framework.exceptions import PermissionDenied, ValidationError
 import logging
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
 
+DATE_FILTERS = ('All', 'Today', 'Tomorrow', 'This Weekend', 'This Week', 'This Month')
+
+
+def get_date_window(date_filter, today=None):
+    """Return the (start, end) dates covered by a dateFilter value, or None for 'All'"""
+    today = today or date.today()
+
+    if date_filter == 'Today':
+        return today, today
+    elif date_filter == 'Tomorrow':
+        tomorrow = today + timedelta(days=1)
+        return tomorrow, tomorrow
+    elif date_filter == 'This Weekend':
+        # Get next Saturday and Sunday
+        days_until_weekend = (5 - today.weekday()) % 7
+        saturday = today + timedelta(days=days_until_weekend)
+        return saturday, saturday + timedelta(days=1)
+    elif date_filter == 'This Week':
+        # Get dates for the next 7 days
+        return today, today + timedelta(days=7)
+    elif date_filter == 'This Month':
+        # Get dates for the current month
+        next_month = today.replace(day=1)
+        if today.month == 12:
+            next_month = next_month.replace(year=today.year + 1, month=1)
+        else:
+            next_month = next_month.replace(month=today.month + 1)
+        return today, next_month - timedelta(days=1)
+    return None
+
+
+def filter_by_date(queryset, date_filter):
+    """
+    Keep events with a date inside the dateFilter window
+
+    The indexed first_date/last_date columns prune events whose span cannot
+    overlap the window; an EXISTS check then confirms an actual date falls in
+    it. Nothing joins events_eventdate, so no duplicates or DISTINCT.
+    """
+    window = get_date_window(date_filter)
+    if window is None:
+        return queryset
+
+    start, end = window
+    return queryset.filter(
+        first_date__lte=end,
+        last_date__gte=start,
+    ).filter(
+        Exists(EventDate.objects.filter(event=OuterRef('pk'), date__range=(start, end)))
+    )
+
+
 
 class IsEventPlannerOrReadOnly(permissions.BasePermission):
     """
@@ -52,9 +112,9 @@ class IsEventPlannerOrReadOnly(permissions.BasePermission):
 class EventViewSet(viewsets.ModelViewSet):
     queryset = Event.objects.all()
     permission_classes = [IsEventPlannerOrReadOnly]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, EventSearchFilter, filters.OrderingFilter]
     filterset_fields = ['location', 'price']
-    search_fields = ['title', 'description', 'location']
     ordering_fields = ['price', 'created_at']
 
 
@@ -138,7 +198,7 @@ class EventViewSet(viewsets.ModelViewSet):
 
 
     def get_serializer_class(self):
-        if self.action == 'list':
+        if self.action in ('list', 'favorites'):
             return EventListSerializer
         elif self.action == 'map_events':
             return MapEventSerializer
@@ -152,6 +212,77 @@ class EventViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(planner=self.request.user.planner_profile)
 
+    def _get_float_param(self, name, minimum=None, maximum=None):
+        value = self.request.query_params.get(name)
+        if value in (None, ''):
+            return None
+        try:
+            value = float(value)
+        except ValueError:
+            raise ValidationError({name: "Must be a number"})
+        if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            raise ValidationError({name: f"Must be between {minimum} and {maximum}"})
+        return value
+
+    def _get_point(self):
+        """Return the (lat, lng) supplied as query params, or None"""
+        latitude = self._get_float_param('lat', -90, 90)
+        longitude = self._get_float_param('lng', -180, 180)
+        if latitude is None or longitude is None:
+            return None
+        return latitude, longitude
+
+    def _get_bbox(self):
+        """Return the bbox query param (minLng,minLat,maxLng,maxLat) as (min_lat, min_lng, max_lat, max_lng)"""
+        bbox = self.request.query_params.get('bbox')
+        if not bbox:
+            return None
+        try:
+            min_lng, min_lat, max_lng, max_lat = (float(part) for part in bbox.split(','))
+        except ValueError:
+            raise ValidationError({"bbox": "Expected minLng,minLat,maxLng,maxLat"})
+        if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lng <= 180 and -180 <= max_lng <= 180):
+            raise ValidationError({"bbox": "Coordinates out of range"})
+        return min_lat, min_lng, max_lat, max_lng
+
+    def _apply_spatial_filters(self, queryset, nearest_limit=None):
+        """
+        Apply bbox/radius filters and annotate distance when a point is given
+
+        With ``nearest_limit`` and a point, returns a list of that many
+        nearest events instead, searched within the radius.
+        """
+        bbox = self._get_bbox()
+        if bbox:
+            queryset = within_bbox(queryset, *bbox)
+
+        point = self._get_point()
+        if point:
+            radius = self._get_float_param('radius', minimum=0)
+            if nearest_limit:
+                queryset = nearest(queryset, *point, nearest_limit, max_radius_km=radius)
+            elif radius is not None:
+                queryset = within_radius(queryset, *point, radius)
+            else:
+                queryset = annotate_distance(queryset, *point)
+        return queryset, point
+
+    def _annotate_list_fields(self, queryset):
+        """
+        Precompute everything EventListSerializer reads, so a page of events
+        costs a fixed number of queries instead of several per event
+        """
+        queryset = queryset.prefetch_related('categories')
+
+        if self.request.user.is_authenticated:
+            queryset = queryset.annotate(
+                user_favorited=Exists(
+                    UserFavorite.objects.filter(user=self.request.user, event=OuterRef('pk'))
+                )
+            )
+        return queryset
+
+    @cache_response('events')
     def list(self, request, *args, **kwargs):
         # Filter by category
         category = request.query_params.get('category', 'All')
@@ -162,46 +293,27 @@ class EventViewSet(viewsets.ModelViewSet):
         
         # Date filtering
         date_filter = request.query_params.get('dateFilter', 'All')
-        today = date.today()
-        
-        if date_filter == 'Today':
-            queryset = queryset.filter(dates__date=today)
-        elif date_filter == 'Tomorrow':
-            tomorrow = today + timedelta(days=1)
-            queryset = queryset.filter(dates__date=tomorrow)
-        elif date_filter == 'This Weekend':
-            # Get next Saturday and Sunday
-            days_until_weekend = (5 - today.weekday()) % 7
-            saturday = today + timedelta(days=days_until_weekend)
-            sunday = saturday + timedelta(days=1)
-            queryset = queryset.filter(Q(dates__date=saturday) | Q(dates__date=sunday))
-        elif date_filter == 'This Week':
-            # Get dates for the next 7 days
-            next_week = today + timedelta(days=7)
-            queryset = queryset.filter(dates__date__range=[today, next_week])
-        elif date_filter == 'This Month':
-            # Get dates for the current month
-            next_month = today.replace(day=1)
-            if today.month == 12:
-                next_month = next_month.replace(year=today.year + 1, month=1)
-            else:
-                next_month = next_month.replace(month=today.month + 1)
-            queryset = queryset.filter(dates__date__range=[today, next_month - timedelta(days=1)])
+        queryset = filter_by_date(queryset, date_filter)
         
+        # Spatial filtering (bbox / radius around lat,lng)
+        queryset, point = self._apply_spatial_filters(queryset)
+
         # Sorting
         sort_by = request.query_params.get('sortBy', 'Recommended')
         if sort_by == 'Date':
-            queryset = queryset.order_by('dates__date')
+            # Upcoming events first, using the denormalized date columns
+            queryset = queryset.order_by(F('next_date').asc(nulls_last=True), 'first_date')
         elif sort_by == 'Price: Low to High':
             queryset = queryset.order_by('price')
         elif sort_by == 'Price: High to Low':
             queryset = queryset.order_by('-price')
         elif sort_by == 'Distance':
-            # Would need user location for actual implementation
-            pass  # For now, no special sorting
-        
-        # Remove duplicates
-        queryset = queryset.distinct()
+            # Distance is computed by the database from the user-supplied lat/lng
+            if point:
+                queryset = queryset.order_by(F('distance').asc(nulls_last=True))
+        if not queryset.query.order_by:
+            # Recommended without a search: newest first, a stable key for pagination
+            queryset = queryset.order_by('-created_at')
         
         # For event planners, show only their events if requested
         planner_only = request.query_params.get('plannerOnly', 'false').lower() == 'true'
@@ -213,6 +325,8 @@ class EventViewSet(viewsets.ModelViewSet):
             except EventPlanner.DoesNotExist:
                 pass
 
+        queryset = self._annotate_list_fields(queryset)
+
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -227,13 +341,14 @@ class EventViewSet(viewsets.ModelViewSet):
         serializer = EventDateSerializer(data=request.data)
 
         if serializer.is_valid():
-            serializer.save(event=event)
+            with transaction.atomic():
+                serializer.save(event=event)
+                Event.update_date_bounds([event.pk])
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
-    @action(detail=False, methods=['get'])
-    def map_events(self, request):
-        """Return events with geolocation for map view"""
+    def _get_map_queryset(self, request):
+        """Geolocated events matching the map's category and date filters"""
         category = request.query_params.get('category', 'All')
         date_filter = request.query_params.get('dateFilter', 'All')
         
@@ -248,35 +363,61 @@ class EventViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(categories__name=category)
         
         # Apply date filter (same logic as in list method)
-        today = date.today()
-        
-        if date_filter == 'Today':
-            queryset = queryset.filter(dates__date=today)
-        elif date_filter == 'Tomorrow':
-            tomorrow = today + timedelta(days=1)
-            queryset = queryset.filter(dates__date=tomorrow)
-        elif date_filter == 'This Weekend':
-            days_until_weekend = (5 - today.weekday()) % 7
-            saturday = today + timedelta(days=days_until_weekend)
-            sunday = saturday + timedelta(days=1)
-            queryset = queryset.filter(Q(dates__date=saturday) | Q(dates__date=sunday))
-        elif date_filter == 'This Week':
-            next_week = today + timedelta(days=7)
-            queryset = queryset.filter(dates__date__range=[today, next_week])
-        elif date_filter == 'This Month':
-            next_month = today.replace(day=1)
-            if today.month == 12:
-                next_month = next_month.replace(year=today.year + 1, month=1)
-            else:
-                next_month = next_month.replace(month=today.month + 1)
-            queryset = queryset.filter(dates__date__range=[today, next_month - timedelta(days=1)])
-        
-        # Remove duplicates
-        queryset = queryset.distinct()
+        queryset = filter_by_date(queryset, date_filter)
         
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    @cache_response('events')
+    def map_events(self, request):
+        """Return events with geolocation for map view"""
+        queryset = self._get_map_queryset(request)
+
+        # Restrict to a bbox and/or radius; with a limit return the nearest N
+        limit = request.query_params.get('limit')
+        if limit:
+            try:
+                limit = int(limit)
+            except ValueError:
+                raise ValidationError({"limit": "Must be an integer"})
+            if limit < 1:
+                raise ValidationError({"limit": "Must be at least 1"})
+        queryset, point = self._apply_spatial_filters(queryset, nearest_limit=limit)
+
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'])
+    def map_clusters(self, request):
+        """Return clustered events for a map viewport (bbox + zoom)"""
+        bbox = self._get_bbox()
+        if not bbox:
+            raise ValidationError({"bbox": "This parameter is required"})
+
+        try:
+            zoom = int(request.query_params.get('zoom', ''))
+        except ValueError:
+            raise ValidationError({"zoom": "Must be an integer"})
+        if not 0 <= zoom <= MAX_ZOOM:
+            raise ValidationError({"zoom": f"Must be between 0 and {MAX_ZOOM}"})
+
+        # Both filters go into the tile cache keys, so only known values are accepted
+        category = request.query_params.get('category', 'All')
+        if category != 'All' and not Category.objects.filter(name=category).exists():
+            raise ValidationError({"category": "Unknown category"})
+        date_filter = request.query_params.get('dateFilter', 'All')
+        if date_filter not in DATE_FILTERS:
+            raise ValidationError({"dateFilter": f"Must be one of {', '.join(DATE_FILTERS)}"})
+
+        data = get_map_clusters(
+            self._get_map_queryset(request),
+            bbox,
+            zoom,
+            category=category,
+            date_filter=date_filter,
+        )
+        return Response(data)
+
     @action(detail=True, methods=['post'])
     def toggle_favorite(self, request, pk=None):
         """Toggle an event as favorite for the current user"""
@@ -298,8 +439,69 @@ class EventViewSet(viewsets.ModelViewSet):
             return Response({"status": "removed from favorites"})
             
         return Response({"status": "added to favorites"})
+
+    @action(
+        detail=False, methods=['post'], url_path='import',
+        permission_classes=[permissions.IsAuthenticated], parser_classes=[MultiPartParser],
+    )
+    def import_events(self, request):
+        """
+        Bulk import events from an uploaded CSV or NDJSON ``file``
+
+        Planners import into their own account; superusers pass ``planner``.
+        Valid rows are created even when others are rejected. A file that
+        can't be read to the end answers 400 with what was imported up to
+        ``stopped.after_row``.
+        """
+        planner = self._get_import_planner(request)
+
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({"file": "This field is required"})
+        import_format = request.data.get('format') or upload.name.rsplit('.', 1)[-1].lower()
+        if import_format not in IMPORT_FORMATS:
+            raise ValidationError({"format": f"Must be one of: {', '.join(IMPORT_FORMATS)}"})
+
+        result = import_events(planner, read_rows(text_stream(upload), import_format))
+        logger.info(f"Imported {result['created']} events for planner {planner.pk}, {result['failed']} rows rejected")
+        if 'stopped' in result:
+            logger.warning(f"Import for planner {planner.pk} stopped after row {result['stopped']['after_row']}")
+            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_201_CREATED if result['created'] else status.HTTP_200_OK)
+
+    def _get_import_planner(self, request):
+        planner_id = request.data.get('planner')
+        if planner_id and request.user.is_superuser:
+            try:
+                return EventPlanner.objects.get(pk=planner_id, status='approved')
+            except (EventPlanner.DoesNotExist, ValueError):
+                raise ValidationError({"planner": "No approved planner with this id"})
+        try:
+            planner = request.user.planner_profile
+        except EventPlanner.DoesNotExist:
+            planner = None
+        if planner is None or planner.status != 'approved':
+            raise PermissionDenied("Only approved planners can import events")
+        return planner
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def favorites(self, request):
+        """The current user's favorite events, most recently favorited first"""
+        queryset = Event.objects.filter(favorited_by__user=request.user).annotate(
+            favorited_at=F('favorited_by__created_at')
+        ).order_by('-favorited_at')
+        queryset = self._annotate_list_fields(queryset)
+
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
         
 class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = KeysetPagination
+
+    @cache_response('events')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
@@ -7,7 +7,17 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nearby.settings')
 django.setup()
 
 # Now import other modules
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
 from django.core.asgi import get_asgi_application
 
-# Initialize Django ASGI application without WebSocket support
-application = get_asgi_application()
+from authentication.middleware import JWTAuthMiddleware
+from payments.routing import websocket_urlpatterns as payment_websocket_urlpatterns
+
+# HTTP goes to Django; WebSockets carry live payment status updates
+application = ProtocolTypeRouter({
+    'http': get_asgi_application(),
+    'websocket': AllowedHostsOriginValidator(
+        JWTAuthMiddleware(URLRouter(payment_websocket_urlpatterns))
+    ),
+})
@@ -186,6 +186,11 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Page size of the keyset paginated listings (?cursor=...&page_size=...).
+# Views opt in with pagination_class = core.pagination.KeysetPagination;
+# the others return bare lists.
+API_PAGE_SIZE = config('API_PAGE_SIZE', default=20, cast=int)
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=config('ACCESS_TOKEN_LIFETIME_DAYS', default=1, cast=int)),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=config('REFRESH_TOKEN_LIFETIME_DAYS', default=7, cast=int)),
@@ -223,6 +228,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.site_settings.SiteSettingsSnapshotMiddleware',
 ]
 
 ROOT_URLCONF = 'nearby.urls'
@@ -246,6 +252,14 @@ TEMPLATES = [
 MEDIA_URL = config('MEDIA_URL', default='/media/')
 MEDIA_ROOT = BASE_DIR / 'media'  # Ensure BASE_DIR is properly defined
 
+# Uploads are stored by content hash (core/storage.py); SERVE_MEDIA serves
+# them from Django with immutable caching headers when no web server does
+STORAGES = {
+    'default': {'BACKEND': 'core.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+SERVE_MEDIA = config('SERVE_MEDIA', default=DEBUG, cast=bool)
+
 WSGI_APPLICATION = 'nearby.wsgi.application'
 
 # WebSocket Configuration
@@ -273,6 +287,86 @@ else:
         }
     }
 
+# Cache Configuration
+CACHE_BACKEND = config('CACHE_BACKEND', default='memory')
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': f"redis://{config('REDIS_HOST', default='127.0.0.1')}:{config('REDIS_PORT', default=6379, cast=int)}/1",
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'nearby',
+            'OPTIONS': {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=5000, cast=int)},
+        },
+    }
+
+# Anonymous API response caching (seconds)
+RESPONSE_CACHE_TIMEOUT = config('RESPONSE_CACHE_TIMEOUT', default=60, cast=int)
+RESPONSE_CACHE_STALE_TIMEOUT = config('RESPONSE_CACHE_STALE_TIMEOUT', default=300, cast=int)
+RESPONSE_CACHE_REFRESH_LOCK_TIMEOUT = config('RESPONSE_CACHE_REFRESH_LOCK_TIMEOUT', default=30, cast=int)
+
+# Seconds a process uses its copy of SiteSetting before checking for changes
+SITE_SETTINGS_CACHE_TTL = config('SITE_SETTINGS_CACHE_TTL', default=30, cast=int)
+
+# Event Date Columns Configuration (run `python manage.py backfill_event_dates --rolled-over --loop`)
+EVENT_DATES_REFRESH_INTERVAL = config('EVENT_DATES_REFRESH_INTERVAL', default=300, cast=int)
+
+# Map Clustering Configuration
+MAP_CLUSTER_CACHE_TIMEOUT = config('MAP_CLUSTER_CACHE_TIMEOUT', default=300, cast=int)
+MAP_PIN_ZOOM = config('MAP_PIN_ZOOM', default=15, cast=int)
+
+# Event Search Configuration ('auto' picks FTS5/tsvector by database, 'fallback' uses icontains)
+EVENT_SEARCH_BACKEND = config('EVENT_SEARCH_BACKEND', default='auto')
+
+# Ticket Inventory Configuration (minutes a pending purchase keeps its seats)
+TICKET_HOLD_MINUTES = config('TICKET_HOLD_MINUTES', default=15, cast=int)
+
+# Ticket Export Configuration (rows fetched and written per block)
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=2000, cast=int)
+
+# Image Variant Configuration (background threads per process; 0 resizes inline after commit)
+IMAGE_WORKERS = config('IMAGE_WORKERS', default=2, cast=int)
+
+# Bulk Event Import Configuration (rows validated and inserted per batch, row errors reported)
+IMPORT_BATCH_SIZE = config('IMPORT_BATCH_SIZE', default=500, cast=int)
+IMPORT_MAX_ERRORS = config('IMPORT_MAX_ERRORS', default=1000, cast=int)
+
+# Flash-sale Admission Queue ('cache' shares the line via a Redis CACHE_BACKEND, 'memory' is per process)
+ADMISSION_QUEUE_STORE = config('ADMISSION_QUEUE_STORE', default='cache' if CACHE_BACKEND == 'redis' else 'memory')
+ADMISSION_QUEUE_SLOTS = config('ADMISSION_QUEUE_SLOTS', default=50, cast=int)
+ADMISSION_SLOT_TTL = config('ADMISSION_SLOT_TTL', default=300, cast=int)
+ADMISSION_TOKEN_TTL = config('ADMISSION_TOKEN_TTL', default=60, cast=int)
+
+# Payment Worker Configuration (run with `python manage.py run_payment_worker`)
+PAYMENT_WORKER_THREADS = config('PAYMENT_WORKER_THREADS', default=4, cast=int)
+PAYMENT_WORKER_BATCH_SIZE = config('PAYMENT_WORKER_BATCH_SIZE', default=10, cast=int)
+PAYMENT_WORKER_POLL_INTERVAL = config('PAYMENT_WORKER_POLL_INTERVAL', default=1.0, cast=float)
+PAYMENT_JOB_MAX_ATTEMPTS = config('PAYMENT_JOB_MAX_ATTEMPTS', default=5, cast=int)
+PAYMENT_JOB_RETRY_DELAY = config('PAYMENT_JOB_RETRY_DELAY', default=5, cast=int)
+PAYMENT_JOB_MAX_RETRY_DELAY = config('PAYMENT_JOB_MAX_RETRY_DELAY', default=120, cast=int)
+PAYMENT_JOB_LEASE_SECONDS = config('PAYMENT_JOB_LEASE_SECONDS', default=120, cast=int)
+
+# Payment Reconciler Configuration (run with `python manage.py reconcile_payments`):
+# pending payments quiet for PAYMENT_RECONCILE_AFTER_SECONDS are checked with the
+# provider, and expired once older than PAYMENT_RECONCILE_EXPIRE_MINUTES
+PAYMENT_RECONCILE_AFTER_SECONDS = config('PAYMENT_RECONCILE_AFTER_SECONDS', default=120, cast=int)
+PAYMENT_RECONCILE_EXPIRE_MINUTES = config('PAYMENT_RECONCILE_EXPIRE_MINUTES', default=TICKET_HOLD_MINUTES, cast=int)
+PAYMENT_RECONCILE_BATCH_SIZE = config('PAYMENT_RECONCILE_BATCH_SIZE', default=500, cast=int)
+PAYMENT_RECONCILE_CONCURRENCY = config('PAYMENT_RECONCILE_CONCURRENCY', default=8, cast=int)
+PAYMENT_RECONCILE_INTERVAL = config('PAYMENT_RECONCILE_INTERVAL', default=30, cast=int)
+
+# Webhook Inbox Configuration (run with `python manage.py process_webhooks`)
+WEBHOOK_BATCH_SIZE = config('WEBHOOK_BATCH_SIZE', default=100, cast=int)
+WEBHOOK_POLL_INTERVAL = config('WEBHOOK_POLL_INTERVAL', default=0.5, cast=float)
+WEBHOOK_MAX_ATTEMPTS = config('WEBHOOK_MAX_ATTEMPTS', default=8, cast=int)
+WEBHOOK_RETRY_DELAY = config('WEBHOOK_RETRY_DELAY', default=2, cast=int)
+
 # Auth User Model
 AUTH_USER_MODEL = 'authentication.User'
 
@@ -358,6 +452,22 @@ LOGGING = {
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY')
 STRIPE_PUBLIC_KEY = config('STRIPE_PUBLIC_KEY')
 STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET')
+# Where the buyer returns after a card's 3-D Secure redirect
+STRIPE_RETURN_URL = config('STRIPE_RETURN_URL', default=None)
+
+# Payment provider HTTP clients (see payments/http.py for the defaults of each key)
+PAYMENT_PROVIDER_HTTP = {
+    'mpesa': {
+        'connect_timeout': config('MPESA_CONNECT_TIMEOUT', default=3.05, cast=float),
+        'read_timeout': config('MPESA_READ_TIMEOUT', default=20, cast=float),
+        'retries': 2,
+    },
+    'stripe': {
+        'connect_timeout': config('STRIPE_CONNECT_TIMEOUT', default=3.05, cast=float),
+        'read_timeout': config('STRIPE_READ_TIMEOUT', default=30, cast=float),
+        'retries': 2,
+    },
+}
 
 # M-Pesa Configuration
 MPESA_API_URL = config('MPESA_API_URL')
@@ -365,4 +475,8 @@ MPESA_CONSUMER_KEY = config('MPESA_CONSUMER_KEY')
 MPESA_CONSUMER_SECRET = config('MPESA_CONSUMER_SECRET')
 MPESA_SHORTCODE = config('MPESA_SHORTCODE')
 MPESA_PASSKEY = config('MPESA_PASSKEY')
-MPESA_CALLBACK_URL = config('MPESA_CALLBACK_URL')
\ No newline at end of file
+MPESA_CALLBACK_URL = config('MPESA_CALLBACK_URL')
+# OAuth token cache: 'local' per process, 'shared' via CACHES for multi-process deployments
+MPESA_TOKEN_CACHE = config('MPESA_TOKEN_CACHE', default='local')
+# Status polls only query M-Pesa about payments pending longer than this (seconds)
+PAYMENT_STATUS_STALE_SECONDS = config('PAYMENT_STATUS_STALE_SECONDS', default=15, cast=int)
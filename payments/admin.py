@@ -1,3 +1,19 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import PaymentJob, WebhookEvent
+
+
+@admin.register(PaymentJob)
+class PaymentJobAdmin(admin.ModelAdmin):
+    list_display = ['payment', 'status', 'attempts', 'run_after', 'updated_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['payment__ticket__order_number', 'idempotency_key']
+    readonly_fields = ['id', 'idempotency_key', 'created_at', 'updated_at']
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['provider', 'event_type', 'event_id', 'status', 'attempts', 'received_at', 'processed_at']
+    list_filter = ['provider', 'status', 'received_at']
+    search_fields = ['event_id']
+    readonly_fields = ['received_at', 'processed_at']
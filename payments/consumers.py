@@ -0,0 +1,39 @@
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import JsonWebsocketConsumer
+
+from tickets.models import Payment
+from .lifecycle import payment_group, payment_snapshot
+
+
+class PaymentStatusConsumer(JsonWebsocketConsumer):
+    """
+    Pushes status changes of one payment to its owner
+
+    The current state is sent on connect, then every transition published by
+    payments/lifecycle.py.
+    """
+
+    def connect(self):
+        user = self.scope['user']
+        payment_id = self.scope['url_route']['kwargs']['payment_id']
+        self.group_name = None
+
+        payment = (
+            Payment.objects.select_related('ticket').filter(id=payment_id, ticket__user_id=user.pk).first()
+            if user.is_authenticated else None
+        )
+        if payment is None:
+            self.close()
+            return
+
+        self.group_name = payment_group(payment.id)
+        async_to_sync(self.channel_layer.group_add)(self.group_name, self.channel_name)
+        self.accept()
+        self.send_json({'type': 'payment_status', **payment_snapshot(payment)})
+
+    def disconnect(self, close_code):
+        if self.group_name:
+            async_to_sync(self.channel_layer.group_discard)(self.group_name, self.channel_name)
+
+    def payment_status(self, event):
+        self.send_json({**event, 'type': 'payment_status'})
@@ -1,5 +1,18 @@
 class PaymentProcessingError(Exception):
     """
     Exception raised for errors during payment processing
+
+    ``retryable`` marks transient failures (timeouts, connection errors,
+    rate limits) that the payment worker may try again.
     """
-    pass
+    def __init__(self, message='', retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class ProviderUnavailable(PaymentProcessingError):
+    """
+    Raised without calling the provider while its circuit breaker is open
+    """
+    def __init__(self, message=''):
+        super().__init__(message, retryable=True)
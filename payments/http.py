@@ -0,0 +1,220 @@
+"""
+Shared HTTP layer for payment providers.
+
+Every provider gets one pooled keep-alive ``requests`` session per process,
+configured from PAYMENT_PROVIDER_HTTP:
+
+* connect/read timeouts, so a slow provider can't pin a worker indefinitely
+* a retry budget for connection failures (and for GETs that hit 502/503/504);
+  POSTs are never resent once the request may have reached the provider
+* a circuit breaker: after ``failure_threshold`` consecutive failures calls
+  fail fast with ProviderUnavailable for ``reset_timeout`` seconds, then a
+  single trial call decides whether the provider is back
+* per-operation latency histograms, see provider_metrics()
+
+MPesaService calls ``get_provider_session('mpesa')`` directly; Stripe's own
+client is pointed at ``get_provider_session('stripe')`` in stripe_service.
+New processors should take their session from here as well.
+"""
+from urllib.parse import urlsplit
+import bisect
+import logging
+import threading
+import time
+
+from django.conf import settings
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
+
+from .exceptions import ProviderUnavailable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROVIDER_HTTP = {
+    'connect_timeout': 3.05,
+    'read_timeout': 15,
+    'retries': 2,
+    'backoff_factor': 0.3,
+    'pool_size': 10,
+    'failure_threshold': 5,
+    'reset_timeout': 30,
+}
+
+# Upper bounds of the latency buckets, in milliseconds
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open trial -> closed"""
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_ms):
+        with self._lock:
+            self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+            self.count += 1
+            self.total_ms += elapsed_ms
+
+    def snapshot(self):
+        with self._lock:
+            buckets = {f'le_{bound}ms': count for bound, count in zip(LATENCY_BUCKETS_MS, self.counts)}
+            buckets['le_inf'] = self.counts[-1]
+            return {
+                'count': self.count,
+                'average_ms': round(self.total_ms / self.count, 1) if self.count else 0,
+                'buckets': buckets,
+            }
+
+
+class ProviderSession(requests.Session):
+    """
+    A requests session with default timeouts, a circuit breaker and latency
+    metrics per operation (method + URL path)
+    """
+
+    def __init__(self, provider, config):
+        super().__init__()
+        self.provider = provider
+        self.timeout = (config['connect_timeout'], config['read_timeout'])
+        self.breaker = CircuitBreaker(config['failure_threshold'], config['reset_timeout'])
+        self.histograms = {}
+        self._histograms_lock = threading.Lock()
+
+        retry = Retry(
+            total=config['retries'],
+            connect=config['retries'],
+            read=config['retries'],
+            status=config['retries'],
+            # Only idempotent requests are retried once they may have been received
+            allowed_methods=frozenset({'GET', 'HEAD', 'OPTIONS'}),
+            status_forcelist=(502, 503, 504),
+            backoff_factor=config['backoff_factor'],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=config['pool_size'], pool_maxsize=config['pool_size'], max_retries=retry
+        )
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        if not self.breaker.allow():
+            logger.warning(f"{self.provider} circuit open, failing fast")
+            raise ProviderUnavailable(f"{self.provider} is temporarily unavailable")
+
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.monotonic()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        finally:
+            self._histogram(method, url).observe((time.monotonic() - started) * 1000)
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def _histogram(self, method, url):
+        operation = f'{method.upper()} {urlsplit(url).path}'
+        with self._histograms_lock:
+            if operation not in self.histograms:
+                self.histograms[operation] = LatencyHistogram()
+            return self.histograms[operation]
+
+    def metrics(self):
+        with self._histograms_lock:
+            histograms = dict(self.histograms)
+        return {
+            'circuit': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            'latency': {operation: histogram.snapshot() for operation, histogram in histograms.items()},
+        }
+
+
+def request_not_sent(error):
+    """
+    Whether a failed request certainly never reached the provider
+
+    Only a connection that could not be opened proves it. After a read
+    timeout or a dropped connection the provider may have acted on the
+    request, so a POST must not be sent again.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
+    return False
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_provider_config(provider):
+    return {**DEFAULT_PROVIDER_HTTP, **settings.PAYMENT_PROVIDER_HTTP.get(provider, {})}
+
+
+def get_provider_session(provider):
+    """Return the process-wide session for a payment provider"""
+    with _sessions_lock:
+        if provider not in _sessions:
+            _sessions[provider] = ProviderSession(provider, get_provider_config(provider))
+        return _sessions[provider]
+
+
+def provider_metrics():
+    """Circuit state and latency histograms of every provider used so far"""
+    with _sessions_lock:
+        sessions = dict(_sessions)
+    return {provider: session.metrics() for provider, session in sessions.items()}
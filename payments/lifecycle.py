@@ -0,0 +1,94 @@
+"""
+Payment state transitions.
+
+Provider callbacks, webhooks, the payment worker and status polling all move
+payments through these functions, so the ticket, its seats and subscribers of
+the payment's status channel (see payments/consumers.py) stay in step.
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from tickets.inventory import InsufficientInventory
+
+logger = logging.getLogger(__name__)
+
+
+def payment_group(payment_id):
+    """Channel layer group receiving status updates of one payment"""
+    return f'payment_{payment_id}'
+
+
+def payment_snapshot(payment):
+    ticket = payment.ticket
+    return {
+        'payment_id': str(payment.id),
+        'payment_status': payment.status,
+        'ticket_status': ticket.status,
+        'order_number': ticket.order_number,
+        'updated_at': payment.updated_at.isoformat() if payment.updated_at else None,
+    }
+
+
+def publish_payment_status(payment):
+    """Push the payment's current state to its subscribers once committed"""
+    snapshot = payment_snapshot(payment)
+
+    def send():
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        try:
+            async_to_sync(channel_layer.group_send)(
+                payment_group(snapshot['payment_id']), {'type': 'payment.status', **snapshot}
+            )
+        except Exception as e:
+            # Subscribers can still fall back to polling
+            logger.error(f"Error publishing payment status: {str(e)}", exc_info=True)
+
+    transaction.on_commit(send)
+
+
+def complete_payment(payment, **details):
+    """
+    Mark a payment as paid and confirm its ticket
+
+    Returns False if the ticket can't be confirmed any more because it was
+    paid after its hold expired and the seats were sold on. The payment is
+    then failed and flagged with ``refund_required`` for a refund by hand.
+    """
+    try:
+        with transaction.atomic():
+            if details:
+                payment.payment_details = {**(payment.payment_details or {}), **details}
+            payment.status = 'COMPLETED'
+            payment.save()
+            payment.ticket.update_status('CONFIRMED')
+            publish_payment_status(payment)
+    except InsufficientInventory:
+        logger.error(f"Payment {payment.id} was paid but its seats are no longer available; it needs a refund")
+        fail_payment(payment, 'Paid after the seats were released', refund_required=True)
+        return False
+    logger.info(f"Payment {payment.id} completed")
+    return True
+
+
+def fail_payment(payment, reason, **details):
+    """Mark a payment as failed and give the ticket's seats back"""
+    with transaction.atomic():
+        payment.payment_details = {**(payment.payment_details or {}), 'error': reason, **details}
+        payment.status = 'FAILED'
+        payment.save()
+        payment.ticket.cancel_hold()
+        publish_payment_status(payment)
+    logger.info(f"Payment {payment.id} failed: {reason}")
+
+
+def refund_payment(payment):
+    """Record a refund made at the provider and cancel the ticket"""
+    with transaction.atomic():
+        payment.ticket.update_status('CANCELLED')
+        publish_payment_status(payment)
+    logger.info(f"Payment {payment.id} refunded")
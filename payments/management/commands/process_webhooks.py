@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from payments.webhooks import process_webhooks
+
+
+class Command(BaseCommand):
+    help = 'Apply stored Stripe/M-Pesa webhook deliveries to payments, exactly once each'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=settings.WEBHOOK_POLL_INTERVAL)
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once no event is due instead of polling forever',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Processing webhook inbox')
+        process_webhooks(poll_interval=options['poll_interval'], once=options['once'])
+        self.stdout.write(self.style.SUCCESS('Webhook processing stopped'))
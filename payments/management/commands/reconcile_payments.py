@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from payments.reconciler import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        'Check payments stuck in PENDING with Stripe/M-Pesa, confirm or fail them, '
+        'and expire abandoned ones so their seats are released'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.PAYMENT_RECONCILE_CONCURRENCY)
+        parser.add_argument('--batch-size', type=int, default=settings.PAYMENT_RECONCILE_BATCH_SIZE)
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep reconciling every PAYMENT_RECONCILE_INTERVAL seconds instead of running one batch',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            metrics = reconcile(concurrency=options['concurrency'], limit=options['batch_size'])
+            self.stdout.write(
+                f"Reconciled {metrics['scanned']} payments in {metrics['duration_seconds']}s "
+                f"({metrics['payments_per_second']}/s): {metrics['completed']} completed, "
+                f"{metrics['failed']} failed, {metrics['expired']} expired, {metrics['pending']} still pending, "
+                f"{metrics['errors']} errors; max lag {metrics['max_lag_seconds']}s, backlog {metrics['backlog']}"
+            )
+            if not options['loop']:
+                return
+            # Work through a backlog back to back, otherwise wait for the next round
+            if not metrics['backlog']:
+                time.sleep(settings.PAYMENT_RECONCILE_INTERVAL)
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from payments.worker import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Run the payment worker that executes queued Stripe/M-Pesa calls'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=settings.PAYMENT_WORKER_THREADS)
+        parser.add_argument('--poll-interval', type=float, default=settings.PAYMENT_WORKER_POLL_INTERVAL)
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once no job is due instead of polling forever',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Starting payment worker with {options['threads']} threads")
+        run_worker(threads=options['threads'], poll_interval=options['poll_interval'], once=options['once'])
+        self.stdout.write(self.style.SUCCESS('Payment worker stopped'))
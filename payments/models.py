@@ -1,3 +1,90 @@
 from django.db import models
+from django.utils import timezone
+import uuid
 
-# Create your models here.
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+class PaymentJob(models.Model):
+    """
+    A queued call to a payment provider, run by the payment worker
+
+    The table is the queue: workers claim due jobs with a conditional UPDATE,
+    so no external broker is needed.
+    """
+    STATUS_CHOICES = (
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('SUCCEEDED', 'Succeeded'),
+        ('FAILED', 'Failed'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    payment = models.ForeignKey('tickets.Payment', on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='QUEUED')
+    # Sent to the provider so a retried job never charges twice
+    idempotency_key = models.CharField(max_length=64, unique=True, default=new_idempotency_key, editable=False)
+    # Provider inputs only (payment method id, phone number); never card details
+    payload = models.JSONField(default=dict, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    # A running job whose lease has passed is assumed crashed and is claimed again
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['run_after']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='payments_job_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.payment_id} - {self.status} (attempt {self.attempts})"
+
+
+class WebhookEvent(models.Model):
+    """
+    Inbox of provider callbacks (Stripe webhooks, M-Pesa STK callbacks)
+
+    The webhook views only store the delivery and acknowledge it; the unique
+    (provider, event_id) constraint turns provider retries into no-ops.
+    ``manage.py process_webhooks`` applies stored events exactly once.
+    """
+    PROVIDER_CHOICES = (
+        ('STRIPE', 'Stripe'),
+        ('MPESA', 'M-Pesa'),
+    )
+    STATUS_CHOICES = (
+        ('RECEIVED', 'Received'),
+        ('PROCESSED', 'Processed'),
+        ('IGNORED', 'Ignored'),
+        ('FAILED', 'Failed'),
+    )
+
+    provider = models.CharField(max_length=20, choices=PROVIDER_CHOICES)
+    # Stripe event id, or the M-Pesa CheckoutRequestID
+    event_id = models.CharField(max_length=255)
+    event_type = models.CharField(max_length=100, blank=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='RECEIVED')
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['received_at']
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'event_id'], name='payments_webhook_event_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='payments_webhook_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} {self.event_type or 'event'} {self.event_id} - {self.status}"
@@ -5,6 +5,9 @@ from datetime import datetime
 import logging
 from django.conf import settings
 from .exceptions import PaymentProcessingError
+from .http import get_provider_session, request_not_sent
+from .lifecycle import complete_payment, fail_payment
+from .token_manager import get_token_manager
 
 logger = logging.getLogger(__name__)
 
@@ -25,24 +28,44 @@ class MPesaService:
         self.passkey = settings.MPESA_PASSKEY
         self.shortcode = settings.MPESA_SHORTCODE
         self.callback_url = settings.MPESA_CALLBACK_URL
+
+        # Pooled keep-alive session with timeouts and a circuit breaker
+        self.session = get_provider_session('mpesa')
         
+    @property
+    def token_manager(self):
+        """Access tokens are cached and shared by every MPesaService instance"""
+        return get_token_manager(
+            'mpesa', f"{self.access_token_url}:{self.consumer_key}", self._fetch_access_token,
+            shared=settings.MPESA_TOKEN_CACHE == 'shared',
+        )
+
     def _get_access_token(self):
         """Get M-Pesa API access token"""
+        return self.token_manager.get_token()
+
+    def _fetch_access_token(self):
+        """Request a new access token; returns (token, expires_in)"""
         try:
             auth = base64.b64encode(f"{self.consumer_key}:{self.consumer_secret}".encode()).decode("utf-8")
             headers = {
                 "Authorization": f"Basic {auth}"
             }
             
-            response = requests.get(self.access_token_url, headers=headers)
+            response = self.session.get(self.access_token_url, headers=headers)
             response.raise_for_status()
             
             result = response.json()
-            return result.get("access_token")
+            return result.get("access_token"), result.get("expires_in", 3599)
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Error getting M-Pesa access token: {str(e)}")
-            raise PaymentProcessingError("Could not connect to M-Pesa")
+            raise PaymentProcessingError("Could not connect to M-Pesa", retryable=True)
+
+    def _check_token_rejected(self, response):
+        # A revoked or expired token would otherwise stay cached until expires_in
+        if response.status_code == 401:
+            self.token_manager.invalidate()
             
     def _generate_password(self):
         """Generate the M-Pesa password"""
@@ -99,13 +122,14 @@ class MPesaService:
                 "PartyA": phone_number,
                 "PartyB": self.shortcode,
                 "PhoneNumber": phone_number,
-                "CallBackURL": self.callback_url,
+                "CallBackURL": self._callback_url(payment),
                 "AccountReference": payment.ticket.order_number,
                 "TransactionDesc": f"Ticket purchase for {payment.ticket.event.title}"
             }
             
             # Initiate STK push
-            response = requests.post(self.stk_push_url, headers=headers, json=stk_payload)
+            response = self.session.post(self.stk_push_url, headers=headers, json=stk_payload)
+            self._check_token_rejected(response)
             response.raise_for_status()
             result = response.json()
             
@@ -137,11 +161,31 @@ class MPesaService:
                 raise PaymentProcessingError(result.get("ResponseDescription", "Payment initiation failed"))
                 
         except requests.exceptions.RequestException as e:
+            response = getattr(e, 'response', None)
+            if request_not_sent(e) or (response is not None and response.status_code < 500):
+                # Never sent, or rejected by M-Pesa: nobody was prompted
+                payment.status = 'FAILED'
+                payment.payment_details = {'error': str(e)}
+                payment.save()
+                logger.error(f"M-Pesa request error: {str(e)}")
+                retryable = response is None or response.status_code in (401, 429)
+                raise PaymentProcessingError("Could not connect to M-Pesa", retryable=retryable)
+
+            # The push may have reached M-Pesa and prompted the buyer, and STK
+            # pushes have no idempotency key: sending it again could charge
+            # twice. The callback finds the payment through its callback URL;
+            # the reconciler expires it if none comes.
+            payment.status = 'PENDING'
+            payment.payment_details = {'phone_number': phone_number, 'submission': 'unconfirmed', 'error': str(e)}
+            payment.save()
+            logger.warning(f"M-Pesa STK push for payment {payment.id} unconfirmed: {str(e)}")
+            return payment
+
+        except PaymentProcessingError as e:
             payment.status = 'FAILED'
             payment.payment_details = {'error': str(e)}
             payment.save()
-            logger.error(f"M-Pesa request error: {str(e)}")
-            raise PaymentProcessingError("Could not connect to M-Pesa")
+            raise
             
         except Exception as e:
             payment.status = 'FAILED'
@@ -149,6 +193,11 @@ class MPesaService:
             payment.save()
             logger.error(f"Unexpected error in M-Pesa payment: {str(e)}", exc_info=True)
             raise PaymentProcessingError("An unexpected error occurred")
+
+    def _callback_url(self, payment):
+        """The callback URL, naming the payment in case the push's response is lost"""
+        separator = '&' if '?' in self.callback_url else '?'
+        return f"{self.callback_url}{separator}payment={payment.id}"
             
     def query_transaction(self, checkout_request_id):
         """
@@ -181,7 +230,8 @@ class MPesaService:
             }
             
             # Send query request
-            response = requests.post(self.query_url, headers=headers, json=query_payload)
+            response = self.session.post(self.query_url, headers=headers, json=query_payload)
+            self._check_token_rejected(response)
             response.raise_for_status()
             result = response.json()
             
@@ -189,7 +239,10 @@ class MPesaService:
             
         except requests.exceptions.RequestException as e:
             logger.error(f"M-Pesa query error: {str(e)}")
-            raise PaymentProcessingError("Could not connect to M-Pesa")
+            raise PaymentProcessingError("Could not connect to M-Pesa", retryable=True)
+
+        except PaymentProcessingError:
+            raise
             
         except Exception as e:
             logger.error(f"Unexpected error in M-Pesa query: {str(e)}", exc_info=True)
@@ -223,43 +276,23 @@ class MPesaService:
                     if name and value:
                         payment_details[name] = value
                 
-                # Update payment record
-                payment.status = 'COMPLETED'
+                # Update payment record, confirm the ticket and notify subscribers
                 payment.transaction_id = payment_details.get("MpesaReceiptNumber", payment.transaction_id)
-                
-                # Update payment details
-                existing_details = payment.payment_details or {}
-                existing_details.update({
-                    'mpesa_receipt': payment_details.get("MpesaReceiptNumber"),
-                    'transaction_date': payment_details.get("TransactionDate"),
-                    'amount': payment_details.get("Amount"),
-                    'phone_number': payment_details.get("PhoneNumber")
-                })
-                payment.payment_details = existing_details
-                payment.save()
-                
-                # Update ticket status
-                ticket = payment.ticket
-                ticket.status = 'CONFIRMED'
-                ticket.payment_completed = True
-                ticket.save()
+                complete_payment(
+                    payment,
+                    mpesa_receipt=payment_details.get("MpesaReceiptNumber"),
+                    transaction_date=payment_details.get("TransactionDate"),
+                    amount=payment_details.get("Amount"),
+                    phone_number=payment_details.get("PhoneNumber"),
+                )
                 
                 logger.info(f"M-Pesa payment completed: {payment.transaction_id}")
                 return payment
                 
             else:
-                # Payment failed
-                payment.status = 'FAILED'
+                # Payment failed; release the seats held for this checkout
                 reason = stkCallback.get("ResultDesc", "Payment failed")
-                
-                # Update payment details
-                existing_details = payment.payment_details or {}
-                existing_details.update({
-                    'error': reason,
-                    'error_code': result_code
-                })
-                payment.payment_details = existing_details
-                payment.save()
+                fail_payment(payment, reason, error_code=result_code)
                 
                 logger.error(f"M-Pesa payment failed: {reason}")
                 return payment
@@ -0,0 +1,186 @@
+"""
+Payment reconciler.
+
+Callbacks and webhooks get lost, and a payment nobody polls would stay
+PENDING forever with its seats held. ``manage.py reconcile_payments`` scans
+pending payments that have been quiet for PAYMENT_RECONCILE_AFTER_SECONDS and
+asks the provider how they ended:
+
+* paid at the provider -> complete_payment (ticket CONFIRMED)
+* failed or cancelled at the provider -> fail_payment (seats released)
+* still open but older than PAYMENT_RECONCILE_EXPIRE_MINUTES, never sent to
+  the provider, or its ticket hold already expired -> expired like a failure
+
+Payments whose PaymentJob is still queued or running belong to the payment
+worker and are skipped. Provider queries run on a bounded thread pool so
+thousands of pending payments don't turn into thousands of concurrent calls,
+and every run records throughput and lag metrics (see last_run_metrics()).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection
+from django.utils import timezone
+import stripe
+
+from tickets.models import Payment
+from .exceptions import PaymentProcessingError
+from .lifecycle import complete_payment, fail_payment
+
+logger = logging.getLogger(__name__)
+
+METRICS_CACHE_KEY = 'payments:reconciler:last_run'
+
+# Stripe payments still being processed are stored as PROCESSING
+PENDING_STATUSES = ('PENDING', 'PROCESSING')
+
+# Outcomes of reconciling one payment
+OUTCOMES = ('completed', 'failed', 'expired', 'pending', 'errors')
+
+# Stripe PaymentIntent statuses that will never turn into a charge
+STRIPE_FAILED_STATUSES = ('canceled', 'requires_payment_method')
+
+
+def stale_payments(now=None):
+    """Pending payments due for reconciliation, least recently checked first"""
+    now = now or timezone.now()
+    return (
+        Payment.objects
+        .filter(status__in=PENDING_STATUSES, updated_at__lt=now - timedelta(seconds=settings.PAYMENT_RECONCILE_AFTER_SECONDS))
+        .exclude(jobs__status__in=('QUEUED', 'RUNNING'))
+        .select_related('ticket')
+        .order_by('updated_at')
+    )
+
+
+def query_mpesa(checkout_request_id):
+    """How an STK push ended, from M-Pesa's STK query: like query_provider()"""
+    from .mpesa_service import MPesaService
+    result = MPesaService().query_transaction(checkout_request_id)
+    # A ResultCode is only present once the customer has acted on the prompt
+    result_code = result.get('ResultCode')
+    if result_code == '0':
+        return 'completed', {}
+    if result_code is not None:
+        return 'failed', {'error': result.get('ResultDesc', 'Payment failed'), 'error_code': result_code}
+    return 'pending', {}
+
+
+def query_provider(payment):
+    """
+    Ask the provider about a payment
+
+    Returns 'completed', 'failed' or 'pending', plus the provider's details.
+    """
+    if payment.payment_method == 'MPESA':
+        return query_mpesa(payment.transaction_id)
+
+    try:
+        intent = stripe.PaymentIntent.retrieve(payment.transaction_id)
+    except stripe.error.StripeError as e:
+        raise PaymentProcessingError(f"Stripe lookup failed: {str(e)}", retryable=True)
+    if intent.status == 'succeeded':
+        return 'completed', {'status': intent.status}
+    if intent.status in STRIPE_FAILED_STATUSES:
+        return 'failed', {'error': f'PaymentIntent {intent.status}', 'status': intent.status}
+    return 'pending', {'status': intent.status}
+
+
+def reconcile_payment(payment, now=None):
+    """Bring one pending payment to its final state if it has one; returns the outcome"""
+    now = now or timezone.now()
+    expired = (
+        payment.created_at < now - timedelta(minutes=settings.PAYMENT_RECONCILE_EXPIRE_MINUTES)
+        or payment.ticket.status == 'CANCELLED'
+    )
+
+    if not payment.transaction_id:
+        if (payment.payment_details or {}).get('submission') == 'unconfirmed' and not expired:
+            # The push may have reached M-Pesa; its callback names the payment
+            Payment.objects.filter(pk=payment.pk).update(updated_at=now)
+            return 'pending'
+        # Never reached the provider and no job will send it any more
+        fail_payment(payment, 'Payment was never submitted to the provider')
+        return 'expired'
+
+    try:
+        outcome, details = query_provider(payment)
+    except PaymentProcessingError as e:
+        logger.warning(f"Could not reconcile payment {payment.id}: {str(e)}")
+        # Move it to the back of the queue so it can't starve the others
+        Payment.objects.filter(pk=payment.pk).update(updated_at=now)
+        return 'errors'
+
+    if outcome == 'completed':
+        # Failed for a refund if its seats were sold on meanwhile
+        return 'completed' if complete_payment(payment, reconciled_at=now.isoformat()) else 'failed'
+    if outcome == 'failed':
+        fail_payment(payment, details.pop('error'), reconciled_at=now.isoformat(), **details)
+        return 'failed'
+    if expired:
+        fail_payment(payment, 'Payment expired', reconciled_at=now.isoformat())
+        return 'expired'
+
+    # Still open at the provider; look again on a later run
+    Payment.objects.filter(pk=payment.pk).update(updated_at=now)
+    return 'pending'
+
+
+def _reconcile_safely(payment, now):
+    try:
+        return reconcile_payment(payment, now)
+    except Exception as e:
+        logger.error(f"Unexpected error reconciling payment {payment.id}: {str(e)}", exc_info=True)
+        return 'errors'
+
+
+def _reconcile_in_thread(payment, now):
+    try:
+        return _reconcile_safely(payment, now)
+    finally:
+        connection.close()
+
+
+def reconcile(concurrency=None, limit=None, now=None):
+    """
+    Reconcile one batch of stale pending payments
+
+    Returns the run's metrics: counts per outcome, duration, throughput and
+    how long the oldest payment had been pending.
+    """
+    concurrency = concurrency or settings.PAYMENT_RECONCILE_CONCURRENCY
+    now = now or timezone.now()
+    started = time.monotonic()
+
+    close_old_connections()
+    payments = list(stale_payments(now)[:limit or settings.PAYMENT_RECONCILE_BATCH_SIZE])
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='payment-reconciler') as pool:
+            outcomes = list(pool.map(lambda payment: _reconcile_in_thread(payment, now), payments))
+    else:
+        outcomes = [_reconcile_safely(payment, now) for payment in payments]
+
+    duration = time.monotonic() - started
+    metrics = {
+        'finished_at': timezone.now().isoformat(),
+        'scanned': len(payments),
+        **{outcome: outcomes.count(outcome) for outcome in OUTCOMES},
+        'duration_seconds': round(duration, 3),
+        'payments_per_second': round(len(payments) / duration, 1) if duration else 0,
+        # Age of the oldest payment seen, i.e. how far behind the callbacks we are
+        'max_lag_seconds': max((round((now - p.created_at).total_seconds()) for p in payments), default=0),
+        # Still due after this run; keeps growing if the reconciler can't keep up
+        'backlog': stale_payments(now).count(),
+    }
+    cache.set(METRICS_CACHE_KEY, metrics, None)
+    logger.info(f"Reconciled payments: {metrics}")
+    return metrics
+
+
+def last_run_metrics():
+    """Metrics of the latest reconciler run in any process, or None"""
+    return cache.get(METRICS_CACHE_KEY)
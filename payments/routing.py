@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .consumers import PaymentStatusConsumer
+
+websocket_urlpatterns = [
+    path('ws/payments/<uuid:payment_id>/', PaymentStatusConsumer.as_asgi()),
+]
@@ -0,0 +1,53 @@
+"""
+Answering payment status polls.
+
+Polls are served from the database. The provider is only asked about a
+pending M-Pesa payment once the payment has been quiet for
+PAYMENT_STATUS_STALE_SECONDS, and at most once per window: concurrent polls
+for the same payment share that single query instead of each making one.
+Clients that want updates as they happen should subscribe to the payment's
+WebSocket instead (payments/consumers.py).
+"""
+from datetime import timedelta
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .exceptions import PaymentProcessingError
+from .lifecycle import complete_payment, fail_payment
+
+logger = logging.getLogger(__name__)
+
+
+def refresh_from_provider(payment):
+    """
+    Bring a pending payment up to date with the provider if it is stale
+
+    Returns the provider's answer, or None if the poll was answered locally.
+    """
+    if payment.status != 'PENDING' or payment.payment_method != 'MPESA' or not payment.transaction_id:
+        return None
+
+    window = settings.PAYMENT_STATUS_STALE_SECONDS
+    if payment.updated_at and timezone.now() - payment.updated_at < timedelta(seconds=window):
+        return None
+    # The first poll in a window queries, the others use local state
+    if not cache.add(f'payments:status:query:{payment.pk}', 1, window):
+        return None
+
+    from .mpesa_service import MPesaService
+    try:
+        result = MPesaService().query_transaction(payment.transaction_id)
+    except PaymentProcessingError as e:
+        logger.warning(f"Could not refresh payment {payment.id} from M-Pesa: {str(e)}")
+        return None
+
+    # A ResultCode is only present once the customer has acted on the prompt
+    result_code = result.get('ResultCode')
+    if result_code == '0':
+        complete_payment(payment)
+    elif result_code is not None:
+        fail_payment(payment, result.get('ResultDesc', 'Payment failed'), error_code=result_code)
+    return result
@@ -2,6 +2,7 @@ import stripe
 from django.conf import settings
 from decimal import Decimal
 from .exceptions import PaymentProcessingError
+from .http import get_provider_config, get_provider_session
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,6 +10,13 @@ logger = logging.getLogger(__name__)
 # Configure Stripe with your API key
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
+# Route Stripe's HTTP calls through the shared pooled session with timeouts,
+# circuit breaker and latency metrics. Stripe resends failed requests itself,
+# safely, because every payment carries an idempotency key.
+_session = get_provider_session('stripe')
+stripe.default_http_client = stripe.RequestsClient(timeout=_session.timeout, session=_session)
+stripe.max_network_retries = get_provider_config('stripe')['retries']
+
 class StripeService:
     """
     Service for processing payments through Stripe
@@ -31,7 +39,9 @@ class StripeService:
                     "order_number": payment.ticket.order_number,
                     "event": payment.ticket.event.title,
                     "user_id": str(payment.ticket.user.id)
-                }
+                },
+                # Retries of the same payment job must not charge twice
+                idempotency_key=payment_data.get('idempotency_key')
             )
 
             # Update payment record
@@ -57,6 +67,14 @@ class StripeService:
             logger.error(f"Card error: {str(e)}")
             raise PaymentProcessingError(f"Card was declined: {e.user_message}")
 
+        except (stripe.error.APIConnectionError, stripe.error.RateLimitError) as e:
+            # Transient; the payment worker retries with the same idempotency key
+            payment.status = 'FAILED'
+            payment.payment_details = {'error': str(e)}
+            payment.save()
+            logger.warning(f"Transient Stripe error: {str(e)}")
+            raise PaymentProcessingError("Could not connect to Stripe", retryable=True)
+
         except stripe.error.StripeError as e:
             # Other Stripe errors
             payment.status = 'FAILED'
@@ -1,3 +1,522 @@
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+from rest_framework.test import APIClient
+from datetime import date, time, timedelta
+import hashlib
+import hmac
+import json
+import requests
+import socket
+import threading
+import time as time_module
+from urllib.parse import urlsplit
+from urllib3.exceptions import MaxRetryError, NewConnectionError
 
-# Create your tests here.
+from authentication.models import User, EventPlanner
+from core.explain import captured_full_scans
+from events.models import Event, EventDate
+from tickets.models import Payment, Ticket
+from .exceptions import ProviderUnavailable
+from .lifecycle import complete_payment, payment_group
+from .http import DEFAULT_PROVIDER_HTTP, CircuitBreaker, ProviderSession, get_provider_session, request_not_sent
+from .models import PaymentJob, WebhookEvent
+from .reconciler import last_run_metrics, reconcile, stale_payments
+from .status import refresh_from_provider
+from .token_manager import TokenManager
+from .webhooks import process_batch
+from .worker import claim_jobs, run_once
+
+
+class FakeProvider(requests.adapters.BaseAdapter):
+    """
+    Stands in for a provider's API on its pooled session: paths in
+    ``responses`` are answered with that JSON (or what a callable returns
+    for the request), every other request fails as a refused connection
+    """
+    def __init__(self):
+        super().__init__()
+        self.responses = {}
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        path = urlsplit(request.url).path
+        if path not in self.responses:
+            refused = NewConnectionError(None, 'Connection refused')
+            raise requests.exceptions.ConnectionError(MaxRetryError(None, request.url, refused), request=request)
+        body = self.responses[path]
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(body(request) if callable(body) else body).encode()
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def refused_url(path=''):
+    """A local URL nothing listens on, so connections fail without a DNS lookup"""
+    with socket.socket() as unused:
+        unused.bind(('127.0.0.1', 0))
+        port = unused.getsockname()[1]
+    return f'http://127.0.0.1:{port}{path}'
+
+
+# Provider calls never leave the process: they are answered by FakeProviders
+@override_settings(MPESA_API_URL='https://mpesa.invalid')
+class PaymentTestCase(TestCase):
+    def setUp(self):
+        self.mpesa = self.fake_provider('mpesa', 'https://mpesa.invalid/')
+        self.stripe = self.fake_provider('stripe', 'https://api.stripe.com/')
+
+        self.user = User.objects.create_user(email='fan@example.com', username='fan', password='pass1234')
+        planner_user = User.objects.create_user(email='planner@example.com', username='planner', password='pass1234')
+        planner = EventPlanner.objects.create(
+            user=planner_user, phone='0700000000', national_id='123', status='approved'
+        )
+        self.event = Event.objects.create(
+            planner=planner, title='Concert', description='Description',
+            location='Nairobi', address='Street', price=10,
+        )
+        self.event_date = EventDate.objects.create(
+            event=self.event, date=date.today() + timedelta(days=7), time=time(18, 0)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def fake_provider(self, provider, prefix):
+        fake = FakeProvider()
+        session = get_provider_session(provider)
+        session.mount(prefix, fake)
+        self.addCleanup(session.adapters.pop, prefix)
+        session.breaker.record_success()
+        return fake
+
+    def purchase(self):
+        response = self.client.post('/api/tickets/purchase/', {
+            'event_id': str(self.event.id), 'date_id': self.event_date.pk, 'quantity': 2,
+            'payment_method': 'MPESA', 'phone_number': '0700000000',
+        }, format='json')
+        self.assertEqual(response.status_code, 202)
+        return response.json()
+
+
+class PaymentWorkerTests(PaymentTestCase):
+    def test_purchase_queues_payment_and_returns_status_url(self):
+        result = self.purchase()
+
+        job = PaymentJob.objects.get(payment_id=result['payment_id'])
+        self.assertEqual(job.status, 'QUEUED')
+        self.assertEqual(job.payload, {'phone_number': '0700000000'})
+        self.assertTrue(result['status_url'].endswith(f"/api/payments/status/{result['payment_id']}/"))
+
+        response = self.client.get(result['status_url'])
+        self.assertEqual(response.json()['payment_status'], 'PENDING')
+        self.assertEqual(response.json()['job']['status'], 'QUEUED')
+
+        self.event_date.refresh_from_db()
+        self.assertEqual(self.event_date.tickets_sold, 2)
+
+    def test_card_purchase_needs_a_payment_method_id(self):
+        purchase = {
+            'event_id': str(self.event.id), 'date_id': self.event_date.pk, 'quantity': 1, 'payment_method': 'CARD',
+        }
+        response = self.client.post('/api/tickets/purchase/', {
+            **purchase, 'card_number': '4242424242424242', 'card_expiry': '12/30', 'card_cvv': '123',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('payment_method_id', response.json()['errors'])
+
+        response = self.client.post('/api/tickets/purchase/', {**purchase, 'payment_method_id': 'pm_1'}, format='json')
+        self.assertEqual(response.status_code, 202)
+        job = PaymentJob.objects.get(payment_id=response.json()['payment_id'])
+        self.assertEqual(job.payload, {'payment_method_id': 'pm_1'})
+
+    def test_charge_after_the_hold_expired_fails_the_payment_for_a_refund(self):
+        response = self.client.post('/api/tickets/purchase/', {
+            'event_id': str(self.event.id), 'date_id': self.event_date.pk, 'quantity': 2,
+            'payment_method': 'CARD', 'payment_method_id': 'pm_1',
+        }, format='json')
+        ticket = Ticket.objects.get(pk=response.json()['ticket']['id'])
+
+        def charge(request):
+            # The hold runs out while Stripe charges the card, and the seats sell out
+            ticket.cancel_hold()
+            EventDate.objects.filter(pk=self.event_date.pk).update(capacity=0)
+            return {'id': 'pi_1', 'object': 'payment_intent', 'status': 'succeeded', 'payment_method': 'pm_1'}
+        self.stripe.responses['/v1/payment_intents'] = charge
+
+        self.assertEqual(run_once(), 1)
+
+        job = PaymentJob.objects.get(payment_id=response.json()['payment_id'])
+        self.assertEqual(job.status, 'FAILED')
+        payment = job.payment
+        self.assertEqual((payment.status, payment.transaction_id), ('FAILED', 'pi_1'))
+        self.assertTrue(payment.payment_details['refund_required'])
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.status, 'CANCELLED')
+        self.event_date.refresh_from_db()
+        self.assertEqual(self.event_date.tickets_sold, 0)
+
+    def test_jobs_are_claimed_once(self):
+        self.purchase()
+        self.assertEqual(len(claim_jobs(10)), 1)
+        self.assertEqual(claim_jobs(10), [])
+
+    def test_transient_failures_retry_then_release_seats(self):
+        result = self.purchase()
+
+        with override_settings(PAYMENT_JOB_MAX_ATTEMPTS=2):
+            self.assertEqual(run_once(), 1)
+            job = PaymentJob.objects.get(payment_id=result['payment_id'])
+            self.assertEqual((job.status, job.attempts), ('QUEUED', 1))
+            self.assertEqual(job.payment.status, 'PENDING')
+
+            # Not due until the backoff has passed
+            self.assertEqual(run_once(), 0)
+            PaymentJob.objects.filter(pk=job.pk).update(run_after=job.created_at)
+            self.assertEqual(run_once(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('FAILED', 2))
+        self.assertEqual(Ticket.objects.get(pk=result['ticket']['id']).status, 'CANCELLED')
+        self.event_date.refresh_from_db()
+        self.assertEqual(self.event_date.tickets_sold, 0)
+
+
+class PaymentReconcilerTests(PaymentTestCase):
+    def make_stale(self, payment_id, **fields):
+        Payment.objects.filter(pk=payment_id).update(updated_at=timezone.now() - timedelta(hours=1), **fields)
+
+    def test_payments_owned_by_the_worker_are_skipped(self):
+        self.make_stale(self.purchase()['payment_id'])
+        self.assertEqual(reconcile(concurrency=1)['scanned'], 0)
+
+    def test_abandoned_payment_is_expired_and_seats_released(self):
+        result = self.purchase()
+        PaymentJob.objects.filter(payment_id=result['payment_id']).update(status='FAILED')
+        self.make_stale(result['payment_id'])
+
+        metrics = reconcile(concurrency=1)
+
+        self.assertEqual((metrics['scanned'], metrics['expired'], metrics['backlog']), (1, 1, 0))
+        self.assertEqual(Payment.objects.get(pk=result['payment_id']).status, 'FAILED')
+        self.assertEqual(Ticket.objects.get(pk=result['ticket']['id']).status, 'CANCELLED')
+        self.event_date.refresh_from_db()
+        self.assertEqual(self.event_date.tickets_sold, 0)
+        self.assertEqual(last_run_metrics()['expired'], 1)
+
+    def test_unreachable_provider_is_retried_on_a_later_run(self):
+        result = self.purchase()
+        PaymentJob.objects.filter(payment_id=result['payment_id']).update(status='SUCCEEDED')
+        self.make_stale(result['payment_id'], transaction_id='ws_CO_1')
+
+        metrics = reconcile(concurrency=1)
+
+        self.assertEqual((metrics['scanned'], metrics['errors']), (1, 1))
+        self.assertEqual(Payment.objects.get(pk=result['payment_id']).status, 'PENDING')
+        # Checked just now, so not due again yet
+        self.assertEqual(reconcile(concurrency=1)['scanned'], 0)
+
+    def test_unconfirmed_push_waits_for_its_callback_until_expired(self):
+        result = self.purchase()
+        PaymentJob.objects.filter(payment_id=result['payment_id']).update(status='SUCCEEDED')
+        self.make_stale(result['payment_id'], payment_details={'submission': 'unconfirmed'})
+
+        self.assertEqual(reconcile(concurrency=1)['pending'], 1)
+        self.assertEqual(Payment.objects.get(pk=result['payment_id']).status, 'PENDING')
+
+        self.make_stale(result['payment_id'], created_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(reconcile(concurrency=1)['expired'], 1)
+        self.assertEqual(Payment.objects.get(pk=result['payment_id']).status, 'FAILED')
+
+
+class WebhookInboxTests(PaymentTestCase):
+    def mpesa_callback(self, checkout_request_id, path='/api/payments/mpesa/callback/'):
+        return self.client.post(path, {'Body': {'stkCallback': {
+            'CheckoutRequestID': checkout_request_id, 'ResultCode': 0, 'ResultDesc': 'Processed',
+            'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': 'RCPT1'}]},
+        }}}, format='json')
+
+    def stripe_webhook(self, event):
+        payload = json.dumps(event)
+        timestamp = int(time_module.time())
+        signature = hmac.new(b'wh', f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return self.client.post(
+            '/api/payments/stripe/webhook/', payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}',
+        )
+
+    @override_settings(STRIPE_WEBHOOK_SECRET='wh')
+    def test_redelivered_stripe_event_is_applied_once(self):
+        result = self.purchase()
+        Payment.objects.filter(pk=result['payment_id']).update(payment_method='CARD', transaction_id='pi_1')
+        event = {'id': 'evt_1', 'object': 'event', 'type': 'charge.succeeded',
+                 'data': {'object': {'id': 'ch_1', 'object': 'charge', 'payment_intent': 'pi_1'}}}
+
+        for _ in range(2):
+            self.assertEqual(self.stripe_webhook(event).status_code, 200)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+        self.assertEqual(process_batch(), 1)
+        self.assertEqual(process_batch(), 0)
+        self.assertEqual(Payment.objects.get(pk=result['payment_id']).status, 'COMPLETED')
+        self.event_date.refresh_from_db()
+        self.assertEqual(self.event_date.tickets_sold, 2)
+
+        # Replays after processing are dropped as well
+        self.assertEqual(self.stripe_webhook(event).status_code, 200)
+        self.assertEqual(process_batch(), 0)
+
+    def test_mpesa_callback_waits_for_its_payment(self):
+        result = self.purchase()
+
+        for _ in range(2):
+            self.assertEqual(self.mpesa_callback('ws_CO_1').status_code, 200)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+        # The STK push response hasn't been saved yet, so it is retried later
+        self.assertEqual(process_batch(), 1)
+        inbox_event = WebhookEvent.objects.get()
+        self.assertEqual((inbox_event.status, inbox_event.attempts), ('RECEIVED', 1))
+
+        Payment.objects.filter(pk=result['payment_id']).update(transaction_id='ws_CO_1')
+        WebhookEvent.objects.update(run_after=timezone.now())
+        self.assertEqual(process_batch(), 1)
+
+        self.assertEqual(WebhookEvent.objects.get().status, 'PROCESSED')
+        self.assertEqual(Payment.objects.get(pk=result['payment_id']).status, 'COMPLETED')
+        self.assertEqual(Ticket.objects.get(pk=result['ticket']['id']).status, 'CONFIRMED')
+
+    def test_mpesa_callback_finds_an_unconfirmed_push_by_its_url(self):
+        result = self.purchase()
+        Payment.objects.filter(pk=result['payment_id']).update(payment_details={'submission': 'unconfirmed'})
+        self.mpesa.responses = {
+            '/oauth/v1/generate': {'access_token': 'token', 'expires_in': 3599},
+            '/mpesa/stkpushquery/v1/query': {'ResultCode': '0', 'ResultDesc': 'Processed'},
+        }
+
+        path = f"/api/payments/mpesa/callback/?payment={result['payment_id']}"
+        self.assertEqual(self.mpesa_callback('ws_CO_1', path).status_code, 200)
+        self.assertEqual(process_batch(), 1)
+
+        query = json.loads(self.mpesa.requests[-1].body)
+        self.assertEqual(query['CheckoutRequestID'], 'ws_CO_1')
+
+        self.assertEqual(WebhookEvent.objects.get().status, 'PROCESSED')
+        payment = Payment.objects.get(pk=result['payment_id'])
+        self.assertEqual((payment.status, payment.transaction_id), ('COMPLETED', 'RCPT1'))
+
+    def test_forged_callback_leaves_the_payment_pending(self):
+        result = self.purchase()
+        path = f"/api/payments/mpesa/callback/?payment={result['payment_id']}"
+        self.client.force_authenticate(None)
+
+        # No STK push was attempted, so the URL isn't trusted at all
+        self.assertEqual(self.mpesa_callback('forged-1', path).status_code, 200)
+        process_batch()
+        self.assertEqual(Payment.objects.get(pk=result['payment_id']).status, 'PENDING')
+
+        # After an unconfirmed push M-Pesa must confirm the checkout, and it doesn't know this one
+        Payment.objects.filter(pk=result['payment_id']).update(payment_details={'submission': 'unconfirmed'})
+        WebhookEvent.objects.update(run_after=timezone.now())
+        process_batch()
+
+        payment = Payment.objects.get(pk=result['payment_id'])
+        self.assertEqual((payment.status, payment.transaction_id), ('PENDING', None))
+        self.assertEqual(Ticket.objects.get(pk=result['ticket']['id']).status, 'PENDING')
+        self.assertEqual(WebhookEvent.objects.get().status, 'RECEIVED')
+
+
+class TokenManagerTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.fetches = 0
+        self.expires_in = 3600
+        self.release = threading.Event()
+        self.release.set()
+
+    def fetch(self):
+        self.fetches += 1
+        self.release.wait(5)
+        return f'token-{self.fetches}', self.expires_in
+
+    def test_token_is_reused_until_refresh_margin(self):
+        manager = TokenManager('test', self.fetch, refresh_margin=60)
+        self.assertEqual(manager.get_token(), 'token-1')
+        self.assertEqual(manager.get_token(), 'token-1')
+        self.assertEqual(self.fetches, 1)
+
+        # Inside the refresh margin the next call fetches a new token
+        manager._refresh_at -= 3550
+        self.assertEqual(manager.get_token(), 'token-2')
+
+        manager.invalidate()
+        self.assertEqual(manager.get_token(), 'token-3')
+
+    def test_short_lived_token_is_refreshed_halfway(self):
+        self.expires_in = 60
+        manager = TokenManager('test', self.fetch, refresh_margin=60)
+        self.assertEqual(manager.get_token(), 'token-1')
+        self.assertEqual(manager.get_token(), 'token-1')
+        self.assertEqual(self.fetches, 1)
+
+        manager._refresh_at -= 30
+        self.assertEqual(manager.get_token(), 'token-2')
+
+    def test_concurrent_callers_fetch_once(self):
+        manager = TokenManager('test', self.fetch)
+        self.release.clear()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(manager.get_token())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        self.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(results, ['token-1'] * 8)
+
+    def test_proactive_refresh_keeps_serving_current_token(self):
+        manager = TokenManager('test', self.fetch, refresh_margin=60)
+        manager.get_token()
+        manager._expires_at -= 3590
+        manager._refresh_at -= 3590
+
+        # While one thread refreshes, others get the still-valid token
+        self.release.clear()
+        refresher = threading.Thread(target=manager.get_token)
+        refresher.start()
+        while self.fetches < 2:
+            time_module.sleep(0.01)
+        self.assertEqual(manager.get_token(), 'token-1')
+        self.release.set()
+        refresher.join()
+        self.assertEqual(manager.get_token(), 'token-2')
+
+    def test_shared_token_is_fetched_once_across_managers(self):
+        first = TokenManager('shared-test', self.fetch, shared=True)
+        second = TokenManager('shared-test', self.fetch, shared=True)
+        self.assertEqual(first.get_token(), 'token-1')
+        self.assertEqual(second.get_token(), 'token-1')
+        self.assertEqual(self.fetches, 1)
+
+
+class ProviderSessionTests(SimpleTestCase):
+    def test_circuit_opens_after_failures_and_half_opens(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+
+        # After the reset timeout exactly one trial call goes through
+        breaker.opened_at -= 60
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_failing_provider_fails_fast_with_metrics(self):
+        session = ProviderSession('test', {**DEFAULT_PROVIDER_HTTP, 'retries': 0, 'failure_threshold': 2})
+        url = refused_url('/oauth')
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                session.get(url)
+        with self.assertRaises(ProviderUnavailable) as context:
+            session.get(url)
+        self.assertTrue(context.exception.retryable)
+
+        metrics = session.metrics()
+        self.assertEqual(metrics['circuit'], 'open')
+        self.assertEqual(metrics['latency']['GET /oauth']['count'], 2)
+
+    def test_only_unopened_connections_are_known_unsent(self):
+        session = ProviderSession('test', {**DEFAULT_PROVIDER_HTTP, 'retries': 0, 'read_timeout': 0.2})
+        with self.assertRaises(requests.exceptions.ConnectionError) as context:
+            session.post(refused_url('/stkpush'))
+        self.assertTrue(request_not_sent(context.exception))
+
+        # A provider that accepts the request and never answers may still act on it
+        with socket.socket() as server:
+            server.bind(('127.0.0.1', 0))
+            server.listen()
+            with self.assertRaises(requests.exceptions.ReadTimeout) as context:
+                session.post(f'http://127.0.0.1:{server.getsockname()[1]}/stkpush')
+        self.assertFalse(request_not_sent(context.exception))
+
+
+class PaymentStatusPushTests(PaymentTestCase):
+    def subscribe(self, payment_id):
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(payment_group(payment_id), channel_name)
+        return channel_layer, channel_name
+
+    def test_completion_is_published_after_commit(self):
+        payment = Payment.objects.get(pk=self.purchase()['payment_id'])
+        channel_layer, channel_name = self.subscribe(payment.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            complete_payment(payment, mpesa_receipt='ABC123')
+
+        message = async_to_sync(channel_layer.receive)(channel_name)
+        self.assertEqual(message['type'], 'payment.status')
+        self.assertEqual(message['payment_status'], 'COMPLETED')
+        self.assertEqual(message['ticket_status'], 'CONFIRMED')
+
+    def test_status_polls_share_one_provider_query(self):
+        cache.clear()
+        payment = Payment.objects.get(pk=self.purchase()['payment_id'])
+        Payment.objects.filter(pk=payment.pk).update(transaction_id='ws_CO_1')
+        payment.refresh_from_db()
+
+        # Recently updated payments are answered locally
+        self.assertIsNone(refresh_from_provider(payment))
+
+        # The first stale poll queries the (unreachable) provider, the next one doesn't
+        payment.updated_at = timezone.now() - timedelta(seconds=60)
+        self.assertIsNone(refresh_from_provider(payment))
+        requests_made = self.provider_requests()
+        self.assertIsNone(refresh_from_provider(payment))
+        self.assertEqual(self.provider_requests(), requests_made)
+        self.assertTrue(cache.get(f'payments:status:query:{payment.pk}'))
+
+    def provider_requests(self):
+        latency = get_provider_session('mpesa').metrics()['latency']
+        return sum(histogram['count'] for histogram in latency.values())
+
+
+class PaymentIndexPlanTests(PaymentTestCase):
+    """Webhook, worker and reconciler lookups must use an index, never a table scan"""
+    TABLES = ('tickets_payment', 'tickets_ticket', 'payments_paymentjob', 'payments_webhookevent')
+
+    def assertNoFullScans(self, queries):
+        self.assertEqual(captured_full_scans(queries, self.TABLES), [])
+
+    def test_webhook_batch_finds_payments_by_reference(self):
+        result = self.purchase()
+        Payment.objects.filter(pk=result['payment_id']).update(transaction_id='ws_CO_1')
+        WebhookEvent.objects.create(provider='MPESA', event_id='ws_CO_1', event_type='callback', payload={
+            'Body': {'stkCallback': {'CheckoutRequestID': 'ws_CO_1', 'ResultCode': 0, 'ResultDesc': 'Processed'}},
+        })
+
+        with CaptureQueriesContext(connection) as context:
+            process_batch()
+        self.assertNoFullScans(context.captured_queries)
+
+    def test_worker_and_reconciler_scans_use_indexes(self):
+        self.purchase()
+        with CaptureQueriesContext(connection) as context:
+            claim_jobs(10)
+            list(stale_payments())
+        self.assertNoFullScans(context.captured_queries)
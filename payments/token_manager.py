@@ -0,0 +1,145 @@
+"""
+Cached OAuth access tokens for payment providers.
+
+A TokenManager keeps one token per provider credential and hands it to every
+service instance and worker thread until shortly before it expires
+(REFRESH_MARGIN seconds ahead of the provider's ``expires_in``, or halfway
+through the lifetime of tokens shorter than twice that). Refreshes are
+single-flight: one caller fetches while the others wait for its result, or
+keep using the still-valid previous token.
+
+With ``shared=True`` the token is also stored in the Django cache, so all
+processes on a Redis-backed cache share it and only one of them refreshes it
+at a time.
+"""
+import hashlib
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Refresh this many seconds before the provider says the token expires
+REFRESH_MARGIN = 60
+
+# How long other processes wait for the one refreshing a shared token
+SHARED_LOCK_TIMEOUT = 10
+SHARED_WAIT_INTERVAL = 0.1
+
+
+class TokenManager:
+    def __init__(self, name, fetch, shared=False, refresh_margin=REFRESH_MARGIN):
+        """
+        ``fetch`` returns ``(access_token, expires_in_seconds)`` from the provider
+        """
+        self.name = name
+        self.fetch = fetch
+        self.shared = shared
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def _cache_key(self):
+        return f'oauth:token:{self.name}'
+
+    def _usable(self, expires_at, now):
+        return now < expires_at
+
+    def _fresh(self, refresh_at, now):
+        return now < refresh_at
+
+    def get_token(self):
+        now = time.time()
+        if self._token and self._fresh(self._refresh_at, now):
+            return self._token
+
+        if self._token and self._usable(self._expires_at, now):
+            # Proactive refresh: one thread refreshes, the rest keep the old token
+            if not self._lock.acquire(blocking=False):
+                return self._token
+        else:
+            self._lock.acquire()
+
+        try:
+            # Another thread may have refreshed while we waited for the lock
+            now = time.time()
+            if self._token and self._fresh(self._refresh_at, now):
+                return self._token
+
+            try:
+                if self.shared:
+                    self._token, self._expires_at, self._refresh_at = self._get_shared_token()
+                else:
+                    self._token, self._expires_at, self._refresh_at = self._fetch()
+            except Exception:
+                if self._token and self._usable(self._expires_at, time.time()):
+                    logger.warning(f"Refreshing {self.name} token failed, using the current one", exc_info=True)
+                    return self._token
+                raise
+            return self._token
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        """Drop the cached token, e.g. after the provider rejected it"""
+        with self._lock:
+            self._token = None
+            self._expires_at = self._refresh_at = 0.0
+            if self.shared:
+                cache.delete(self._cache_key)
+
+    def _fetch(self):
+        token, expires_in = self.fetch()
+        logger.info(f"Fetched new {self.name} access token valid for {expires_in}s")
+        now, expires_in = time.time(), int(expires_in)
+        # A margin longer than the token's life would make it never fresh
+        margin = min(self.refresh_margin, expires_in / 2)
+        return token, now + expires_in, now + expires_in - margin
+
+    def _get_shared_token(self):
+        deadline = time.time() + SHARED_LOCK_TIMEOUT
+        lock_key = f'{self._cache_key}:refresh'
+        while True:
+            now = time.time()
+            entry = cache.get(self._cache_key)
+            if entry and self._fresh(entry['refresh_at'], now):
+                return entry['token'], entry['expires_at'], entry['refresh_at']
+
+            if cache.add(lock_key, 1, SHARED_LOCK_TIMEOUT):
+                try:
+                    token, expires_at, refresh_at = self._fetch()
+                    cache.set(
+                        self._cache_key,
+                        {'token': token, 'expires_at': expires_at, 'refresh_at': refresh_at},
+                        max(int(expires_at - now), 1),
+                    )
+                    return token, expires_at, refresh_at
+                finally:
+                    cache.delete(lock_key)
+
+            # Someone else is refreshing; the old token is fine until it expires
+            if entry and self._usable(entry['expires_at'], now):
+                return entry['token'], entry['expires_at'], entry['refresh_at']
+            if now >= deadline:
+                return self._fetch()
+            time.sleep(SHARED_WAIT_INTERVAL)
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(provider, credential, fetch, shared=False):
+    """Return the process-wide TokenManager for a provider credential"""
+    # Key on a digest so the credential itself never ends up in cache keys
+    digest = hashlib.sha256(credential.encode()).hexdigest()[:16]
+    name = f'{provider}:{digest}'
+    with _managers_lock:
+        if name not in _managers:
+            _managers[name] = TokenManager(name, fetch, shared=shared)
+        return _managers[name]
@@ -1,8 +1,9 @@
 from django.urls import path
-from .views import MPesaCallbackView, StripeWebhookView, PaymentStatusView
+from .views import MPesaCallbackView, StripeWebhookView, PaymentStatusView, ProviderMetricsView
 
 urlpatterns = [
     path('mpesa/callback/', MPesaCallbackView.as_view(), name='mpesa-callback'),
     path('stripe/webhook/', StripeWebhookView.as_view(), name='stripe-webhook'),
     path('status/<uuid:payment_id>/', PaymentStatusView.as_view(), name='payment-status'),
+    path('metrics/', ProviderMetricsView.as_view(), name='payment-provider-metrics'),
 ]
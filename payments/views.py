@@ -1,18 +1,25 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework import status
+from rest_framework import permissions, status
 import json
 import logging
 from tickets.models import Payment
-from .mpesa_service import MPesaService
 from .stripe_service import StripeService
+from .http import provider_metrics
+from .reconciler import last_run_metrics
+from .status import refresh_from_provider
+from .webhooks import record_webhook
 import stripe
+from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
 class MPesaCallbackView(APIView):
     """
     View to handle M-Pesa STK push callbacks
+
+    The callback is stored in the webhook inbox and acknowledged straight
+    away; ``manage.py process_webhooks`` applies it to the payment.
     """
     # No authentication required for M-Pesa callbacks
     authentication_classes = []
@@ -31,16 +38,13 @@ class MPesaCallbackView(APIView):
                 logger.error("No CheckoutRequestID in callback data")
                 return Response({"result": "error", "message": "Invalid callback data"}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Find payment with this checkout request ID
-            try:
-                payment = Payment.objects.get(transaction_id=checkout_request_id)
-            except Payment.DoesNotExist:
-                logger.error(f"No payment found for CheckoutRequestID: {checkout_request_id}")
-                return Response({"result": "error", "message": "Payment not found"}, status=status.HTTP_404_NOT_FOUND)
+            # Set by MPesaService._callback_url, for pushes whose response was lost
+            payment_id = request.query_params.get('payment')
+            if payment_id:
+                callback_data = {**callback_data, 'payment_id': payment_id}
 
-            # Process the callback
-            mpesa_service = MPesaService()
-            mpesa_service.process_callback(callback_data, payment)
+            # Retried deliveries of the same checkout are dropped here
+            record_webhook('MPESA', checkout_request_id, 'stkCallback', callback_data)
 
             # Return success response
             return Response({"result": "success"}, status=status.HTTP_200_OK)
@@ -53,6 +57,9 @@ class MPesaCallbackView(APIView):
 class StripeWebhookView(APIView):
     """
     View to handle Stripe webhook events
+
+    Verified events are stored in the webhook inbox and acknowledged straight
+    away; ``manage.py process_webhooks`` applies them to payments.
     """
     authentication_classes = []
     permission_classes = []
@@ -68,58 +75,10 @@ class StripeWebhookView(APIView):
             )
             
             logger.info(f"Received Stripe webhook: {event.type}")
-            
-            # Handle payment events
-            if event.type == 'charge.succeeded':
-                charge = event.data.object
-                transaction_id = charge.id
-                
-                try:
-                    payment = Payment.objects.get(transaction_id=transaction_id)
-                    
-                    # If the payment isn't already marked as completed
-                    if payment.status != 'COMPLETED':
-                        payment.status = 'COMPLETED'
-                        payment.save()
-                        
-                        # Update ticket status
-                        ticket = payment.ticket
-                        ticket.status = 'CONFIRMED'
-                        ticket.payment_completed = True
-                        ticket.save()
-                        
-                        # Update event date tickets sold count
-                        event_date = ticket.event_date
-                        event_date.tickets_sold += ticket.quantity
-                        event_date.save()
-                        
-                        logger.info(f"Payment {payment.id} marked as completed via webhook")
-                
-                except Payment.DoesNotExist:
-                    logger.error(f"No payment found for transaction ID: {transaction_id}")
-            
-            elif event.type == 'charge.refunded':
-                charge = event.data.object
-                transaction_id = charge.id
-                
-                try:
-                    payment = Payment.objects.get(transaction_id=transaction_id)
-                    
-                    # If the payment isn't already refunded
-                    if payment.status != 'REFUNDED':
-                        payment.status = 'REFUNDED'
-                        payment.save()
-                        
-                        # Update ticket status
-                        ticket = payment.ticket
-                        ticket.status = 'CANCELLED'
-                        ticket.save()
-                        
-                        logger.info(f"Payment {payment.id} marked as refunded via webhook")
-                
-                except Payment.DoesNotExist:
-                    logger.error(f"No payment found for transaction ID: {transaction_id}")
-                    
+
+            # Stripe retries until acknowledged; redeliveries are dropped here
+            record_webhook('STRIPE', event.id, event.type, json.loads(payload))
+
             return Response({"status": "success"}, status=status.HTTP_200_OK)
             
         except ValueError as e:
@@ -145,36 +104,46 @@ class PaymentStatusView(APIView):
             if payment.ticket.user != request.user:
                 return Response({"status": "error", "message": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
             
-            # If payment is still pending, check its current status
-            if payment.status == 'PENDING':
-                if payment.payment_method == 'MPESA':
-                    # For M-Pesa, query the transaction status
-                    mpesa_service = MPesaService()
-                    checkout_request_id = payment.transaction_id
-                    if checkout_request_id:
-                        result = mpesa_service.query_transaction(checkout_request_id)
-                        return Response({
-                            "status": "success",
-                            "payment_status": payment.status,
-                            "mpesa_status": result
-                        })
-                
-                # For other payment methods, just return current status
-                return Response({
-                    "status": "success", 
-                    "payment_status": payment.status,
-                    "payment_details": payment.payment_details
-                })
-            
-            # For completed/failed payments, return the current status
-            return Response({
+            # Progress of the queued provider call, if any
+            job = payment.jobs.order_by('-created_at').first()
+            job_status = job and {
+                "status": job.status,
+                "attempts": job.attempts,
+                "next_attempt_at": job.run_after if job.status == 'QUEUED' else None,
+            }
+
+            # Answered from local state; M-Pesa is only queried once the
+            # payment has been pending for a while (live updates: ws/payments/<id>/)
+            result = refresh_from_provider(payment)
+
+            response_data = {
                 "status": "success",
                 "payment_status": payment.status,
+                "ticket_status": payment.ticket.status,
+                "job": job_status,
                 "payment_details": payment.payment_details
-            })
+            }
+            if result is not None:
+                response_data["mpesa_status"] = result
+            return Response(response_data)
             
         except Payment.DoesNotExist:
             return Response({"status": "error", "message": "Payment not found"}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             logger.error(f"Error checking payment status: {str(e)}", exc_info=True)
             return Response({"status": "error", "message": "Server error"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class ProviderMetricsView(APIView):
+    """
+    Circuit breaker state and latency histograms of payment provider calls
+    made by this process, and the latest payment reconciler run
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            "status": "success",
+            "providers": provider_metrics(),
+            "reconciler": last_run_metrics(),
+        })
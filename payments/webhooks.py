@@ -0,0 +1,180 @@
+"""
+Webhook inbox.
+
+Providers retry callbacks they don't see acknowledged quickly, and may deliver
+the same event more than once or concurrently. The webhook views therefore
+do nothing but verify the delivery and ``record_webhook()`` it: a single
+INSERT that is silently dropped if (provider, event_id) is already stored.
+
+``manage.py process_webhooks`` drains the inbox in batches. Each batch is one
+transaction: events are claimed with SELECT ... FOR UPDATE SKIP LOCKED where
+the database supports it, their payments are loaded with one query, every
+event is applied in its own savepoint, and the outcome is written back with a
+few bulk UPDATEs. An event is marked PROCESSED in the same transaction that
+applies it, so it takes effect exactly once. Events that fail are retried with
+backoff (an M-Pesa callback can beat the worker saving the CheckoutRequestID)
+and marked FAILED after WEBHOOK_MAX_ATTEMPTS.
+"""
+from datetime import timedelta
+import logging
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from tickets.models import Payment
+from .lifecycle import complete_payment, fail_payment, refund_payment
+from .models import WebhookEvent
+from .reconciler import query_mpesa
+
+logger = logging.getLogger(__name__)
+
+# Stripe events we act on; anything else is stored and ignored
+STRIPE_EVENT_TYPES = ('charge.succeeded', 'charge.refunded')
+
+
+class WebhookNotReady(Exception):
+    """The event can't be applied yet, e.g. its payment isn't known yet"""
+
+
+def record_webhook(provider, event_id, event_type, payload):
+    """Store a delivery; redeliveries of a stored event are dropped by the database"""
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(provider=provider, event_id=event_id, event_type=event_type, payload=payload)],
+        ignore_conflicts=True,
+    )
+
+
+def payment_reference(event):
+    """The Payment.transaction_id an event refers to"""
+    if event.provider == 'MPESA':
+        return event.event_id
+    charge = event.payload.get('data', {}).get('object', {})
+    # We store PaymentIntent ids; older payments may have stored the charge id
+    return charge.get('payment_intent') or charge.get('id')
+
+
+def apply_event(event, payment):
+    """Apply one event to its payment; returns False if there was nothing to do"""
+    if event.provider == 'MPESA':
+        if payment.status != 'PENDING':
+            # Already settled, e.g. by the reconciler or a status poll
+            return False
+        from .mpesa_service import MPesaService
+        if not payment.transaction_id:
+            # Matched through its callback URL only. Callbacks aren't
+            # authenticated, so M-Pesa has to confirm the checkout first
+            outcome, details = query_mpesa(event.event_id)
+            if outcome == 'pending':
+                raise WebhookNotReady(f'Checkout {event.event_id} is not settled at M-Pesa')
+            payment.transaction_id = event.event_id
+            result_code = event.payload.get('Body', {}).get('stkCallback', {}).get('ResultCode')
+            if (outcome == 'completed') != (result_code == 0):
+                # The callback contradicts M-Pesa; M-Pesa wins
+                if outcome == 'completed':
+                    complete_payment(payment)
+                else:
+                    fail_payment(payment, details.pop('error'), **details)
+                return True
+        MPesaService().process_callback(event.payload, payment)
+        return True
+
+    if event.event_type == 'charge.succeeded' and payment.status != 'COMPLETED':
+        complete_payment(payment)
+        return True
+    if event.event_type == 'charge.refunded' and payment.status != 'REFUNDED':
+        refund_payment(payment)
+        return True
+    return False
+
+
+def _payments_for(events):
+    references = {payment_reference(event) for event in events} - {None}
+    payments = Payment.objects.filter(transaction_id__in=references).select_related('ticket')
+    by_reference = {payment.transaction_id: payment for payment in payments}
+
+    # An STK push whose response was lost left no CheckoutRequestID behind;
+    # its callback URL named the payment instead. Only payments with such a
+    # push qualify, and apply_event() has M-Pesa confirm the checkout.
+    unmatched = {
+        event.event_id: event.payload['payment_id'] for event in events
+        if event.provider == 'MPESA' and event.event_id not in by_reference and event.payload.get('payment_id')
+    }
+    if unmatched:
+        pending = Payment.objects.filter(pk__in=set(unmatched.values()), payment_method='MPESA').select_related('ticket')
+        by_pk = {
+            str(payment.pk): payment for payment in pending
+            if not payment.transaction_id and (payment.payment_details or {}).get('submission') == 'unconfirmed'
+        }
+        for reference, payment_id in unmatched.items():
+            if payment_id in by_pk:
+                by_reference[reference] = by_pk[payment_id]
+    return by_reference
+
+
+def process_batch(batch_size=None):
+    """Apply one batch of due events; returns how many were claimed"""
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            WebhookEvent.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='RECEIVED', run_after__lte=now)
+            .order_by('run_after')[:batch_size or settings.WEBHOOK_BATCH_SIZE]
+        )
+        if not events:
+            return 0
+        payments = _payments_for(events)
+
+        processed, ignored, failed = [], [], []
+        for event in events:
+            if event.provider == 'STRIPE' and event.event_type not in STRIPE_EVENT_TYPES:
+                ignored.append(event.pk)
+                continue
+            payment = payments.get(payment_reference(event))
+            try:
+                if payment is None:
+                    raise WebhookNotReady(f'No payment for {payment_reference(event)}')
+                with transaction.atomic():
+                    applied = apply_event(event, payment)
+                (processed if applied else ignored).append(event.pk)
+            except Exception as e:
+                if not isinstance(e, WebhookNotReady):
+                    logger.error(f"Error applying webhook {event}: {str(e)}", exc_info=True)
+                failed.append((event, str(e)))
+
+        WebhookEvent.objects.filter(pk__in=processed).update(
+            status='PROCESSED', attempts=F('attempts') + 1, processed_at=now
+        )
+        WebhookEvent.objects.filter(pk__in=ignored).update(
+            status='IGNORED', attempts=F('attempts') + 1, processed_at=now
+        )
+        for event, error in failed:
+            _record_failure(event, error, now)
+    return len(events)
+
+
+def _record_failure(event, error, now):
+    attempts = event.attempts + 1
+    if attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+        logger.error(f"Giving up on webhook {event} after {attempts} attempts: {error}")
+        status, run_after = 'FAILED', event.run_after
+    else:
+        status = 'RECEIVED'
+        run_after = now + timedelta(seconds=settings.WEBHOOK_RETRY_DELAY * 2 ** (attempts - 1))
+    WebhookEvent.objects.filter(pk=event.pk).update(
+        status=status, attempts=attempts, run_after=run_after, last_error=error
+    )
+
+
+def process_webhooks(poll_interval=None, once=False):
+    """Drain the inbox; with ``once`` stop as soon as no event is due"""
+    poll_interval = poll_interval or settings.WEBHOOK_POLL_INTERVAL
+    while True:
+        close_old_connections()
+        if not process_batch():
+            if once:
+                return
+            time.sleep(poll_interval)
@@ -0,0 +1,179 @@
+"""
+Payment worker.
+
+Purchases no longer talk to Stripe or M-Pesa in the request thread. They
+commit the Ticket and Payment as PENDING together with a PaymentJob, and the
+worker started by ``manage.py run_payment_worker`` executes the provider call:
+
+* Due jobs are claimed with a conditional UPDATE (QUEUED -> RUNNING plus a
+  lease), so any number of worker threads or processes can share the table.
+* Transient provider errors are retried with exponential backoff, reusing the
+  job's idempotency key; permanent ones fail the payment and release the
+  ticket's seats. An M-Pesa STK push has no idempotency key, so it is only
+  retried when it certainly never reached M-Pesa (see request_not_sent).
+* A worker that dies mid-job leaves a RUNNING job whose lease runs out, and
+  the job is picked up again.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from tickets.models import Payment
+from .exceptions import PaymentProcessingError
+from .lifecycle import complete_payment, fail_payment, publish_payment_status
+from .models import PaymentJob
+from .payment_factory import PaymentFactory
+
+logger = logging.getLogger(__name__)
+
+# Fields of the purchase request the providers need
+PAYLOAD_FIELDS = ('payment_method_id', 'phone_number')
+
+
+def enqueue_payment(payment, payment_data):
+    """Queue the provider call for a payment; call inside the purchase transaction"""
+    return PaymentJob.objects.create(
+        payment=payment,
+        payload={field: payment_data[field] for field in PAYLOAD_FIELDS if payment_data.get(field)},
+    )
+
+
+def claim_jobs(limit):
+    """Claim up to ``limit`` due jobs for this worker"""
+    now = timezone.now()
+    due = PaymentJob.objects.filter(
+        Q(status='QUEUED', run_after__lte=now) | Q(status='RUNNING', locked_until__lt=now)
+    ).order_by('run_after').values_list('pk', 'status', 'locked_until')[:limit]
+
+    claimed = []
+    for pk, status, locked_until in due:
+        # Only succeeds for one worker if several saw the same job
+        updated = PaymentJob.objects.filter(pk=pk, status=status, locked_until=locked_until).update(
+            status='RUNNING',
+            locked_until=now + timedelta(seconds=settings.PAYMENT_JOB_LEASE_SECONDS),
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+        if updated:
+            claimed.append(pk)
+    return list(PaymentJob.objects.filter(pk__in=claimed).select_related('payment__ticket'))
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter, in seconds"""
+    delay = settings.PAYMENT_JOB_RETRY_DELAY * 2 ** (attempts - 1)
+    return min(delay, settings.PAYMENT_JOB_MAX_RETRY_DELAY) * random.uniform(0.8, 1.2)
+
+
+def run_job(job):
+    """Execute one claimed job and record the outcome"""
+    payment = job.payment
+    ticket = payment.ticket
+
+    if payment.status == 'COMPLETED':
+        # Completed by an attempt that crashed before finishing the job
+        _finish(job, 'SUCCEEDED')
+        return
+
+    if ticket.status != 'PENDING':
+        # Cancelled (e.g. hold expired) before the job ran; don't charge
+        _finish(job, 'FAILED', f'Ticket is {ticket.status}')
+        return
+
+    if job.attempts > settings.PAYMENT_JOB_MAX_ATTEMPTS:
+        # Reclaimed after crashing too many times
+        _finish(job, 'FAILED', job.last_error or 'Too many attempts')
+        fail_payment(payment, job.last_error or 'Too many attempts')
+        return
+
+    if payment.payment_method == 'MPESA' and (
+        payment.transaction_id or (payment.payment_details or {}).get('submission') == 'unconfirmed'
+    ):
+        # The STK push went out (or may have) on an earlier attempt; the
+        # callback or the reconciler finishes it
+        _finish(job, 'SUCCEEDED')
+        return
+
+    try:
+        payment.status = 'PENDING'
+        PaymentFactory.process_payment(payment, {**job.payload, 'idempotency_key': job.idempotency_key})
+    except PaymentProcessingError as e:
+        if e.retryable and job.attempts < settings.PAYMENT_JOB_MAX_ATTEMPTS:
+            delay = retry_delay(job.attempts)
+            logger.warning(f"Payment {payment.id} attempt {job.attempts} failed, retrying in {delay:.0f}s: {e}")
+            # The provider service marked it FAILED; it is still in progress
+            Payment.objects.filter(pk=payment.pk).update(status='PENDING')
+            PaymentJob.objects.filter(pk=job.pk).update(
+                status='QUEUED',
+                run_after=timezone.now() + timedelta(seconds=delay),
+                locked_until=None,
+                last_error=str(e),
+                updated_at=timezone.now(),
+            )
+            return
+        logger.error(f"Payment {payment.id} failed after {job.attempts} attempts: {e}")
+        _finish(job, 'FAILED', str(e))
+        # Give the seats back straight away instead of waiting for the hold to expire
+        fail_payment(payment, str(e))
+        return
+
+    # The payment's state changes before the job is finished, so a crash in
+    # between hands the job to another attempt instead of losing the update
+    if payment.status != 'COMPLETED':
+        # e.g. the M-Pesa STK push is out; the callback completes it
+        publish_payment_status(payment)
+    elif not complete_payment(payment):
+        _finish(job, 'FAILED', payment.payment_details['error'])
+        return
+    _finish(job, 'SUCCEEDED')
+
+
+def _finish(job, status, error=''):
+    PaymentJob.objects.filter(pk=job.pk).update(
+        status=status, locked_until=None, last_error=error, updated_at=timezone.now()
+    )
+
+
+def run_once(batch_size=None):
+    """Claim and run one batch of due jobs; returns how many ran"""
+    jobs = claim_jobs(batch_size or settings.PAYMENT_WORKER_BATCH_SIZE)
+    for job in jobs:
+        try:
+            run_job(job)
+        except Exception as e:
+            # Leave it RUNNING; the lease expiry hands it to another attempt
+            logger.error(f"Unexpected error running payment job {job.pk}: {str(e)}", exc_info=True)
+    return len(jobs)
+
+
+def _worker_loop(poll_interval, stop_when_idle):
+    try:
+        while True:
+            close_old_connections()
+            if not run_once():
+                if stop_when_idle:
+                    return
+                time.sleep(poll_interval)
+    finally:
+        connection.close()
+
+
+def run_worker(threads=None, poll_interval=None, once=False):
+    """
+    Run payment worker threads
+
+    With ``once`` the threads exit as soon as no job is due, which suits cron
+    and tests; otherwise they poll forever.
+    """
+    threads = threads or settings.PAYMENT_WORKER_THREADS
+    poll_interval = poll_interval or settings.PAYMENT_WORKER_POLL_INTERVAL
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='payment-worker') as pool:
+        for future in [pool.submit(_worker_loop, poll_interval, once) for _ in range(threads)]:
+            future.result()
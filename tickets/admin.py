@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 from django.contrib import admin
-from .models import Ticket, Payment
+from .models import Ticket, Payment, SalesRollup
 
 class PaymentInline(admin.StackedInline):
     model = Payment
@@ -13,13 +13,16 @@ class TicketAdmin(admin.ModelAdmin):
     list_display = ['order_number', 'user', 'event', 'status', 'quantity', 'payment_completed', 'created_at']
     list_filter = ['status', 'payment_completed', 'payment_method', 'created_at']
     search_fields = ['order_number', 'user__username', 'event__title']
-    readonly_fields = ['id', 'order_number', 'qr_code', 'created_at', 'updated_at']
+    readonly_fields = ['id', 'order_number', 'qr_code', 'inventory_held', 'hold_expires_at', 'created_at', 'updated_at']
     inlines = [PaymentInline]
     
     fieldsets = (
         ('Ticket Information', {
             'fields': ('id', 'order_number', 'user', 'event', 'event_date', 'ticket_type', 'quantity', 'status')
         }),
+        ('Inventory', {
+            'fields': ('inventory_held', 'hold_expires_at')
+        }),
         ('Payment Details', {
             'fields': ('total_price', 'service_fee', 'payment_method', 'payment_completed')
         }),
@@ -37,3 +40,11 @@ class PaymentAdmin(admin.ModelAdmin):
     list_filter = ['status', 'payment_method', 'created_at']
     search_fields = ['transaction_id', 'ticket__order_number', 'ticket__user__username']
     readonly_fields = ['id', 'created_at', 'updated_at']
+
+@admin.register(SalesRollup)
+class SalesRollupAdmin(admin.ModelAdmin):
+    list_display = ['event_date', 'day', 'orders', 'tickets', 'revenue', 'refunds']
+    list_filter = ['day']
+    search_fields = ['event__title']
+    # Maintained by Ticket.update_status; rebuild with `manage.py rebuild_sales_rollups`
+    readonly_fields = [field.name for field in SalesRollup._meta.fields]
@@ -0,0 +1,274 @@
+"""
+Admission queue for flash sales.
+
+Event dates with ``queue_enabled`` set only let a bounded number of buyers
+into the purchase path at a time. Everyone else joins a first-come,
+first-served line and polls their position:
+
+* Joining hands out a token with a sequence number from a per-date counter.
+  A buyer has one place per date: joining again returns the same token.
+* Purchase slots are ADMISSION_QUEUE_SLOTS leases per date, each an
+  ``add``-if-absent key that expires after ADMISSION_SLOT_TTL seconds, so a
+  buyer who walks away frees their slot automatically.
+* Whenever a slot is free, the head of the line is promoted into it. Tokens
+  that stopped polling for ADMISSION_TOKEN_TTL seconds are skipped.
+* A finished purchase, successful or not, gives its slot back right away.
+
+All state lives in a small key-value store with atomic add/incr. The
+in-process store suits tests and single-process setups; the cache store shares
+the line across processes and nodes when CACHE_BACKEND points at Redis (the
+tickets.W001 check warns when it doesn't).
+"""
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Seconds a place in line stays claimed by the caller promoting it. Short, so
+# a caller that dies mid-promotion stalls the line only briefly.
+PROMOTING_TTL = 5
+
+
+class InMemoryQueueStore:
+    """Process-local store; every node would run its own line"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= now:
+            del self._data[key]
+            return None
+        return item
+
+    def _expiry(self, timeout, now):
+        return None if timeout is None else now + timeout
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key, time.monotonic())
+            return None if item is None else item[0]
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            now = time.monotonic()
+            self._data[key] = (value, self._expiry(timeout, now))
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            now = time.monotonic()
+            if self._live(key, now) is not None:
+                return False
+            self._data[key] = (value, self._expiry(timeout, now))
+            return True
+
+    def incr(self, key, delta=1):
+        with self._lock:
+            item = self._live(key, time.monotonic())
+            value = (item[0] if item else 0) + delta
+            self._data[key] = (value, item[1] if item else None)
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class CacheQueueStore:
+    """Store backed by the Django cache, shared between nodes on Redis"""
+
+    def get(self, key):
+        return cache.get(key)
+
+    def set(self, key, value, timeout=None):
+        cache.set(key, value, timeout)
+
+    def add(self, key, value, timeout=None):
+        return cache.add(key, value, timeout)
+
+    def incr(self, key, delta=1):
+        cache.add(key, 0, None)
+        return cache.incr(key, delta)
+
+    def delete(self, key):
+        cache.delete(key)
+
+
+class AdmissionQueue:
+    """The line for purchases of queue-enabled event dates"""
+
+    def __init__(self, store, slots=None, slot_ttl=None, token_ttl=None):
+        self.store = store
+        self.slots = slots or settings.ADMISSION_QUEUE_SLOTS
+        self.slot_ttl = slot_ttl or settings.ADMISSION_SLOT_TTL
+        self.token_ttl = token_ttl or settings.ADMISSION_TOKEN_TTL
+
+    def _key(self, date_id, *parts):
+        return ':'.join(['admission', str(date_id), *map(str, parts)])
+
+    def _counter(self, date_id, name):
+        return self.store.get(self._key(date_id, name)) or 0
+
+    def join(self, date_id, user_id):
+        """Get in line, or keep the place already held; returns the token's status"""
+        token = uuid.uuid4().hex
+        user_key = self._key(date_id, 'user', user_id)
+        if not self.store.add(user_key, token, self.slot_ttl + self.token_ttl):
+            current = self.store.get(user_key)
+            result = current and self.status(date_id, current, user_id)
+            if result:
+                return result
+            # The previous place lapsed
+            self.store.set(user_key, token, self.slot_ttl + self.token_ttl)
+
+        seq = self.store.incr(self._key(date_id, 'tail'))
+        entry = {'seq': seq, 'user_id': str(user_id), 'joined_at': time.time()}
+        self._touch(date_id, token, entry)
+        return self.status(date_id, token, user_id)
+
+    def status(self, date_id, token, user_id):
+        """
+        Return ``{'queue_token', 'admitted', 'position'}`` for a token, or
+        None if it is unknown, expired or belongs to someone else
+
+        Polling also keeps the token's place in line.
+        """
+        entry = self._entry(date_id, token, user_id)
+        if entry is None:
+            return None
+
+        slot = self._slot_of(date_id, token)
+        if slot is not None and not self._holds_slot(date_id, token, slot):
+            # Admitted, but the slot lease ran out before a purchase was made
+            self.leave(date_id, token)
+            return None
+
+        if slot is None:
+            self._touch(date_id, token, entry)
+            self._promote(date_id)
+            slot = self._slot_of(date_id, token)
+
+        admitted = self._holds_slot(date_id, token, slot)
+        position = 0 if admitted else max(entry['seq'] - self._counter(date_id, 'served'), 1)
+        return {'queue_token': token, 'admitted': admitted, 'position': position}
+
+    def is_admitted(self, date_id, token, user_id):
+        return (
+            self._entry(date_id, token, user_id) is not None
+            and self._holds_slot(date_id, token, self._slot_of(date_id, token))
+        )
+
+    def leave(self, date_id, token):
+        """Give up a place in line or a purchase slot"""
+        entry = self.store.get(self._key(date_id, 'token', token))
+        if entry is None:
+            return
+        slot = self._slot_of(date_id, token)
+        if self._holds_slot(date_id, token, slot):
+            self.store.delete(self._key(date_id, 'slot', slot))
+        self.store.delete(self._key(date_id, 'admitted', token))
+        self.store.delete(self._key(date_id, 'token', token))
+        self.store.delete(self._key(date_id, 'seq', entry['seq']))
+        if self.store.get(self._key(date_id, 'user', entry['user_id'])) == token:
+            self.store.delete(self._key(date_id, 'user', entry['user_id']))
+
+    def metrics(self, date_id):
+        """Queue depth, slot usage and wait times for one date"""
+        served = self._counter(date_id, 'served')
+        admitted = self._counter(date_id, 'admitted_total')
+        wait_ms = self._counter(date_id, 'wait_ms')
+        active = sum(
+            1 for slot in range(self.slots)
+            if self.store.get(self._key(date_id, 'slot', slot)) is not None
+        )
+        return {
+            'depth': max(self._counter(date_id, 'tail') - served, 0),
+            'active_slots': active,
+            'slots': self.slots,
+            'admitted_total': admitted,
+            'average_wait_seconds': round(wait_ms / admitted / 1000, 3) if admitted else 0,
+            'max_wait_seconds': round(self._counter(date_id, 'max_wait_ms') / 1000, 3),
+        }
+
+    def _entry(self, date_id, token, user_id):
+        entry = self.store.get(self._key(date_id, 'token', token))
+        if entry is None or entry['user_id'] != str(user_id):
+            return None
+        return entry
+
+    def _touch(self, date_id, token, entry):
+        # Only the seq key expires quickly; that is what marks a token abandoned
+        self.store.set(self._key(date_id, 'token', token), entry, self.slot_ttl + self.token_ttl)
+        self.store.set(self._key(date_id, 'user', entry['user_id']), token, self.slot_ttl + self.token_ttl)
+        self.store.set(self._key(date_id, 'seq', entry['seq']), token, self.token_ttl)
+
+    def _slot_of(self, date_id, token):
+        return self.store.get(self._key(date_id, 'admitted', token))
+
+    def _holds_slot(self, date_id, token, slot):
+        return slot is not None and self.store.get(self._key(date_id, 'slot', slot)) == token
+
+    def _acquire_slot(self, date_id, token):
+        for slot in range(self.slots):
+            if self.store.add(self._key(date_id, 'slot', slot), token, self.slot_ttl):
+                return slot
+        return None
+
+    def _promote(self, date_id):
+        """Move the head of the line into free slots, skipping abandoned tokens"""
+        while True:
+            served = self._counter(date_id, 'served')
+            next_seq = served + 1
+            if next_seq > self._counter(date_id, 'tail'):
+                return
+
+            # Only one caller may promote a given place in line
+            if not self.store.add(self._key(date_id, 'promoting', next_seq), 1, PROMOTING_TTL):
+                return
+
+            token = self.store.get(self._key(date_id, 'seq', next_seq))
+            entry = token and self.store.get(self._key(date_id, 'token', token))
+            if entry:
+                slot = self._acquire_slot(date_id, token)
+                if slot is None:
+                    self.store.delete(self._key(date_id, 'promoting', next_seq))
+                    return
+                self.store.set(self._key(date_id, 'admitted', token), slot, self.slot_ttl)
+                self._record_wait(date_id, time.time() - entry['joined_at'])
+
+            # The promoting marker is left to expire, so a caller that read
+            # the old served count can't promote this place a second time
+            self.store.incr(self._key(date_id, 'served'))
+
+    def _record_wait(self, date_id, waited):
+        waited_ms = int(waited * 1000)
+        self.store.incr(self._key(date_id, 'admitted_total'))
+        self.store.incr(self._key(date_id, 'wait_ms'), waited_ms)
+        if waited_ms > self._counter(date_id, 'max_wait_ms'):
+            self.store.set(self._key(date_id, 'max_wait_ms'), waited_ms)
+        logger.info(f"Admitted buyer to event date {date_id} after {waited:.1f}s")
+
+
+_queue = None
+
+
+def get_admission_queue():
+    """Return the admission queue configured by ADMISSION_QUEUE_STORE"""
+    global _queue
+    if _queue is None:
+        if settings.ADMISSION_QUEUE_STORE == 'memory':
+            store = InMemoryQueueStore()
+        else:
+            store = CacheQueueStore()
+        _queue = AdmissionQueue(store)
+    return _queue
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Cache backends whose entries every process keeps to itself
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def check_admission_queue_store(app_configs, **kwargs):
+    """The 'cache' admission queue store needs a cache all processes share"""
+    if settings.ADMISSION_QUEUE_STORE != 'cache':
+        return []
+    if settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Warning(
+        "ADMISSION_QUEUE_STORE is 'cache' but the default cache is local to each process, "
+        "so every process runs its own admission line.",
+        hint="Set CACHE_BACKEND=redis, or ADMISSION_QUEUE_STORE=memory for a single process.",
+        id='tickets.W001',
+    )]
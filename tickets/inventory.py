@@ -0,0 +1,70 @@
+"""
+Ticket inventory for event dates.
+
+Seats are taken and returned with single conditional UPDATE statements on the
+EventDate row, so there is no read-modify-write window and no lock is held
+beyond that one statement. Purchases for different dates never touch the same
+row, and overselling is impossible because the capacity check is part of the
+UPDATE's WHERE clause.
+
+``tickets_sold`` counts every seat that is spoken for: confirmed tickets as
+well as pending tickets whose hold has not expired yet (see Ticket.expire_holds).
+"""
+from django.db.models import Case, CharField, F, Value, When
+from django.db.models.lookups import GreaterThanOrEqual
+
+from events.models import EventDate
+
+
+class InsufficientInventory(Exception):
+    """Raised when an event date has fewer seats left than requested"""
+
+    def __init__(self, remaining):
+        self.remaining = max(remaining, 0)
+        super().__init__(f"Only {self.remaining} tickets are available for this date")
+
+
+def availability_expression(tickets_sold):
+    """SQL equivalent of EventDate.update_availability"""
+    return Case(
+        When(GreaterThanOrEqual(tickets_sold, F('capacity')), then=Value('Sold Out')),
+        # tickets_sold >= 80% of capacity, kept in integer arithmetic
+        When(GreaterThanOrEqual(tickets_sold * 5, F('capacity') * 4), then=Value('Limited')),
+        default=Value('Available'),
+        output_field=CharField(),
+    )
+
+
+def reserve(event_date_id, quantity):
+    """
+    Take ``quantity`` seats on an event date
+
+    Returns False, without changing anything, when not enough are left.
+    """
+    new_total = F('tickets_sold') + quantity
+    updated = EventDate.objects.filter(
+        pk=event_date_id,
+        tickets_sold__lte=F('capacity') - quantity,
+    ).update(
+        tickets_sold=new_total,
+        availability=availability_expression(new_total),
+    )
+    return updated == 1
+
+
+def release(event_date_id, quantity):
+    """Return ``quantity`` seats to an event date"""
+    new_total = F('tickets_sold') - quantity
+    EventDate.objects.filter(
+        pk=event_date_id,
+        tickets_sold__gte=quantity,
+    ).update(
+        tickets_sold=new_total,
+        availability=availability_expression(new_total),
+    )
+
+
+def remaining(event_date_id):
+    """Seats currently left on an event date"""
+    capacity, sold = EventDate.objects.values_list('capacity', 'tickets_sold').get(pk=event_date_id)
+    return capacity - sold
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from tickets.models import Ticket
+
+
+class Command(BaseCommand):
+    help = (
+        'Cancel pending tickets whose seat hold has expired and return the seats. '
+        'Run every few minutes; purchases also reclaim expired holds when a date looks full.'
+    )
+
+    def handle(self, *args, **options):
+        count = Ticket.expire_holds()
+        self.stdout.write(self.style.SUCCESS(f'Released {count} expired ticket holds'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from tickets.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the planner sales rollups from all tickets. '
+        'Run once after deploying them, or to repair them; best while payments are quiet.'
+    )
+
+    def handle(self, *args, **options):
+        count = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} sales rollup rows'))
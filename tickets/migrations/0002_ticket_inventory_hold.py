@@ -0,0 +1,30 @@
+# Generated by Django 5.0.6 on 2026-10-17 00:02
+
+from django.db import migrations, models
+
+
+def mark_counted_tickets(apps, schema_editor):
+    # Confirmed and used tickets were already added to tickets_sold
+    Ticket = apps.get_model('tickets', 'Ticket')
+    Ticket.objects.filter(status__in=['CONFIRMED', 'USED']).update(inventory_held=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='hold_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='inventory_held',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_counted_tickets, migrations.RunPython.noop),
+    ]
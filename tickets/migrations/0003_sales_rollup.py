@@ -0,0 +1,52 @@
+# Generated by Django 5.0.6 on 2026-10-17 00:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def mark_recorded_sales(apps, schema_editor):
+    # Existing sales are added to the rollups by `manage.py rebuild_sales_rollups`
+    Ticket = apps.get_model('tickets', 'Ticket')
+    Ticket.objects.filter(status__in=['CONFIRMED', 'USED']).update(sale_recorded=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0002_notification'),
+        ('events', '0006_eventdate_queue_enabled'),
+        ('tickets', '0002_ticket_inventory_hold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='sale_recorded',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('tickets', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('service_fees', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('refunded_orders', models.PositiveIntegerField(default=0)),
+                ('refunded_tickets', models.PositiveIntegerField(default=0)),
+                ('refunds', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='events.event')),
+                ('event_date', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='events.eventdate')),
+                ('planner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='authentication.eventplanner')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['planner', 'day'], name='tickets_rollup_planner_idx'), models.Index(fields=['event', 'day'], name='tickets_rollup_event_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='salesrollup',
+            constraint=models.UniqueConstraint(fields=('event_date', 'day'), name='tickets_rollup_date_day_unique'),
+        ),
+        migrations.RunPython(mark_recorded_sales, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.0.6 on 2026-10-17 00:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0007_keyset_indexes'),
+        ('tickets', '0003_sales_rollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='tickets_user_keyset_idx'),
+        ),
+    ]
@@ -1,10 +1,12 @@
 from django.db import models
 
-from django.db import models
-from authentication.models import User
+from django.db import models, transaction
+from authentication.models import EventPlanner, User
 from events.models import Event, EventDate
+from datetime import timedelta
 import uuid
 from django.utils import timezone
+from . import inventory, rollups
 
 class Ticket(models.Model):
     STATUS_CHOICES = (
@@ -33,8 +35,22 @@ class Ticket(models.Model):
     service_fee = models.DecimalField(max_digits=10, decimal_places=2)
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHOD_CHOICES)
     payment_completed = models.BooleanField(default=False)
+    # Whether this ticket's quantity is counted in event_date.tickets_sold
+    inventory_held = models.BooleanField(default=False, editable=False)
+    # Pending tickets give their seats back once this passes
+    hold_expires_at = models.DateTimeField(null=True, blank=True, db_index=True, editable=False)
+    # Whether this ticket's sale is counted in SalesRollup (see tickets/rollups.py)
+    sale_recorded = models.BooleanField(default=False, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a user's tickets, newest first
+            models.Index(fields=['user', 'created_at', 'id'], name='tickets_user_keyset_idx'),
+            # Planner stats, analytics and exports filter an event's tickets by status
+            models.Index(fields=['event', 'status'], name='tickets_event_status_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         # Generate order number if not already set
@@ -68,42 +84,119 @@ class Ticket(models.Model):
     def update_status(self, new_status, update_event_count=True):
         """
         Update ticket status and related event counters in a consistent way
+
+        Raises inventory.InsufficientInventory when confirming a ticket whose
+        seats were released in the meantime and are no longer available.
         """
-        old_status = self.status
-        self.status = new_status
-        
-        # Update payment completion flag
-        if new_status == 'CONFIRMED':
-            self.payment_completed = True
-        elif new_status == 'CANCELLED':
-            self.payment_completed = False
-    
-        self.save()
-        
-        # Update event date tickets sold count
-        if update_event_count:
-            event_date = self.event_date
-            
-            # Only update counts if status changed from/to CONFIRMED
-            if old_status != 'CONFIRMED' and new_status == 'CONFIRMED':
-                # Adding tickets
-                event_date.tickets_sold += self.quantity
-                event_date.save()
-            elif old_status == 'CONFIRMED' and new_status != 'CONFIRMED':
-                # Removing tickets
-                event_date.tickets_sold -= self.quantity
-                event_date.save()
-    
-        # If there's a payment record, update it too
-        if hasattr(self, 'payment'):
+        with transaction.atomic():
+            if update_event_count:
+                if new_status in ('CONFIRMED', 'USED'):
+                    self.hold_inventory()
+                elif new_status == 'CANCELLED':
+                    self.release_inventory()
+
+            self.status = new_status
+            if new_status != 'PENDING':
+                self.hold_expires_at = None
+
+            # Update payment completion flag
             if new_status == 'CONFIRMED':
-                self.payment.status = 'COMPLETED'
+                self.payment_completed = True
+            elif new_status == 'CANCELLED':
+                self.payment_completed = False
+
+            self.save()
+
+            # Keep the planner analytics rollups in step, in the same transaction
+            if new_status in ('CONFIRMED', 'USED'):
+                rollups.record_sale(self)
             elif new_status == 'CANCELLED':
-                self.payment.status = 'REFUNDED'
-            self.payment.save()
+                rollups.record_refund(self)
+
+            # If there's a payment record, update it too
+            if hasattr(self, 'payment'):
+                if new_status == 'CONFIRMED':
+                    self.payment.status = 'COMPLETED'
+                elif new_status == 'CANCELLED':
+                    # Only money that was taken is refunded; unpaid checkouts just fail
+                    paid = self.payment.status in ('COMPLETED', 'REFUNDED')
+                    self.payment.status = 'REFUNDED' if paid else 'FAILED'
+                self.payment.save()
+
+    def hold_inventory(self, hold_minutes=None):
+        """
+        Count this ticket's seats against its event date
 
+        With ``hold_minutes`` the seats are only held that long while the
+        ticket is pending. Raises inventory.InsufficientInventory if the date
+        does not have enough seats left.
+        """
+        if self.pk and not self._state.adding:
+            # Claim the flag first so concurrent callers can't reserve twice
+            claimed = Ticket.objects.filter(pk=self.pk, inventory_held=False).update(inventory_held=True)
+            if not claimed:
+                self.inventory_held = True
+                return
+        elif self.inventory_held:
+            return
+
+        if not self._reserve():
+            if self.pk and not self._state.adding:
+                Ticket.objects.filter(pk=self.pk).update(inventory_held=False)
+            raise inventory.InsufficientInventory(inventory.remaining(self.event_date_id))
+
+        self.inventory_held = True
+        if hold_minutes is not None:
+            self.hold_expires_at = timezone.now() + timedelta(minutes=hold_minutes)
+
+    def _reserve(self):
+        if inventory.reserve(self.event_date_id, self.quantity):
+            return True
+        # Seats may only be tied up by abandoned checkouts; free those and retry
+        if Ticket.expire_holds(event_date_id=self.event_date_id):
+            return inventory.reserve(self.event_date_id, self.quantity)
+        return False
+
+    def release_inventory(self):
+        """Give this ticket's seats back to its event date, at most once"""
+        released = Ticket.objects.filter(pk=self.pk, inventory_held=True).update(inventory_held=False)
+        if released:
+            inventory.release(self.event_date_id, self.quantity)
+        self.inventory_held = False
+
+    def cancel_hold(self):
+        """
+        Cancel a pending ticket and release its seats, leaving the payment as is
+
+        Returns False if the ticket is no longer pending (e.g. it was paid).
+        """
+        with transaction.atomic():
+            cancelled = Ticket.objects.filter(pk=self.pk, status='PENDING').update(
+                status='CANCELLED', hold_expires_at=None, updated_at=timezone.now()
+            )
+            if not cancelled:
+                return False
+            self.release_inventory()
+        self.status = 'CANCELLED'
+        self.hold_expires_at = None
+        return True
 
+    @classmethod
+    def expire_holds(cls, now=None, event_date_id=None):
+        """Cancel pending tickets whose hold has run out; returns how many"""
+        expired = cls.objects.filter(
+            status='PENDING',
+            inventory_held=True,
+            hold_expires_at__lt=now or timezone.now(),
+        )
+        if event_date_id is not None:
+            expired = expired.filter(event_date_id=event_date_id)
 
+        count = 0
+        for ticket in expired.only('id', 'event_date_id', 'quantity', 'status'):
+            if ticket.cancel_hold():
+                count += 1
+        return count
 
 
 class Payment(models.Model):
@@ -124,6 +217,47 @@ class Payment(models.Model):
     payment_details = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Webhooks and callbacks find their payment by the provider's reference
+            models.Index(fields=['transaction_id'], name='tickets_payment_txn_idx'),
+            # The reconciler scans pending payments by how long they have been quiet
+            models.Index(fields=['status', 'updated_at'], name='tickets_payment_status_idx'),
+        ]
     
     def __str__(self):
         return f"{self.ticket.order_number} - {self.amount} {self.currency} - {self.status}"
+
+
+class SalesRollup(models.Model):
+    """
+    Ticket sales per event date and day, maintained incrementally
+
+    Sales are counted on the day a ticket is confirmed and refunds on the day
+    a paid ticket is cancelled. Planner analytics read only these rows; they
+    can be recomputed with ``manage.py rebuild_sales_rollups``.
+    """
+    planner = models.ForeignKey(EventPlanner, on_delete=models.CASCADE, related_name='sales_rollups')
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='sales_rollups')
+    event_date = models.ForeignKey(EventDate, on_delete=models.CASCADE, related_name='sales_rollups')
+    day = models.DateField()
+    orders = models.PositiveIntegerField(default=0)
+    tickets = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    service_fees = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    refunded_orders = models.PositiveIntegerField(default=0)
+    refunded_tickets = models.PositiveIntegerField(default=0)
+    refunds = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event_date', 'day'], name='tickets_rollup_date_day_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['planner', 'day'], name='tickets_rollup_planner_idx'),
+            models.Index(fields=['event', 'day'], name='tickets_rollup_event_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_date} on {self.day}: {self.tickets} tickets"
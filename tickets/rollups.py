@@ -0,0 +1,108 @@
+"""
+Sales rollups for planner analytics.
+
+SalesRollup keeps one row per event date and day with the tickets, revenue,
+service fees and refunds of that day. Ticket.update_status adds to it in the
+same transaction as the status change, so the analytics endpoints can read
+the rollups alone and their cost does not grow with the number of tickets.
+
+Like the seat counts in inventory.py, a sale is counted at most once: the
+ticket's ``sale_recorded`` flag is claimed with a conditional UPDATE before
+the rollup is touched, so a payment confirmed twice (say by a webhook and by
+the reconciler) is only counted once, and a refund only undoes a counted sale.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+ROLLUP_FIELDS = (
+    'orders', 'tickets', 'revenue', 'service_fees', 'refunded_orders', 'refunded_tickets', 'refunds',
+)
+
+
+def record_sale(ticket, day=None):
+    """Count a confirmed ticket's sale; call inside the status change transaction"""
+    from .models import Ticket
+    if not Ticket.objects.filter(pk=ticket.pk, sale_recorded=False).update(sale_recorded=True):
+        return
+    ticket.sale_recorded = True
+    _add(ticket, day, orders=1, tickets=ticket.quantity, revenue=ticket.total_price, service_fees=ticket.service_fee)
+
+
+def record_refund(ticket, day=None):
+    """Count the refund of a ticket whose sale was counted"""
+    from .models import Ticket
+    if not Ticket.objects.filter(pk=ticket.pk, sale_recorded=True).update(sale_recorded=False):
+        return
+    ticket.sale_recorded = False
+    _add(ticket, day, refunded_orders=1, refunded_tickets=ticket.quantity, refunds=ticket.total_price)
+
+
+def _add(ticket, day, **amounts):
+    from .models import SalesRollup
+    rollup, _ = SalesRollup.objects.get_or_create(
+        event_date_id=ticket.event_date_id,
+        day=day or timezone.localdate(),
+        defaults={'planner_id': ticket.event.planner_id, 'event_id': ticket.event_id},
+    )
+    SalesRollup.objects.filter(pk=rollup.pk).update(
+        **{field: F(field) + amount for field, amount in amounts.items()}
+    )
+
+
+def rebuild():
+    """
+    Recompute every rollup from the tickets; returns the number of rows
+
+    Past sales are counted on the day the ticket was bought and refunds on the
+    day the ticket was last updated, as the exact confirmation time isn't
+    stored. Best run while no payments are being processed.
+    """
+    from .models import SalesRollup, Ticket
+
+    sold = Q(status__in=('CONFIRMED', 'USED'))
+    refunded = Q(status='CANCELLED', payment__status='REFUNDED')
+    group = ('event__planner_id', 'event_id', 'event_date_id', 'day')
+
+    rows = defaultdict(lambda: dict.fromkeys(ROLLUP_FIELDS, 0))
+    sales = (
+        Ticket.objects.filter(sold | refunded)
+        .annotate(day=TruncDate('created_at'))
+        .values(*group)
+        .annotate(
+            orders=Count('id'),
+            tickets=Sum('quantity'),
+            revenue=Sum('total_price', default=Decimal('0')),
+            service_fees=Sum('service_fee', default=Decimal('0')),
+        )
+        .order_by()
+    )
+    refunds = (
+        Ticket.objects.filter(refunded)
+        .annotate(day=TruncDate('updated_at'))
+        .values(*group)
+        .annotate(
+            refunded_orders=Count('id'),
+            refunded_tickets=Sum('quantity'),
+            refunds=Sum('total_price', default=Decimal('0')),
+        )
+        .order_by()
+    )
+
+    with transaction.atomic():
+        for row in [*sales, *refunds]:
+            key = tuple(row[field] for field in group)
+            rows[key].update({field: row[field] for field in ROLLUP_FIELDS if field in row})
+
+        SalesRollup.objects.all().delete()
+        SalesRollup.objects.bulk_create([
+            SalesRollup(planner_id=planner_id, event_id=event_id, event_date_id=event_date_id, day=day, **amounts)
+            for (planner_id, event_id, event_date_id, day), amounts in rows.items()
+        ], batch_size=1000)
+        Ticket.objects.filter(sold).update(sale_recorded=True)
+        Ticket.objects.exclude(sold).update(sale_recorded=False)
+    return len(rows)
@@ -1,12 +1,14 @@
 from rest_framework import serializers
 from .models import Ticket, Payment
 from events.serializers import EventListSerializer
+from django.conf import settings
 from django.db import transaction
 from events.models import EventDate, Event
 import decimal
-from payments.payment_factory import PaymentFactory
-from payments.exceptions import PaymentProcessingError
+from payments.worker import enqueue_payment
+from core.images import preferred_url
 from core.models import SiteSetting
+from .inventory import InsufficientInventory
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payment
@@ -36,27 +38,54 @@ class TicketSerializer(serializers.ModelSerializer):
         return {
             'eventId': str(obj.event.id),
             'eventTitle': obj.event.title,
-            'eventImage': obj.event.image.url if obj.event.image else None,
+            'eventImage': preferred_url(obj.event.image, obj.event.image_variants, 'thumb'),
             'location': obj.event.location,
             'date': obj.event_date.date.strftime("%b %d, %Y"),
             'time': obj.event_date.time.strftime("%I:%M %p")
         }
 
+class TicketListSerializer(TicketSerializer):
+    """
+    Ticket list rows
+
+    Same fields as TicketSerializer; setup_queryset joins in the event, date
+    and payment columns these rows read, so a list costs one query.
+    """
+    # Columns of the joined rows that are actually rendered
+    RELATED_COLUMNS = (
+        'event__id', 'event__title', 'event__image', 'event__image_variants', 'event__location', 'event__planner_id',
+        'event_date__id', 'event_date__date', 'event_date__time',
+        'payment__id', 'payment__payment_method', 'payment__amount', 'payment__currency',
+        'payment__status', 'payment__transaction_id',
+    )
+
+    class Meta(TicketSerializer.Meta):
+        pass
+
+    @classmethod
+    def setup_queryset(cls, queryset):
+        ticket_columns = [field.name for field in Ticket._meta.concrete_fields]
+        return queryset.select_related('event', 'event_date', 'payment').only(
+            *ticket_columns, *cls.RELATED_COLUMNS
+        )
+
 class TicketPurchaseSerializer(serializers.Serializer):
     event_id = serializers.UUIDField()
-    date_id = serializers.UUIDField()
+    date_id = serializers.IntegerField()
     quantity = serializers.IntegerField(min_value=1, max_value=10)
     payment_method = serializers.ChoiceField(choices=['CARD', 'MPESA'])
 
-    # Card payment fields (only required if payment method is CARD)
-    card_number = serializers.CharField(max_length=19, required=False)
-    card_expiry = serializers.CharField(max_length=5, required=False)
-    card_cvv = serializers.CharField(max_length=4, required=False)
-    card_name = serializers.CharField(max_length=100, required=False)
+    # Card payment field (only required if payment method is CARD): the
+    # Stripe PaymentMethod id created by the frontend; card details never
+    # reach this API
+    payment_method_id = serializers.CharField(max_length=255, required=False)
 
     # M-Pesa field (only required if payment method is MPESA)
     phone_number = serializers.CharField(max_length=15, required=False)
 
+    # Admission queue token, required for queue-enabled dates
+    queue_token = serializers.CharField(max_length=64, required=False)
+
     
 
     def validate(self, data):
@@ -66,36 +95,20 @@ class TicketPurchaseSerializer(serializers.Serializer):
         except Event.DoesNotExist:
             raise serializers.ValidationError({"event_id": "Event does not exist"})
 
-        # Validate event date exists and belongs to the event 
+        # Validate event date exists and belongs to the event
         try:
-            # Use select_for_update to lock the row during validation
-            from django.db import transaction
-            with transaction.atomic():
-                event_date = EventDate.objects.select_for_update().get(
-                    id=data['date_id'], 
-                    event=event
-                )
-            
-                # Check if tickets are available
-                if event_date.availability == 'Sold Out':
-                    raise serializers.ValidationError({"date_id": "This event date is sold out"})
-
-                # Check if requested quantity is available
-                if event_date.tickets_sold + data['quantity'] > event_date.capacity:
-                    remaining = event_date.capacity - event_date.tickets_sold
-                    raise serializers.ValidationError({
-                        "quantity": f"Only {remaining} tickets are available for this date"
-                    })
+            event_date = EventDate.objects.get(id=data['date_id'], event=event)
         except EventDate.DoesNotExist:
             raise serializers.ValidationError({"date_id": "Event date does not exist or doesn't belong to this event"})
 
+        # Seats are checked and taken atomically in create(), where holds of
+        # abandoned checkouts can be reclaimed first
+
         # The rest of the validation remains the same...
         # Validate payment method specific fields
         if data['payment_method'] == 'CARD':
-            required_fields = ['card_number', 'card_expiry', 'card_cvv', 'card_name']
-            for field in required_fields:
-                if field not in data or not data[field]:
-                    raise serializers.ValidationError({field: f"{field} is required for card payments"})
+            if 'payment_method_id' not in data or not data['payment_method_id']:
+                raise serializers.ValidationError({"payment_method_id": "payment_method_id is required for card payments"})
 
         elif data['payment_method'] == 'MPESA':
             if 'phone_number' not in data or not data['phone_number']:
@@ -108,7 +121,7 @@ class TicketPurchaseSerializer(serializers.Serializer):
 
 
         # Get the site settings
-        site_settings = SiteSetting.get_settings()
+        site_settings = SiteSetting.current()
         
         # Calculate prices
         ticket_price = event_date.price if event_date.price else event.price
@@ -132,45 +145,37 @@ class TicketPurchaseSerializer(serializers.Serializer):
 
 
 
-    @transaction.atomic
     def create(self, validated_data):
         user = self.context['request'].user
         event = validated_data['event']
         event_date = validated_data['event_date']
 
-        # Create ticket record
-        ticket = Ticket.objects.create(
-            user=user,
-            event=event,
-            event_date=event_date,
-            quantity=validated_data['quantity'],
-            ticket_type='Regular',
-            total_price=validated_data['total_price'],
-            service_fee=validated_data['service_fee'],
-            payment_method=validated_data['payment_method'],
-        )
-
-        # Create payment record
-        payment = Payment.objects.create(
-            ticket=ticket,
-            payment_method=validated_data['payment_method'],
-            amount=validated_data['total_price'],
-            currency=event.currency,
-        )
-
-        # Process payment using the payment factory
-        try:
-            PaymentFactory.process_payment(payment, validated_data)
-        except PaymentProcessingError as e:
-            # If payment processing fails, mark ticket as pending
-            # The ticket will be automatically updated if/when payment completes
-            ticket.status = 'PENDING'
+        # Hold the seats, record the order and queue the provider call in one
+        # short transaction; the payment worker talks to Stripe/M-Pesa
+        with transaction.atomic():
+            ticket = Ticket(
+                user=user,
+                event=event,
+                event_date=event_date,
+                quantity=validated_data['quantity'],
+                ticket_type='Regular',
+                total_price=validated_data['total_price'],
+                service_fee=validated_data['service_fee'],
+                payment_method=validated_data['payment_method'],
+            )
+            try:
+                ticket.hold_inventory(hold_minutes=settings.TICKET_HOLD_MINUTES)
+            except InsufficientInventory as e:
+                raise serializers.ValidationError({"quantity": str(e)})
             ticket.save()
-            raise serializers.ValidationError({"payment": str(e)})
 
-        # Update ticket status if payment was successful immediately
-        if payment.status == 'COMPLETED':
-            ticket.update_status('CONFIRMED')
+            # Create payment record
+            payment = Payment.objects.create(
+                ticket=ticket,
+                payment_method=validated_data['payment_method'],
+                amount=validated_data['total_price'],
+                currency=event.currency,
+            )
+            enqueue_payment(payment, validated_data)
 
         return ticket
-
@@ -1,3 +1,408 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+from rest_framework.test import APIClient
+from datetime import date, time, timedelta
+import csv
+import io
+import json
+import time as time_module
 
-# Create your tests here.
+from authentication.models import User, EventPlanner
+from core.explain import captured_full_scans
+from events.models import Event, EventDate
+from . import admission, inventory
+from .admission import AdmissionQueue, InMemoryQueueStore
+from .checks import check_admission_queue_store
+from .models import Payment, SalesRollup, Ticket
+from .rollups import rebuild
+
+
+class TicketTestCase(TestCase):
+    """A fan, an approved planner's 'Concert' a week from now and an anonymous client"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='fan@example.com', username='fan', password='pass1234')
+        planner_user = User.objects.create_user(email='planner@example.com', username='planner', password='pass1234')
+        self.planner = EventPlanner.objects.create(
+            user=planner_user, phone='0700000000', national_id='123', status='approved'
+        )
+        self.event = Event.objects.create(
+            planner=self.planner, title='Concert', description='Description',
+            location='Nairobi', address='Street', price=10,
+        )
+        self.event_date = self.add_date(7)
+        self.client = APIClient()
+
+    def add_date(self, days, **fields):
+        return EventDate.objects.create(
+            event=self.event, date=date.today() + timedelta(days=days), time=time(18, 0), **fields
+        )
+
+    def create_ticket(self, quantity=1, event_date=None, **fields):
+        return Ticket.objects.create(
+            user=self.user, event=self.event, event_date=event_date or self.event_date, quantity=quantity,
+            total_price=10 * quantity, service_fee=quantity, payment_method='MPESA', **fields,
+        )
+
+
+class TicketInventoryTests(TicketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.event_date.capacity = 10
+        self.event_date.save()
+
+    def hold(self, quantity, hold_minutes=15):
+        ticket = Ticket(
+            user=self.user, event=self.event, event_date=self.event_date, quantity=quantity,
+            total_price=10 * quantity, service_fee=0, payment_method='MPESA',
+        )
+        ticket.hold_inventory(hold_minutes=hold_minutes)
+        ticket.save()
+        return ticket
+
+    def assertSold(self, tickets_sold, availability):
+        self.event_date.refresh_from_db()
+        self.assertEqual(self.event_date.tickets_sold, tickets_sold)
+        self.assertEqual(self.event_date.availability, availability)
+
+    def test_reserve_never_exceeds_capacity(self):
+        self.assertTrue(inventory.reserve(self.event_date.pk, 7))
+        self.assertSold(7, 'Available')
+
+        self.assertFalse(inventory.reserve(self.event_date.pk, 4))
+        self.assertSold(7, 'Available')
+
+        self.assertTrue(inventory.reserve(self.event_date.pk, 1))
+        self.assertSold(8, 'Limited')
+
+        self.assertTrue(inventory.reserve(self.event_date.pk, 2))
+        self.assertSold(10, 'Sold Out')
+
+        inventory.release(self.event_date.pk, 3)
+        self.assertSold(7, 'Available')
+
+    def test_confirm_and_cancel_count_seats_once(self):
+        ticket = self.hold(3)
+        self.assertSold(3, 'Available')
+
+        ticket.update_status('CONFIRMED')
+        ticket.update_status('CONFIRMED')
+        self.assertSold(3, 'Available')
+        self.assertIsNone(ticket.hold_expires_at)
+
+        ticket.update_status('CANCELLED')
+        ticket.update_status('CANCELLED')
+        self.assertSold(0, 'Available')
+
+    def test_hold_fails_when_sold_out(self):
+        self.hold(8)
+        with self.assertRaises(inventory.InsufficientInventory) as context:
+            self.hold(3)
+        self.assertEqual(context.exception.remaining, 2)
+        self.assertSold(8, 'Limited')
+
+    def test_expired_holds_are_released(self):
+        expired = self.hold(4, hold_minutes=-1)
+        paid = self.hold(4, hold_minutes=-1)
+        paid.update_status('CONFIRMED')
+
+        self.assertEqual(Ticket.expire_holds(), 1)
+        expired.refresh_from_db()
+        self.assertEqual(expired.status, 'CANCELLED')
+        self.assertSold(4, 'Available')
+
+    def test_full_date_reclaims_expired_holds(self):
+        self.hold(8, hold_minutes=-1)
+        ticket = self.hold(5)
+
+        self.assertEqual(ticket.status, 'PENDING')
+        self.assertGreater(ticket.hold_expires_at, timezone.now())
+        self.assertSold(5, 'Available')
+
+
+class AdmissionQueueTests(TestCase):
+    def setUp(self):
+        self.queue = AdmissionQueue(InMemoryQueueStore(), slots=2, slot_ttl=60, token_ttl=60)
+
+    def test_slots_are_released_in_order(self):
+        first, second, third, fourth = [self.queue.join(1, user) for user in range(4)]
+        self.assertTrue(first['admitted'])
+        self.assertTrue(second['admitted'])
+        self.assertEqual((third['admitted'], third['position']), (False, 1))
+        self.assertEqual((fourth['admitted'], fourth['position']), (False, 2))
+
+        # Another date has its own line
+        self.assertTrue(self.queue.join(2, 9)['admitted'])
+
+        self.queue.leave(1, first['queue_token'])
+        self.assertFalse(self.queue.status(1, fourth['queue_token'], 3)['admitted'])
+        self.assertTrue(self.queue.status(1, third['queue_token'], 2)['admitted'])
+        self.assertTrue(self.queue.is_admitted(1, third['queue_token'], 2))
+
+        metrics = self.queue.metrics(1)
+        self.assertEqual(metrics['depth'], 1)
+        self.assertEqual(metrics['active_slots'], 2)
+        self.assertEqual(metrics['admitted_total'], 3)
+
+    def test_joining_again_keeps_one_place(self):
+        holders = [self.queue.join(1, user) for user in range(2)]
+        first = self.queue.join(1, 'alice')
+        self.assertEqual(self.queue.join(1, 'alice'), first)
+        self.assertEqual(self.queue.join(1, 'bob')['position'], 2)
+        self.assertEqual(self.queue.metrics(1)['depth'], 2)
+
+        # Once admitted the same slot is returned, and after leaving a new place is taken
+        self.queue.leave(1, holders[0]['queue_token'])
+        admitted = self.queue.join(1, 'alice')
+        self.assertEqual((admitted['queue_token'], admitted['admitted']), (first['queue_token'], True))
+        self.queue.leave(1, first['queue_token'])
+        self.assertNotEqual(self.queue.join(1, 'alice')['queue_token'], first['queue_token'])
+
+    @override_settings(ADMISSION_QUEUE_STORE='cache')
+    def test_cache_store_on_a_process_local_cache_warns(self):
+        self.assertEqual([warning.id for warning in check_admission_queue_store(None)], ['tickets.W001'])
+        with override_settings(ADMISSION_QUEUE_STORE='memory'):
+            self.assertEqual(check_admission_queue_store(None), [])
+
+    def test_promoting_claims_lapse_quickly(self):
+        self.queue.join(1, 'first')
+
+        # Left behind by the promotion; a caller dying mid-way would leave one too
+        _, expires_at = self.queue.store._data['admission:1:promoting:1']
+        self.assertLessEqual(expires_at - time_module.monotonic(), admission.PROMOTING_TTL)
+        self.assertLess(admission.PROMOTING_TTL, self.queue.slot_ttl)
+
+    def test_tokens_are_bound_to_their_user(self):
+        result = self.queue.join(1, 'alice')
+        self.assertIsNone(self.queue.status(1, result['queue_token'], 'mallory'))
+        self.assertFalse(self.queue.is_admitted(1, result['queue_token'], 'mallory'))
+
+    def test_abandoned_tokens_are_skipped(self):
+        holders = [self.queue.join(1, user) for user in range(2)]
+        abandoned = self.queue.join(1, 'gone')
+        waiting = self.queue.join(1, 'here')
+
+        # The abandoned buyer stopped polling, so their place lapsed
+        entry = self.queue.store.get(f"admission:1:token:{abandoned['queue_token']}")
+        self.queue.store.delete(f"admission:1:seq:{entry['seq']}")
+        self.queue.leave(1, holders[0]['queue_token'])
+
+        self.assertTrue(self.queue.status(1, waiting['queue_token'], 'here')['admitted'])
+
+
+class AdmissionQueuePurchaseTests(TicketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.event_date.queue_enabled = True
+        self.event_date.save()
+        self.client.force_authenticate(self.user)
+        cache.clear()
+
+    def test_purchase_requires_admission(self):
+        response = self.client.post('/api/tickets/purchase/', {
+            'event_id': str(self.event.id), 'date_id': self.event_date.pk, 'quantity': 1,
+            'payment_method': 'MPESA', 'phone_number': '254700000000',
+        }, format='json')
+        self.assertEqual(response.status_code, 429)
+
+        response = self.client.post('/api/tickets/queue/', {'date_id': self.event_date.pk}, format='json')
+        self.assertEqual(response.status_code, 201)
+        token = response.json()['queue_token']
+
+        response = self.client.get('/api/tickets/queue_status/', {'date_id': self.event_date.pk, 'queue_token': token})
+        self.assertTrue(response.json()['admitted'])
+
+
+class TicketStatsTests(TicketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dates = [self.event_date, self.add_date(14)]
+        for index, ticket_status in enumerate(['CONFIRMED', 'CONFIRMED', 'PENDING', 'CANCELLED', 'USED']):
+            self.create_ticket(
+                event_date=self.dates[index % 2], status=ticket_status,
+                payment_completed=ticket_status in ('CONFIRMED', 'USED'),
+            )
+        self.client.force_authenticate(self.planner.user)
+
+    def test_stats_are_aggregated_in_bounded_queries(self):
+        # Totals and status counts, top events, per-date breakdown
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/tickets/stats/', {'breakdown': 'dates'})
+        data = response.json()
+
+        self.assertEqual(data['total_tickets'], 5)
+        self.assertEqual(data['total_sales'], 30)
+        self.assertEqual(data['total_service_fees'], 3)
+        self.assertEqual(data['status_counts'], {'confirmed': 2, 'pending': 1, 'cancelled': 1, 'used': 1})
+        self.assertEqual(
+            [(row['event_date_id'], row['ticket_count'], row['tickets_sold']) for row in data['event_dates']],
+            [(self.dates[0].pk, 3, 2), (self.dates[1].pk, 2, 1)],
+        )
+
+    def test_stats_date_range(self):
+        tomorrow = date.today() + timedelta(days=1)
+        response = self.client.get('/api/tickets/stats/', {'start_date': tomorrow.isoformat()})
+        self.assertEqual(response.json()['total_tickets'], 0)
+        self.assertEqual(response.json()['total_sales'], 0)
+
+        response = self.client.get('/api/tickets/stats/', {'end_date': 'soon'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SalesRollupTests(TicketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.planner.user)
+
+    def ticket(self, quantity):
+        ticket = self.create_ticket(quantity)
+        Payment.objects.create(ticket=ticket, payment_method='MPESA', amount=ticket.total_price)
+        return ticket
+
+    def rollup_totals(self):
+        return SalesRollup.objects.values('orders', 'tickets', 'revenue', 'refunded_tickets', 'refunds').get()
+
+    def test_status_changes_update_rollups_once(self):
+        first, second = self.ticket(2), self.ticket(3)
+        first.update_status('CONFIRMED')
+        # A second confirmation (e.g. webhook after the reconciler) is not counted again
+        Ticket.objects.get(pk=first.pk).update_status('CONFIRMED')
+        second.update_status('CONFIRMED')
+        second.update_status('CANCELLED')
+        # Pending tickets that are cancelled were never sales
+        self.ticket(1).update_status('CANCELLED')
+
+        expected = {'orders': 2, 'tickets': 5, 'revenue': 50, 'refunded_tickets': 3, 'refunds': 30}
+        self.assertEqual(self.rollup_totals(), expected)
+
+        # Rebuilding from the tickets gives the same numbers
+        self.assertEqual(rebuild(), 1)
+        self.assertEqual(self.rollup_totals(), expected)
+
+    def test_analytics_reads_rollups(self):
+        self.ticket(2).update_status('CONFIRMED')
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/tickets/analytics/', {'group_by': 'event_date'})
+        data = response.json()
+        self.assertEqual(data['totals']['tickets'], 2)
+        self.assertEqual(data['results'][0]['event_date_id'], self.event_date.pk)
+        self.assertEqual(data['results'][0]['revenue'], 20)
+
+        response = self.client.get('/api/tickets/analytics/', {'group_by': 'week'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/tickets/analytics/', {'event_id': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TicketExportTests(TicketTestCase):
+    def setUp(self):
+        super().setUp()
+        User.objects.filter(pk=self.user.pk).update(first_name='Amina', last_name='Otieno')
+        for ticket_status in ('CONFIRMED', 'CONFIRMED', 'CANCELLED'):
+            self.create_ticket(status=ticket_status)
+        self.client.force_authenticate(self.planner.user)
+
+    def export(self, **params):
+        response = self.client.get('/api/tickets/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export_streams_attendees(self):
+        rows = list(csv.DictReader(io.StringIO(self.export(event_id=str(self.event.id), status='confirmed'))))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['attendee_email'], 'fan@example.com')
+        self.assertEqual(rows[0]['event_title'], 'Concert')
+
+    def test_csv_export_neutralises_formulas(self):
+        User.objects.filter(pk=self.user.pk).update(first_name='=HYPERLINK("http://x")', last_name='-Otieno')
+        rows = list(csv.DictReader(io.StringIO(self.export())))
+        self.assertEqual(rows[0]['attendee_name'], '\'=HYPERLINK("http://x")')
+        self.assertEqual(rows[0]['attendee_surname'], "'-Otieno")
+
+        # NDJSON isn't opened by spreadsheets and keeps the raw value
+        self.assertEqual(json.loads(self.export(output='ndjson').splitlines()[0])['attendee_surname'], '-Otieno')
+
+    def test_ndjson_export(self):
+        lines = self.export(output='ndjson').splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])['attendee_name'], 'Amina')
+
+        response = self.client.get('/api/tickets/export/', {'output': 'xlsx'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TicketListQueryTests(TicketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def add_tickets(self, count):
+        for _ in range(count):
+            ticket = self.create_ticket()
+            Payment.objects.create(ticket=ticket, payment_method='MPESA', amount=10)
+
+    def test_list_query_count_does_not_grow_with_tickets(self):
+        self.add_tickets(1)
+        # The first request also looks up (and caches) the user's planner profile
+        self.client.get('/api/tickets/')
+        with self.assertNumQueries(1):
+            self.client.get('/api/tickets/')
+
+        self.add_tickets(9)
+        # One query for the tickets with their event, date and payment
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/tickets/')
+        results = response.json()['results']
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results[0]['event_details']['eventTitle'], 'Concert')
+        self.assertEqual(results[0]['payment']['status'], 'PENDING')
+
+    def test_detail_permission_uses_joined_event(self):
+        self.add_tickets(1)
+        ticket = Ticket.objects.get()
+        self.client.get('/api/tickets/')
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/tickets/{ticket.pk}/')
+        self.assertEqual(response.status_code, 200)
+
+
+class TicketIndexPlanTests(TicketTestCase):
+    """Ticket and payment lookups on the hot paths must use an index, never a table scan"""
+    TABLES = ('tickets_ticket', 'tickets_payment', 'tickets_salesrollup', 'events_eventdate')
+
+    def setUp(self):
+        super().setUp()
+        for ticket_status in ('PENDING', 'CONFIRMED', 'CANCELLED'):
+            ticket = self.create_ticket(status=ticket_status)
+            Payment.objects.create(ticket=ticket, payment_method='MPESA', amount=10)
+
+    def assertNoFullScans(self, path, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path, params or {})
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(captured_full_scans(context.captured_queries, self.TABLES), [], f'{path} {params}')
+
+    def test_ticket_lists_use_indexes(self):
+        self.client.force_authenticate(self.user)
+        self.assertNoFullScans('/api/tickets/')
+        self.assertNoFullScans('/api/tickets/', {'filter': 'upcoming', 'status': 'CONFIRMED'})
+
+        self.client.force_authenticate(self.planner.user)
+        self.assertNoFullScans('/api/tickets/')
+
+    def test_planner_reports_use_indexes(self):
+        self.client.force_authenticate(self.planner.user)
+        self.assertNoFullScans('/api/tickets/stats/', {'breakdown': 'dates'})
+        self.assertNoFullScans('/api/tickets/analytics/', {'group_by': 'event'})
+        self.assertNoFullScans('/api/tickets/export/', {'event_id': str(self.event.id), 'status': 'CONFIRMED'})
+
+    def test_hold_expiry_uses_index(self):
+        with CaptureQueriesContext(connection) as context:
+            Ticket.expire_holds()
+        self.assertEqual(captured_full_scans(context.captured_queries, self.TABLES), [])
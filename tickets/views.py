@@ -1,35 +1,59 @@
 from django.shortcuts import render
+from django.urls import reverse
 from django.db import transaction
+from django.core.exceptions import ValidationError as DjangoValidationError
 from core.models import SiteSetting
-from rest_framework import viewsets, permissions, status, filters
+from core.pagination import KeysetPagination
+from rest_framework import viewsets, permissions, status, filters, serializers
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from django_filters.rest_framework import DjangoFilterBackend
 from datetime import datetime, timedelta, date
-from django.db.models import Q
+from django.db.models import Count, Q, Sum
+from decimal import Decimal
 import logging
 from rest_framework.decorators import action
 from payments.payment_factory import PaymentFactory
 from payments.exceptions import PaymentProcessingError
-from .models import Ticket, Payment
-from .serializers import TicketSerializer, TicketPurchaseSerializer
+from payments.status import refresh_from_provider
+from .models import Ticket, Payment, SalesRollup
+from .serializers import TicketSerializer, TicketListSerializer, TicketPurchaseSerializer
+from .admission import get_admission_queue
+from .export import EXPORT_FORMATS, streaming_export
 from events.models import EventDate
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# status_counts keys of the stats endpoint
+STATS_STATUSES = {
+    'confirmed': 'CONFIRMED',
+    'pending': 'PENDING',
+    'cancelled': 'CANCELLED',
+    'used': 'USED',
+}
+
+# Rollup columns each analytics grouping returns per row
+ANALYTICS_GROUPS = {
+    'day': ('day',),
+    'event': ('event_id', 'event__title'),
+    'event_date': ('event_date_id', 'event_date__date', 'event_date__time', 'event__title'),
+}
+
+
 class IsTicketOwnerOrEventPlanner(permissions.BasePermission):
     """
     Custom permission to allow ticket owners and event planners to access their tickets.
     """
     def has_object_permission(self, request, view, obj):
         # Check if this ticket belongs to the user
-        if obj.user == request.user:
+        if obj.user_id == request.user.pk:
             return True
             
-        # Check if user is the event planner for this ticket
+        # Check if user is the event planner for this ticket (by id, the
+        # event is joined in by get_queryset and the planner isn't needed)
         if hasattr(request.user, 'planner_profile'):
-            return obj.event.planner == request.user.planner_profile
+            return obj.event.planner_id == request.user.planner_profile.pk
             
         return False
 
@@ -37,6 +61,7 @@ class TicketViewSet(viewsets.ModelViewSet):
     queryset = Ticket.objects.all()
     serializer_class = TicketSerializer
     permission_classes = [permissions.IsAuthenticated, IsTicketOwnerOrEventPlanner]
+    pagination_class = KeysetPagination
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['status', 'event', 'payment_completed']
     ordering_fields = ['created_at', 'event_date__date']
@@ -66,8 +91,16 @@ class TicketViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(event_date__date__gte=today)
         elif filter_type == 'past':
             queryset = queryset.filter(event_date__date__lt=today)
-            
-        return queryset.order_by('-created_at')
+
+        if self.action == 'list':
+            return TicketListSerializer.setup_queryset(queryset).order_by('-created_at')
+        # Detail actions read the event, date and payment of the ticket too
+        return queryset.select_related('event', 'event_date', 'payment').order_by('-created_at')
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return TicketListSerializer
+        return super().get_serializer_class()
 
 
 
@@ -179,39 +212,19 @@ class TicketViewSet(viewsets.ModelViewSet):
 
         payment = ticket.payment
 
-        # If payment is still pending, check its current status
-        if payment.status == 'PENDING':
-            if payment.payment_method == 'MPESA' and payment.transaction_id:
-                try:
-                    # For M-Pesa, query the transaction status
-                    from payments.mpesa_service import MPesaService
-                    mpesa_service = MPesaService()
-                    result = mpesa_service.query_transaction(payment.transaction_id)
-
-                    # If the query shows payment is complete, update the status
-                    if result.get('ResultCode') == '0':
-                        with transaction.atomic():
-                            payment.status = 'COMPLETED'
-                            payment.save()
-                            # Use the model method to update ticket status
-                            ticket.update_status('CONFIRMED')
-
-                    return Response({
-                        "status": "success",
-                        "ticket_status": ticket.status,
-                        "payment_status": payment.status,
-                        "mpesa_status": result
-                    })
-
-                except Exception as e:
-                    logger.error(f"Error checking M-Pesa status: {str(e)}", exc_info=True)
-
-        # For other payment methods or non-pending status, just return current status
-        return Response({
+        # Answered from local state; M-Pesa is only queried once the payment
+        # has been pending for a while (live updates: ws/payments/<id>/)
+        result = refresh_from_provider(payment)
+        ticket.refresh_from_db(fields=['status'])
+
+        response_data = {
             "status": "success",
             "ticket_status": ticket.status,
             "payment_status": payment.status,
-        })
+        }
+        if result is not None:
+            response_data["mpesa_status"] = result
+        return Response(response_data)
 
 
     
@@ -220,6 +233,7 @@ class TicketViewSet(viewsets.ModelViewSet):
         """
         Purchase tickets for an event
         """
+        admitted_token = None
         try:
             serializer = TicketPurchaseSerializer(
                 data=request.data,
@@ -235,27 +249,114 @@ class TicketViewSet(viewsets.ModelViewSet):
                     },
                     status=status.HTTP_400_BAD_REQUEST
                 )
+
+            # Flash-sale dates only accept buyers the admission queue let in
+            event_date = serializer.validated_data['event_date']
+            if event_date.queue_enabled:
+                queue_token = serializer.validated_data.get('queue_token')
+                if not queue_token or not get_admission_queue().is_admitted(event_date.pk, queue_token, request.user.pk):
+                    return Response(
+                        {
+                            "status": "error",
+                            "detail": "This date is in high demand. Join the queue and wait to be admitted.",
+                            "errors": {"queue_token": "A valid, admitted queue token is required"}
+                        },
+                        status=status.HTTP_429_TOO_MANY_REQUESTS
+                    )
+                admitted_token = queue_token
                 
-            # Create ticket with payment
+            # Create ticket with payment; the payment worker charges it
             ticket = serializer.save()
             
-            # Return ticket details
+            # Return ticket details and where to follow the payment
             return Response(
                 {
                     "status": "success",
-                    "detail": "Ticket purchased successfully",
+                    "detail": "Ticket reserved, payment is being processed",
                     "ticket": TicketSerializer(ticket).data,
-                    "order_number": ticket.order_number
+                    "order_number": ticket.order_number,
+                    "payment_id": str(ticket.payment.id),
+                    "status_url": request.build_absolute_uri(
+                        reverse('payment-status', args=[ticket.payment.id])
+                    )
                 },
-                status=status.HTTP_201_CREATED
+                status=status.HTTP_202_ACCEPTED
+            )
+
+        except serializers.ValidationError as e:
+            # Raised by create() when seats run out
+            return Response(
+                {
+                    "status": "error",
+                    "detail": "Ticket purchase could not be completed",
+                    "errors": e.detail
+                },
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
         except Exception as e:
             logger.error(f"Unexpected error processing ticket purchase: {str(e)}", exc_info=True)
             return Response(
                 {"status": "error", "detail": "An unexpected error occurred"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+        finally:
+            # Successful or not, the purchase slot goes to the next buyer in line
+            if admitted_token:
+                get_admission_queue().leave(event_date.pk, admitted_token)
+
+    def _get_event_date(self, date_id):
+        try:
+            return EventDate.objects.select_related('event__planner').get(pk=int(date_id))
+        except (TypeError, ValueError, EventDate.DoesNotExist):
+            return None
+
+    @action(detail=False, methods=['post'])
+    def queue(self, request):
+        """
+        Join the admission queue for an event date
+        """
+        event_date = self._get_event_date(request.data.get('date_id'))
+        if event_date is None:
+            return Response(
+                {"status": "error", "detail": "Event date not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        # Dates without a queue can be bought straight away
+        if not event_date.queue_enabled:
+            return Response({"status": "success", "queue_token": None, "admitted": True, "position": 0})
+
+        result = get_admission_queue().join(event_date.pk, request.user.pk)
+        return Response({"status": "success", **result}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'])
+    def queue_status(self, request):
+        """
+        Check a queue token's position; poll this to keep the place in line
+        """
+        queue_token = request.query_params.get('queue_token', '')
+        event_date = self._get_event_date(request.query_params.get('date_id'))
+        result = event_date and get_admission_queue().status(event_date.pk, queue_token, request.user.pk)
+        if not result:
+            return Response(
+                {"status": "error", "detail": "Queue token not found or expired"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response({"status": "success", **result})
+
+    @action(detail=False, methods=['get'])
+    def queue_metrics(self, request):
+        """
+        Queue depth and wait times for one of the planner's event dates
+        """
+        event_date = self._get_event_date(request.query_params.get('date_id'))
+        planner = getattr(request.user, 'planner_profile', None)
+        if event_date is None or planner is None or event_date.event.planner_id != planner.pk:
+            return Response(
+                {"status": "error", "detail": "Event date not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response({"status": "success", **get_admission_queue().metrics(event_date.pk)})
     
            
 
@@ -298,6 +399,11 @@ class TicketViewSet(viewsets.ModelViewSet):
     def stats(self, request):
         """
         Get ticket stats for event planners
+
+        Totals and status counts come from one aggregate query. Optional query
+        params: ``start_date``/``end_date`` (YYYY-MM-DD) limit the stats to
+        tickets bought in that range, and ``breakdown=dates`` adds a row per
+        event date.
         """
         # Only event planners can access this endpoint
         if not hasattr(request.user, 'planner_profile'):
@@ -308,31 +414,152 @@ class TicketViewSet(viewsets.ModelViewSet):
             
         planner = request.user.planner_profile
         queryset = Ticket.objects.filter(event__planner=planner)
-        
-        # Basic stats
-        total_tickets = queryset.count()
-        total_sales = sum(ticket.total_price for ticket in queryset.filter(payment_completed=True))
-        total_service_fees = sum(ticket.service_fee for ticket in queryset.filter(payment_completed=True))
-        
-        # Status breakdown
-        status_counts = {
-            'confirmed': queryset.filter(status='CONFIRMED').count(),
-            'pending': queryset.filter(status='PENDING').count(),
-            'cancelled': queryset.filter(status='CANCELLED').count(),
-            'used': queryset.filter(status='USED').count()
-        }
+
+        start_date = self._get_date_param('start_date')
+        end_date = self._get_date_param('end_date')
+        if start_date:
+            queryset = queryset.filter(created_at__date__gte=start_date)
+        if end_date:
+            queryset = queryset.filter(created_at__date__lte=end_date)
+
+        paid = Q(payment_completed=True)
+        totals = queryset.aggregate(
+            total_tickets=Count('id'),
+            total_sales=Sum('total_price', filter=paid, default=Decimal('0')),
+            total_service_fees=Sum('service_fee', filter=paid, default=Decimal('0')),
+            **{
+                key: Count('id', filter=Q(status=ticket_status))
+                for key, ticket_status in STATS_STATUSES.items()
+            }
+        )
         
         # Event breakdown (top 5 events by ticket sales)
-        from django.db.models import Count, Sum
         events_data = queryset.values('event__title').annotate(
             ticket_count=Count('id'),
-            revenue=Sum('total_price', filter=Q(payment_completed=True))
+            revenue=Sum('total_price', filter=paid)
         ).order_by('-ticket_count')[:5]
-        
-        return Response({
-            "total_tickets": total_tickets,
-            "total_sales": total_sales,
-            "total_service_fees": total_service_fees,
-            "status_counts": status_counts,
+
+        response_data = {
+            "total_tickets": totals['total_tickets'],
+            "total_sales": totals['total_sales'],
+            "total_service_fees": totals['total_service_fees'],
+            "status_counts": {key: totals[key] for key in STATS_STATUSES},
             "top_events": events_data
+        }
+
+        if request.query_params.get('breakdown') == 'dates':
+            response_data["event_dates"] = queryset.values(
+                'event_date_id', 'event_date__date', 'event_date__time', 'event__title'
+            ).annotate(
+                ticket_count=Count('id'),
+                tickets_sold=Sum('quantity', filter=paid, default=0),
+                revenue=Sum('total_price', filter=paid, default=Decimal('0')),
+            ).order_by('event_date__date', 'event_date__time')
+
+        return Response(response_data)
+
+    @action(detail=False, methods=['get'])
+    def analytics(self, request):
+        """
+        Sales over time for event planners, read from the sales rollups only
+
+        ``group_by`` is ``day`` (default), ``event`` or ``event_date``.
+        Optional filters: ``start_date``/``end_date`` (YYYY-MM-DD, day of sale
+        or refund) and ``event_id``.
+        """
+        if not hasattr(request.user, 'planner_profile'):
+            return Response(
+                {"status": "error", "detail": "Only event planners can access sales analytics"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        group_by = request.query_params.get('group_by', 'day')
+        if group_by not in ANALYTICS_GROUPS:
+            return Response(
+                {"status": "error", "detail": f"group_by must be one of: {', '.join(ANALYTICS_GROUPS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        rollups = SalesRollup.objects.filter(planner=request.user.planner_profile)
+        start_date = self._get_date_param('start_date')
+        end_date = self._get_date_param('end_date')
+        if start_date:
+            rollups = rollups.filter(day__gte=start_date)
+        if end_date:
+            rollups = rollups.filter(day__lte=end_date)
+        if request.query_params.get('event_id'):
+            try:
+                rollups = rollups.filter(event_id=request.query_params['event_id'])
+            except (ValueError, DjangoValidationError):
+                return Response(
+                    {"status": "error", "detail": "Invalid event_id"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        sums = {
+            'orders': Sum('orders', default=0),
+            'tickets': Sum('tickets', default=0),
+            'revenue': Sum('revenue', default=Decimal('0')),
+            'service_fees': Sum('service_fees', default=Decimal('0')),
+            'refunded_tickets': Sum('refunded_tickets', default=0),
+            'refunds': Sum('refunds', default=Decimal('0')),
+        }
+        fields = ANALYTICS_GROUPS[group_by]
+        results = rollups.values(*fields).annotate(**sums).order_by(*fields)
+
+        return Response({
+            "group_by": group_by,
+            "totals": rollups.aggregate(**sums),
+            "results": results,
         })
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream the planner's tickets and attendees as CSV or NDJSON
+
+        ``output`` is ``csv`` (default) or ``ndjson``. Optional filters:
+        ``event_id``, ``date_id`` and ``status`` (comma separated).
+        """
+        if not hasattr(request.user, 'planner_profile'):
+            return Response(
+                {"status": "error", "detail": "Only event planners can export tickets"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        export_format = request.query_params.get('output', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {"status": "error", "detail": f"output must be one of: {', '.join(EXPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        queryset = Ticket.objects.filter(event__planner=request.user.planner_profile)
+        try:
+            if request.query_params.get('event_id'):
+                queryset = queryset.filter(event_id=request.query_params['event_id'])
+            if request.query_params.get('date_id'):
+                queryset = queryset.filter(event_date_id=request.query_params['date_id'])
+        except (ValueError, DjangoValidationError):
+            return Response(
+                {"status": "error", "detail": "Invalid event_id or date_id"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if request.query_params.get('status'):
+            queryset = queryset.filter(status__in=request.query_params['status'].upper().split(','))
+
+        return streaming_export(
+            request._request,
+            queryset.order_by('event_date__date', 'event_date__time', 'created_at'),
+            export_format,
+            filename=f"tickets-{date.today().isoformat()}",
+        )
+
+    def _get_date_param(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise serializers.ValidationError({name: "Must be a date in YYYY-MM-DD format"})